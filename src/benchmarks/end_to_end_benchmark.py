@@ -0,0 +1,141 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+from src.benchmarks.fake_graph import FakeGraphServer
+from src.benchmarks.synthetic_confirmation import build_confirmation_pdf
+from src.config import (
+    DEFAULT_FROM_ADDRESS,
+    INCOMING_RESERVATION_PREFIX,
+    MONITORED_EMAIL_ADDRESS,
+    ORIGINAL_FOLDER,
+    REDACTED_FOLDER,
+    SHAREPOINT_FOLDER_PATH,
+)
+
+DEFAULT_MESSAGES = 100
+DEFAULT_PAGES = 3
+DEFAULT_DATES = 10
+
+
+def seed_backlog(
+    server: FakeGraphServer, num_messages: int, pages: int, dates: int
+) -> None:
+    """Unread reservation confirmations, each with its own booking id."""
+    for folder in (ORIGINAL_FOLDER, REDACTED_FOLDER):
+        server.state.ensure_folder(f"{SHAREPOINT_FOLDER_PATH}/{folder}")
+    for i in range(num_messages):
+        booking_id = str(100000 + i)
+        server.state.add_message(
+            MONITORED_EMAIL_ADDRESS,
+            subject=f"{INCOMING_RESERVATION_PREFIX} {booking_id}",
+            sender=DEFAULT_FROM_ADDRESS,
+            attachments=[
+                (
+                    f"{booking_id}.pdf",
+                    build_confirmation_pdf(
+                        booking_id=booking_id, num_pages=pages, num_dates=dates
+                    ),
+                )
+            ],
+        )
+
+
+def run_backlog(server: FakeGraphServer) -> float:
+    # imported late, the orchestrator sets the locale and reads the environment
+    from src.orchestrator import GRAPH_STAND_IN_URL_ENV_VAR, Orchestrator
+
+    os.environ[GRAPH_STAND_IN_URL_ENV_VAR] = server.url
+    working_dir = os.getcwd()
+    # the parse memo and the other state files are relative to the working
+    # directory, a fresh one keeps earlier runs from skipping the backlog
+    with tempfile.TemporaryDirectory() as state_dir:
+        os.chdir(state_dir)
+        try:
+            orchestrator = Orchestrator()
+            start = time.perf_counter()
+            orchestrator.process_incoming_emails()
+            return time.perf_counter() - start
+        finally:
+            os.chdir(working_dir)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Processes a backlog of synthetic reservation messages against the local Graph
+    stand-in and reports the wall time and the Graph round-trips per route.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES)
+    parser.add_argument("--dates", type=int, default=DEFAULT_DATES)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    server = FakeGraphServer(
+        latency_seconds=args.latency, failure_rate=args.failure_rate, seed=args.seed
+    )
+    server.start()
+    try:
+        seed_backlog(server, args.messages, args.pages, args.dates)
+        wall_seconds = run_backlog(server)
+    finally:
+        server.stop()
+
+    counts: Dict[str, int] = dict(server.request_counts.most_common())
+    batched_counts: Dict[str, int] = dict(server.batched_counts.most_common())
+    unread = sum(
+        not message["isRead"]
+        for message in server.state.messages.get(MONITORED_EMAIL_ADDRESS, {}).values()
+        if not message["isDraft"]
+    )
+    uploaded = sum("file" in item for item in server.state.items.values())
+    print(
+        f"\n{args.messages} messages in {wall_seconds:.2f} s "
+        f"({args.messages / wall_seconds:.1f} messages/s), "
+        f"{server.total_requests()} Graph requests "
+        f"({server.total_requests() / args.messages:.1f} per message)"
+    )
+    print(
+        f"  {uploaded} files uploaded, {len(server.state.sent)} mails sent, "
+        f"{unread} messages left unread"
+    )
+    print(
+        f"  {server.bytes_received / 1e6:.1f} MB sent to Graph, "
+        f"{server.bytes_sent / 1e6:.1f} MB received"
+    )
+    for route, count in counts.items():
+        print(f"  {route:<28}{count:>7}")
+    for route, count in batched_counts.items():
+        print(f"  {'batched ' + route:<28}{count:>7}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "messages": args.messages,
+                    "wall_seconds": wall_seconds,
+                    "requests": server.total_requests(),
+                    "requests_per_route": counts,
+                    "batched_requests_per_route": batched_counts,
+                    "bytes_to_graph": server.bytes_received,
+                    "bytes_from_graph": server.bytes_sent,
+                    "files_uploaded": uploaded,
+                    "mails_sent": len(server.state.sent),
+                    "unread_left": unread,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,917 @@
+import argparse
+import base64
+import datetime as dt
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple, Type
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlparse
+
+API_VERSION = "v1.0"
+DRIVE_ID = "stand-in-drive"
+ROOT_ITEM_ID = "root"
+DEFAULT_PAGE_SIZE = 10
+MAX_BODY_BYTES = 64 * 1024 * 1024
+MAX_BATCH_REQUESTS = 20
+
+MULTIPLE_SLASHES = re.compile(r"/{2,}")
+# drive endpoints O365 builds relative to the site, the stand-in has a single drive
+SITE_DRIVE_PREFIX = re.compile(
+    rf"^/{API_VERSION}(?:/sites/[^/]+)?/drives?(?=[/:])(?:/(?!items\b|root\b)[^/:]+)?"
+)
+FILTER_IS_UNREAD = re.compile(r"isRead eq false")
+
+JsonDict = Dict[str, Any]
+
+
+class GraphError(Exception):
+    def __init__(self, status: int, code: str, message: str = "") -> None:
+        super().__init__(message or code)
+        self.status = status
+        self.code = code
+
+
+def _now() -> str:
+    return dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex
+
+
+class FakeGraphState:
+    """
+    In-memory mailboxes, drive and subscriptions behind the stand-in. Only the
+    parts of Graph this project uses are modelled.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        # mailbox address -> message id -> message
+        self.messages: Dict[str, Dict[str, JsonDict]] = {}
+        self.attachments: Dict[str, List[JsonDict]] = {}
+        self.sent: List[JsonDict] = []
+        self.items: Dict[str, JsonDict] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.upload_sessions: Dict[str, JsonDict] = {}
+        self.subscriptions: Dict[str, JsonDict] = {}
+        self.change_counter = 0
+        self.items[ROOT_ITEM_ID] = self._folder_item(ROOT_ITEM_ID, "root", None)
+
+    # mail
+
+    def add_message(
+        self,
+        mailbox: str,
+        subject: str,
+        sender: str,
+        body: str = "",
+        attachments: Optional[List[Tuple[str, bytes]]] = None,
+        folder: str = "Inbox",
+    ) -> str:
+        with self.lock:
+            message_id = _new_id()
+            address = {"emailAddress": {"address": sender, "name": sender}}
+            self.change_counter += 1
+            self.messages.setdefault(mailbox.lower(), {})[message_id] = {
+                "id": message_id,
+                "subject": subject,
+                "sender": address,
+                "from": address,
+                "toRecipients": [{"emailAddress": {"address": mailbox}}],
+                "isRead": False,
+                "isDraft": False,
+                "hasAttachments": bool(attachments),
+                "receivedDateTime": _now(),
+                "body": {"contentType": "html", "content": body},
+                "parentFolderId": folder,
+                "_version": self.change_counter,
+            }
+            self.attachments[message_id] = [
+                self._file_attachment(name, content)
+                for name, content in attachments or []
+            ]
+            return message_id
+
+    def _file_attachment(self, name: str, content: bytes) -> JsonDict:
+        return {
+            "@odata.type": "#microsoft.graph.fileAttachment",
+            "id": _new_id(),
+            "name": name,
+            "contentType": "application/pdf",
+            "size": len(content),
+            "isInline": False,
+            "contentBytes": base64.b64encode(content).decode("ascii"),
+        }
+
+    def get_message(self, mailbox: str, message_id: str) -> JsonDict:
+        message = self.messages.get(mailbox.lower(), {}).get(message_id)
+        if message is None:
+            raise GraphError(404, "ErrorItemNotFound")
+        return message
+
+    def update_message(self, mailbox: str, message_id: str, data: JsonDict) -> JsonDict:
+        with self.lock:
+            message = self.get_message(mailbox, message_id)
+            message.update({k: v for k, v in data.items() if not k.startswith("@")})
+            self.change_counter += 1
+            message["_version"] = self.change_counter
+            return message
+
+    # drive
+
+    def _folder_item(
+        self, item_id: str, name: str, parent_id: Optional[str]
+    ) -> JsonDict:
+        item: JsonDict = {
+            "id": item_id,
+            "name": name,
+            "createdDateTime": _now(),
+            "lastModifiedDateTime": _now(),
+            "size": 0,
+            "folder": {"childCount": 0},
+        }
+        if parent_id is not None:
+            item["parentReference"] = {"driveId": DRIVE_ID, "id": parent_id}
+        return item
+
+    def children(self, parent_id: str) -> List[JsonDict]:
+        return [
+            item
+            for item in self.items.values()
+            if item.get("parentReference", {}).get("id") == parent_id
+        ]
+
+    def child_by_name(self, parent_id: str, name: str) -> Optional[JsonDict]:
+        for item in self.children(parent_id):
+            if item["name"].lower() == name.lower():
+                return item
+        return None
+
+    def item_by_path(self, path: str) -> JsonDict:
+        item = self.items[ROOT_ITEM_ID]
+        for part in [p for p in path.split("/") if p]:
+            child = self.child_by_name(item["id"], part)
+            if child is None:
+                raise GraphError(404, "itemNotFound", f"{path} not found")
+            item = child
+        return item
+
+    def ensure_folder(self, path: str) -> JsonDict:
+        with self.lock:
+            item = self.items[ROOT_ITEM_ID]
+            for part in [p for p in path.split("/") if p]:
+                child = self.child_by_name(item["id"], part)
+                if child is None:
+                    child = self.create_folder(item["id"], part)
+                item = child
+            return item
+
+    def create_folder(self, parent_id: str, name: str) -> JsonDict:
+        with self.lock:
+            if self.child_by_name(parent_id, name) is not None:
+                raise GraphError(409, "nameAlreadyExists")
+            item = self._folder_item(_new_id(), name, parent_id)
+            self.items[item["id"]] = item
+            return item
+
+    def put_file(self, parent_id: str, name: str, content: bytes) -> JsonDict:
+        with self.lock:
+            if parent_id not in self.items:
+                raise GraphError(404, "itemNotFound")
+            item = self.child_by_name(parent_id, name)
+            if item is None:
+                item = {
+                    "id": _new_id(),
+                    "name": name,
+                    "createdDateTime": _now(),
+                    "parentReference": {"driveId": DRIVE_ID, "id": parent_id},
+                    "file": {"mimeType": "application/octet-stream", "hashes": {}},
+                }
+                self.items[item["id"]] = item
+            item["size"] = len(content)
+            item["lastModifiedDateTime"] = _now()
+            self.contents[item["id"]] = content
+            return item
+
+
+Route = Tuple[str, Pattern[str], Callable[..., Tuple[int, Any]]]
+
+
+class FakeGraphServer:
+    """
+    Local HTTP stand-in for the Graph endpoints this project calls: mailbox
+    messages, attachments, sendMail, forwards and drafts, the SharePoint site and
+    drive with folder listings, simple and session uploads and downloads, and
+    subscriptions. Every request is delayed by `latency_seconds` and fails with
+    `failure_status` with probability `failure_rate`. Requests are counted per
+    route in `request_counts`.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_seconds: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.state = FakeGraphState()
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.page_size = page_size
+        self.request_counts: "Counter[str]" = Counter()
+        # requests inside $batch calls, the calls themselves are in request_counts
+        self.batched_counts: "Counter[str]" = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        # total size of each upload session, announced by the Content-Range of its chunks
+        self._pending_sizes: Dict[str, int] = {}
+        self._counts_lock = threading.Lock()
+        self._routes = self._build_routes()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-graph", daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    def start(self) -> None:
+        self._thread.start()
+        logging.info(f"... Graph stand-in listening on {self.url}")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self) -> None:
+        with self._counts_lock:
+            self.request_counts.clear()
+            self.batched_counts.clear()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def total_requests(self) -> int:
+        return sum(self.request_counts.values())
+
+    # routing
+
+    def _build_routes(self) -> List[Route]:
+        mailbox = r"/users/(?P<mailbox>[^/]+)"
+        message = mailbox + r"/messages/(?P<message_id>[^/]+)"
+        drive_item = r"/drives/[^/]+/items/(?P<item_id>[^/:]+)"
+        routes: List[Tuple[str, str, Callable[..., Tuple[int, Any]]]] = [
+            (
+                "GET",
+                mailbox + r"/mailFolders/(?P<folder>[^/]+)/messages/delta",
+                self._delta,
+            ),
+            (
+                "GET",
+                mailbox + r"/mailFolders/(?P<folder>[^/]+)/messages",
+                self._list_messages,
+            ),
+            (
+                "POST",
+                mailbox + r"/mailFolders/(?P<folder>[^/]+)/messages",
+                self._create_draft,
+            ),
+            ("POST", mailbox + r"/messages", self._create_draft),
+            ("POST", mailbox + r"/sendMail", self._send_mail),
+            ("GET", message + r"/attachments", self._list_attachments),
+            (
+                "POST",
+                message + r"/attachments/createUploadSession",
+                self._create_attachment_session,
+            ),
+            ("POST", message + r"/attachments", self._add_attachment),
+            ("POST", message + r"/createForward", self._create_forward),
+            ("POST", message + r"/forward", self._forward),
+            ("POST", message + r"/send", self._send_draft),
+            ("GET", message, self._get_message),
+            ("PATCH", message, self._patch_message),
+            ("GET", r"/sites/(?P<site_id>[^/]+)/drive", self._get_drive),
+            ("GET", r"/sites/(?P<site_id>[^/]+)", self._get_site),
+            ("GET", r"/drives/[^/]+/root:(?P<path>.*?):?", self._get_item_by_path),
+            ("GET", drive_item + r"/children", self._list_children),
+            ("POST", drive_item + r"/children", self._create_child_folder),
+            ("PUT", drive_item + r":/(?P<name>[^/]+):/content", self._simple_upload),
+            (
+                "POST",
+                drive_item + r":/(?P<name>[^/]+):/createUploadSession",
+                self._create_upload_session,
+            ),
+            ("GET", drive_item + r"/content", self._download),
+            ("POST", drive_item + r"/createLink", self._create_link),
+            ("GET", drive_item, self._get_item),
+            ("POST", r"/\$batch", self._batch),
+            ("POST", r"/subscriptions", self._create_subscription),
+            (
+                "PATCH",
+                r"/subscriptions/(?P<subscription_id>[^/]+)",
+                self._renew_subscription,
+            ),
+            (
+                "DELETE",
+                r"/subscriptions/(?P<subscription_id>[^/]+)",
+                self._delete_subscription,
+            ),
+        ]
+        return [
+            (method, re.compile(f"/{API_VERSION}{pattern}"), handler)
+            for method, pattern, handler in routes
+        ]
+
+    def _batch(self, query: Dict[str, List[str]], body: bytes) -> Tuple[int, Any]:
+        requests = _json(body).get("requests", [])
+        if not isinstance(requests, list) or len(requests) > MAX_BATCH_REQUESTS:
+            raise GraphError(400, "BadRequest", "invalid number of batch requests")
+        return 200, {
+            "responses": [
+                {"id": request["id"], **self._batched_response(request)}
+                for request in requests
+            ]
+        }
+
+    def _batched_response(self, request: JsonDict) -> JsonDict:
+        """Each request of a batch can fail on its own, like on Graph."""
+        if self._random.random() < self.failure_rate:
+            return {
+                "status": self.failure_status,
+                "headers": {"Retry-After": "0"},
+                "body": {"error": {"code": "serviceNotAvailable"}},
+            }
+        parsed = urlparse(str(request["url"]))
+        body = json.dumps(request["body"]).encode() if "body" in request else b""
+        try:
+            status, payload, route = self.dispatch(
+                str(request["method"]),
+                f"/{API_VERSION}{unquote(parsed.path)}",
+                parse_qs(parsed.query),
+                body,
+            )
+        except GraphError as e:
+            return {"status": e.status, "body": {"error": {"code": e.code}}}
+        except (ValueError, KeyError) as e:
+            return {
+                "status": 400,
+                "body": {"error": {"code": "BadRequest", "message": str(e)}},
+            }
+        with self._counts_lock:
+            self.batched_counts[route] += 1
+        if isinstance(payload, bytes):
+            payload = None
+        return {"status": status, "body": _public(payload)}
+
+    def dispatch(
+        self, method: str, path: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any, str]:
+        """Returns status, payload and the route name the request was counted under."""
+        path = SITE_DRIVE_PREFIX.sub(
+            f"/{API_VERSION}/drives/{DRIVE_ID}", MULTIPLE_SLASHES.sub("/", path)
+        )
+        if path.startswith("/_upload/"):
+            return (*self._upload_chunk(path[len("/_upload/") :], body), "upload_chunk")
+        for route_method, pattern, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            params = {k: unquote(v) for k, v in match.groupdict().items()}
+            status, payload = handler(query=query, body=body, **params)
+            return status, payload, handler.__name__.lstrip("_")
+        raise GraphError(
+            400, "BadRequest", f"stand-in has no route for {method} {path}"
+        )
+
+    # mail handlers
+
+    def _list_messages(
+        self, mailbox: str, folder: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        messages = [
+            m
+            for m in self.state.messages.get(mailbox.lower(), {}).values()
+            if m["parentFolderId"].lower() == folder.lower() and not m["isDraft"]
+        ]
+        odata_filter = _first(query, "$filter")
+        if odata_filter:
+            messages = [m for m in messages if _matches_filter(m, odata_filter)]
+        messages.sort(key=lambda m: m["receivedDateTime"])
+        top = int(_first(query, "$top") or self.page_size)
+        skip = int(_first(query, "$skip") or 0)
+        page = messages[skip : skip + top]
+        result: JsonDict = {
+            "value": [_select(m, _first(query, "$select")) for m in page]
+        }
+        if skip + top < len(messages):
+            next_query = {k: v[0] for k, v in query.items()}
+            next_query["$skip"] = str(skip + top)
+            result["@odata.nextLink"] = (
+                f"{self.url}/{API_VERSION}/users/{quote(mailbox)}/mailFolders/{folder}/messages?"
+                + urlencode(next_query)
+            )
+        return 200, result
+
+    def _delta(
+        self, mailbox: str, folder: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        since = int(_first(query, "$deltatoken") or 0)
+        skip = int(_first(query, "$skiptoken") or 0)
+        changed = sorted(
+            (
+                m
+                for m in self.state.messages.get(mailbox.lower(), {}).values()
+                if m["parentFolderId"].lower() == folder.lower()
+                and not m["isDraft"]
+                and m["_version"] > since
+            ),
+            key=lambda m: m["_version"],
+        )
+        select = _first(query, "$select")
+        page = changed[skip : skip + self.page_size]
+        base = f"{self.url}/{API_VERSION}/users/{quote(mailbox)}/mailFolders/{folder}/messages/delta"
+        result: JsonDict = {"value": [_select(m, select) for m in page]}
+        next_query = {"$deltatoken": str(since)}
+        if select:
+            next_query["$select"] = select
+        if skip + self.page_size < len(changed):
+            next_query["$skiptoken"] = str(skip + self.page_size)
+            result["@odata.nextLink"] = base + "?" + urlencode(next_query)
+        else:
+            next_query["$deltatoken"] = str(self.state.change_counter)
+            result["@odata.deltaLink"] = base + "?" + urlencode(next_query)
+        return 200, result
+
+    def _get_message(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        message = self.state.get_message(mailbox, message_id)
+        return 200, _select(message, _first(query, "$select"))
+
+    def _patch_message(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        return 200, _public(self.state.update_message(mailbox, message_id, _json(body)))
+
+    def _list_attachments(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        self.state.get_message(mailbox, message_id)
+        return 200, {"value": self.state.attachments.get(message_id, [])}
+
+    def _add_attachment(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        self.state.get_message(mailbox, message_id)
+        attachment = dict(_json(body), id=_new_id())
+        with self.state.lock:
+            self.state.attachments.setdefault(message_id, []).append(attachment)
+        return 201, attachment
+
+    def _create_attachment_session(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        self.state.get_message(mailbox, message_id)
+        info = (
+            _json(body).get("AttachmentItem") or _json(body).get("attachmentItem") or {}
+        )
+        return 201, self._new_upload_session(
+            {
+                "kind": "attachment",
+                "message_id": message_id,
+                "name": info.get("name", "attachment"),
+            }
+        )
+
+    def _create_draft(
+        self,
+        mailbox: str,
+        query: Dict[str, List[str]],
+        body: bytes,
+        folder: str = "Drafts",
+    ) -> Tuple[int, Any]:
+        data = _json(body)
+        sender = (
+            (data.get("from") or {}).get("emailAddress", {}).get("address", mailbox)
+        )
+        attachments = data.pop("attachments", [])
+        message_id = self.state.add_message(
+            mailbox, data.get("subject", ""), sender, folder=folder
+        )
+        message = self.state.update_message(
+            mailbox, message_id, dict(data, isDraft=True)
+        )
+        with self.state.lock:
+            self.state.attachments[message_id] = [
+                dict(a, id=_new_id()) for a in attachments
+            ]
+        return 201, _public(message)
+
+    def _create_forward(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        original = self.state.get_message(mailbox, message_id)
+        forward_id = self.state.add_message(
+            mailbox,
+            "FW: " + original["subject"],
+            mailbox,
+            body=original["body"]["content"],
+            folder="Drafts",
+        )
+        forward = self.state.update_message(mailbox, forward_id, {"isDraft": True})
+        with self.state.lock:
+            self.state.attachments[forward_id] = list(
+                self.state.attachments.get(message_id, [])
+            )
+        return 201, _public(forward)
+
+    def _forward(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        data = _json(body)
+        original = self.state.get_message(mailbox, message_id)
+        forward = dict(
+            data.get("message") or {},
+            body={
+                "contentType": "html",
+                "content": data.get("comment", "") + original["body"]["content"],
+            },
+        )
+        forward.setdefault("subject", "FW: " + original["subject"])
+        with self.state.lock:
+            forward["attachments"] = list(self.state.attachments.get(message_id, []))
+            self.state.sent.append(forward)
+        return 202, None
+
+    def _send_draft(
+        self, mailbox: str, message_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        with self.state.lock:
+            message = self.state.messages.get(mailbox.lower(), {}).pop(message_id, None)
+            if message is None:
+                raise GraphError(404, "ErrorItemNotFound")
+            message["attachments"] = self.state.attachments.pop(message_id, [])
+            self.state.sent.append(_public(message))
+        return 202, None
+
+    def _send_mail(
+        self, mailbox: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        message = _json(body).get("message", {})
+        with self.state.lock:
+            self.state.sent.append(message)
+        return 202, None
+
+    # drive handlers
+
+    def _get_site(
+        self, site_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        return 200, {
+            "id": site_id,
+            "displayName": "Stand-in site",
+            "name": site_id,
+            "webUrl": f"{self.url}/sites/{site_id}",
+        }
+
+    def _get_drive(
+        self, site_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        return 200, {
+            "id": DRIVE_ID,
+            "name": "Documents",
+            "driveType": "documentLibrary",
+        }
+
+    def _get_item_by_path(
+        self, path: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        return 200, self.state.item_by_path(path)
+
+    def _get_item(
+        self, item_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        item = self.state.items.get(item_id)
+        if item is None:
+            raise GraphError(404, "itemNotFound")
+        return 200, item
+
+    def _list_children(
+        self, item_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        if item_id not in self.state.items:
+            raise GraphError(404, "itemNotFound")
+        return 200, {"value": self.state.children(item_id)}
+
+    def _create_child_folder(
+        self, item_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        return 201, self.state.create_folder(item_id, str(_json(body)["name"]))
+
+    def _simple_upload(
+        self, item_id: str, name: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        return 201, self.state.put_file(item_id, name, body)
+
+    def _create_upload_session(
+        self, item_id: str, name: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        if item_id not in self.state.items:
+            raise GraphError(404, "itemNotFound")
+        return 200, self._new_upload_session(
+            {"kind": "drive", "parent_id": item_id, "name": name}
+        )
+
+    def _create_link(
+        self, item_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        if item_id not in self.state.items:
+            raise GraphError(404, "itemNotFound")
+        request = _json(body)
+        return 200, {
+            "id": f"link-{item_id}",
+            "roles": ["read" if request.get("type") == "view" else "write"],
+            "expirationDateTime": request.get("expirationDateTime"),
+            "link": {
+                "type": request.get("type"),
+                "scope": request.get("scope"),
+                "webUrl": f"https://stand-in.invalid/s/{quote(item_id)}",
+            },
+        }
+
+    def _download(
+        self, item_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        content = self.state.contents.get(item_id)
+        if content is None:
+            raise GraphError(404, "itemNotFound")
+        return 200, content
+
+    def _new_upload_session(self, session: JsonDict) -> JsonDict:
+        session_id = _new_id()
+        with self.state.lock:
+            self.state.upload_sessions[session_id] = dict(session, chunks=[])
+        return {
+            "uploadUrl": f"{self.url}/_upload/{session_id}",
+            "expirationDateTime": (
+                dt.datetime.now(dt.timezone.utc) + dt.timedelta(hours=1)
+            ).isoformat(),
+        }
+
+    def _upload_chunk(self, session_id: str, body: bytes) -> Tuple[int, Any]:
+        # chunks are expected in order, the Content-Range header is not checked
+        with self.state.lock:
+            session = self.state.upload_sessions.get(session_id)
+            if session is None:
+                raise GraphError(404, "itemNotFound")
+            session["chunks"].append(body)
+            total = self._pending_sizes.get(session_id)
+        if total is not None and sum(len(c) for c in session["chunks"]) < total:
+            return 202, {
+                "nextExpectedRanges": [f"{sum(len(c) for c in session['chunks'])}-"]
+            }
+        content = b"".join(session["chunks"])
+        with self.state.lock:
+            del self.state.upload_sessions[session_id]
+            self._pending_sizes.pop(session_id, None)
+        if session["kind"] == "drive":
+            return 201, self.state.put_file(
+                session["parent_id"], session["name"], content
+            )
+        attachment = self.state._file_attachment(session["name"], content)
+        with self.state.lock:
+            self.state.attachments.setdefault(session["message_id"], []).append(
+                attachment
+            )
+        return 201, {}
+
+    # subscriptions
+
+    def _create_subscription(
+        self, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        subscription = dict(_json(body), id=_new_id())
+        with self.state.lock:
+            self.state.subscriptions[subscription["id"]] = subscription
+        return 201, subscription
+
+    def _renew_subscription(
+        self, subscription_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        subscription = self.state.subscriptions.get(subscription_id)
+        if subscription is None:
+            raise GraphError(404, "ResourceNotFound")
+        subscription.update(_json(body))
+        return 200, subscription
+
+    def _delete_subscription(
+        self, subscription_id: str, query: Dict[str, List[str]], body: bytes
+    ) -> Tuple[int, Any]:
+        with self.state.lock:
+            self.state.subscriptions.pop(subscription_id, None)
+        return 204, None
+
+    # http
+
+    def _make_handler(self) -> Type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                self._handle("GET")
+
+            def do_POST(self) -> None:
+                self._handle("POST")
+
+            def do_PUT(self) -> None:
+                self._handle("PUT")
+
+            def do_PATCH(self) -> None:
+                self._handle("PATCH")
+
+            def do_DELETE(self) -> None:
+                self._handle("DELETE")
+
+            def _handle(self, method: str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY_BYTES:
+                    self._respond(
+                        "error", 0, 413, {"error": {"code": "RequestTooLarge"}}
+                    )
+                    return
+                body = self.rfile.read(length) if length else b""
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                if server.latency_seconds:
+                    time.sleep(server.latency_seconds)
+                if server._random.random() < server.failure_rate:
+                    self._respond(
+                        "injected_failure",
+                        len(body),
+                        server.failure_status,
+                        {
+                            "error": {
+                                "code": "serviceNotAvailable",
+                                "message": "injected failure",
+                            }
+                        },
+                        {"Retry-After": "0"},
+                    )
+                    return
+                if parsed.path.startswith("/_upload/"):
+                    content_range = self.headers.get("Content-Range", "")
+                    total = content_range.rsplit("/", 1)[-1]
+                    if total.isdigit():
+                        server._pending_sizes[parsed.path[len("/_upload/") :]] = int(
+                            total
+                        )
+                try:
+                    status, payload, route = server.dispatch(
+                        method, unquote(parsed.path), query, body
+                    )
+                except GraphError as e:
+                    self._respond(
+                        "error",
+                        len(body),
+                        e.status,
+                        {"error": {"code": e.code, "message": str(e)}},
+                    )
+                    return
+                except (ValueError, KeyError) as e:
+                    self._respond(
+                        "error",
+                        len(body),
+                        400,
+                        {"error": {"code": "BadRequest", "message": str(e)}},
+                    )
+                    return
+                self._respond(route, len(body), status, payload)
+
+            def _respond(
+                self,
+                route: str,
+                received: int,
+                status: int,
+                payload: Any,
+                headers: Optional[Dict[str, str]] = None,
+            ) -> None:
+                if payload is None:
+                    encoded = b""
+                    content_type = "text/plain"
+                elif isinstance(payload, bytes):
+                    encoded = payload
+                    content_type = "application/octet-stream"
+                else:
+                    encoded = json.dumps(_public(payload)).encode("utf-8")
+                    content_type = "application/json"
+                # counted before the client can see the response
+                server._count(route, received, len(encoded))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(encoded)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug(format % args)
+
+        return Handler
+
+    def _count(self, route: str, received: int, sent: int) -> None:
+        with self._counts_lock:
+            self.request_counts[route] += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+
+def _first(query: Dict[str, List[str]], key: str) -> Optional[str]:
+    values = query.get(key)
+    return values[0] if values else None
+
+
+def _json(body: bytes) -> JsonDict:
+    if not body:
+        return {}
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("expected a json object")
+    return data
+
+
+def _public(data: Any) -> Any:
+    if isinstance(data, dict):
+        return {k: _public(v) for k, v in data.items() if not k.startswith("_")}
+    if isinstance(data, list):
+        return [_public(v) for v in data]
+    return data
+
+
+def _select(message: JsonDict, select: Optional[str]) -> JsonDict:
+    public: JsonDict = _public(message)
+    if not select:
+        return public
+    fields = {"id", *select.split(",")}
+    return {k: v for k, v in public.items() if k in fields}
+
+
+def _matches_filter(message: JsonDict, odata_filter: str) -> bool:
+    """Understands the filters build_unread_messages_query builds, ignores other clauses."""
+    return not (FILTER_IS_UNREAD.search(odata_filter) and message["isRead"])
+
+
+def main() -> None:
+    """Serves the Graph stand-in until interrupted."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="share of requests answered with --failure-status",
+    )
+    parser.add_argument("--failure-status", type=int, default=503)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = FakeGraphServer(
+        host=args.host,
+        port=args.port,
+        latency_seconds=args.latency,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+    )
+    server.start()
+    print(
+        f"Graph stand-in at {server.url}, set HALLENRESERVATION_GRAPH_URL={server.url}"
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
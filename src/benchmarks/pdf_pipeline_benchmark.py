@@ -0,0 +1,188 @@
+import argparse
+import base64
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, cast
+from O365.account import Account
+from O365.message import Message
+from src.benchmarks.synthetic_confirmation import build_confirmation_pdf
+from src.email.email_processors.reservation_email_processor import (
+    ReservationEmailProcessor,
+)
+from src.utils.pdf_text_cache import CachedPdfDocument
+from src.utils.typed_pymupdf import _open_pdf_from_bytes
+
+DEFAULT_PAGES = [1, 3, 8]
+DEFAULT_DATES = [1, 10, 40]
+DEFAULT_ITERATIONS = 20
+DEFAULT_WARMUP = 2
+
+
+@dataclass
+class StageStats:
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+
+    @classmethod
+    def from_durations(cls, durations: List[float]) -> "StageStats":
+        ordered = sorted(durations)
+        return cls(
+            mean_ms=1000 * sum(ordered) / len(ordered),
+            p50_ms=1000 * _percentile(ordered, 0.5),
+            p95_ms=1000 * _percentile(ordered, 0.95),
+            max_ms=1000 * ordered[-1],
+        )
+
+
+@dataclass
+class ScenarioResult:
+    pages: int
+    dates: int
+    iterations: int
+    docs_per_second: float
+    latency: StageStats
+    stages: Dict[str, StageStats] = field(default_factory=dict)
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.durations: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        self.durations.setdefault(name, []).append(time.perf_counter() - start)
+
+
+def run_pipeline_once(
+    processor: ReservationEmailProcessor, encoded_pdf: str, timer: StageTimer
+) -> None:
+    """The PDF stages of `process_attachment`, without any Graph calls."""
+    with timer.stage("decode"):
+        content = base64.b64decode(encoded_pdf)
+    with timer.stage("open"):
+        pdf_doc = CachedPdfDocument(_open_pdf_from_bytes(content))
+    with timer.stage("determine_pdf_cutoff"):
+        cutoff_page_num = processor.determine_pdf_cutoff(pdf_doc)
+    if cutoff_page_num is None:
+        raise RuntimeError("The synthetic confirmation has no page number")
+    with timer.stage("cut_pdf_after_page_n"):
+        processor.cut_pdf_after_page_n(pdf_doc, cutoff_page_num)
+    with timer.stage("read_pdf"):
+        pdf_text = processor.read_pdf(pdf_doc)
+    with timer.stage("find"):
+        metas = processor.find_attachment_meta.find(pdf_text)
+    with timer.stage("signature"):
+        pdf_doc.signature_hash()
+    with timer.stage("tobytes_original"):
+        pdf_doc.tobytes()
+    with timer.stage("redact_and_highlight_pdf"):
+        processor.redact_and_highlight_pdf(
+            pdf_doc,
+            strings_to_redact=metas[0].sensitive_content,
+            strings_to_highlight=metas[0].locations,
+        )
+    with timer.stage("tobytes_redacted"):
+        pdf_doc.tobytes()
+
+
+def run_scenario(
+    processor: ReservationEmailProcessor,
+    pages: int,
+    dates: int,
+    iterations: int,
+    warmup: int,
+) -> ScenarioResult:
+    encoded_pdf = base64.b64encode(
+        build_confirmation_pdf(booking_id="4711", num_pages=pages, num_dates=dates)
+    ).decode("ascii")
+    for _ in range(warmup):
+        run_pipeline_once(processor, encoded_pdf, StageTimer())
+    timer = StageTimer()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run_pipeline_once(processor, encoded_pdf, timer)
+        latencies.append(time.perf_counter() - start)
+    return ScenarioResult(
+        pages=pages,
+        dates=dates,
+        iterations=iterations,
+        docs_per_second=iterations / sum(latencies),
+        latency=StageStats.from_durations(latencies),
+        stages={
+            name: StageStats.from_durations(durations)
+            for name, durations in timer.durations.items()
+        },
+    )
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def print_result(result: ScenarioResult) -> None:
+    print(
+        f"\n{result.pages} pages, {result.dates} dates: "
+        f"{result.docs_per_second:.1f} docs/s, "
+        f"latency p50 {result.latency.p50_ms:.1f} ms, p95 {result.latency.p95_ms:.1f} ms"
+    )
+    print(f"  {'stage':<26}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+    for name, stats in result.stages.items():
+        print(
+            f"  {name:<26}{stats.mean_ms:>9.2f}{stats.p50_ms:>9.2f}"
+            f"{stats.p95_ms:>9.2f}{stats.max_ms:>9.2f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Times the reservation PDF pipeline on synthetic booking confirmations."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES)
+    parser.add_argument("--dates", type=int, nargs="+", default=DEFAULT_DATES)
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    # the stages don't touch the account or the message, they are never used online
+    processor = ReservationEmailProcessor(
+        message=cast(Message, None), account=Account(("benchmark", "benchmark"))
+    )
+    results = [
+        run_scenario(processor, pages, dates, args.iterations, args.warmup)
+        for pages in args.pages
+        for dates in args.dates
+    ]
+    for result in results:
+        print_result(result)
+    rss = peak_rss_mb()
+    print(f"\npeak RSS: {rss:.1f} MB")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "peak_rss_mb": rss,
+                    "scenarios": [asdict(result) for result in results],
+                },
+                f,
+                indent=2,
+            )
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+if __name__ == "__main__":
+    main()
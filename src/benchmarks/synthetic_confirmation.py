@@ -0,0 +1,78 @@
+import datetime as dt
+from typing import Any, List
+import fitz
+from src.utils.typed_pymupdf import _open_empty_pdf, _pdf_tobytes
+
+LINE_HEIGHT = 13
+FONT_SIZE = 10
+TOP_MARGIN = 50
+LEFT_MARGIN = 50
+LOCATIONS = [
+    "Mehrzweckhalle: Halle A / Dusche",
+    "Mehrzweckhalle: Halle B",
+    "Turnhalle Schulhaus Nord",
+]
+
+
+def build_confirmation_pdf(
+    booking_id: str,
+    num_pages: int,
+    num_dates: int,
+    trailing_pages: int = 2,
+    first_date: dt.date = dt.date(2030, 1, 7),
+) -> bytes:
+    """
+    A booking confirmation in the layout FindAttachmentMeta expects: the booking
+    id and address block on top, "Seite x/y" on every booking page, the dates
+    between "Mietoptionen" and "Kosten" spread over the pages and each location
+    followed by an "Adresse" line. `trailing_pages` pages of terms follow, they
+    are cut off by the page number detection.
+    """
+    doc = _open_empty_pdf()
+    dates = [first_date + dt.timedelta(days=7 * i) for i in range(num_dates)]
+    dates_per_page = -(-num_dates // num_pages)
+    for page_num in range(num_pages):
+        lines: List[str] = []
+        if page_num == 0:
+            lines += [
+                booking_id,
+                "Turnverein Musterdorf",
+                "Erika Muster",
+                "Musterstrasse 12",
+                "8000 Zürich",
+                "Tel. 079 123 45 67",
+                "erika.muster@example.ch",
+            ]
+        else:
+            lines.append(booking_id)
+        lines += [
+            f"Definitive Buchungsbestätigung ({booking_id})",
+            f"Seite {page_num + 1}/{num_pages}",
+        ]
+        page_dates = dates[page_num * dates_per_page : (page_num + 1) * dates_per_page]
+        if page_dates:
+            lines.append("Mietoptionen")
+            lines += [f"{d:%d.%m.%Y} 18:00 - 20:00" for d in page_dates]
+            lines.append("Kosten")
+        if page_num == 0:
+            for location in LOCATIONS:
+                lines += [location, "Adresse Schulhausstrasse 5, 8000 Zürich"]
+        _add_page(doc, lines)
+    for page_num in range(trailing_pages):
+        _add_page(
+            doc,
+            [f"Allgemeine Geschäftsbedingungen {page_num + 1}"]
+            + [f"{i}. Die Halle ist sauber zu verlassen." for i in range(1, 40)],
+        )
+    return _pdf_tobytes(doc)
+
+
+def _add_page(doc: fitz.Document, lines: List[str]) -> None:
+    page: Any = doc.new_page()
+    max_lines = int((page.rect.height - 2 * TOP_MARGIN) // LINE_HEIGHT)
+    if len(lines) > max_lines:
+        raise ValueError(f"{len(lines)} lines don't fit on a page, use more pages")
+    for i, line in enumerate(lines):
+        page.insert_text(
+            (LEFT_MARGIN, TOP_MARGIN + i * LINE_HEIGHT), line, fontsize=FONT_SIZE
+        )
@@ -1,117 +1,343 @@
 import base64
-import os
-from typing import List, Optional, Set, Tuple
-import fitz
-import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, NamedTuple, Optional, Set, Tuple
 import logging
 from O365.account import Account
 from O365.message import Message, MessageAttachment
 from O365.drive import Folder, File
-from tempfile import TemporaryDirectory
-from src.email.email_sender import EmailSender
+from src.email.email_sender import EmailSender, OutgoingEmail
 from src.utils.find_attachment_meta import (
     AttachmentMeta,
     FindAttachmentMeta,
     PAGE_NUMBER_REGEX,
 )
 from src.config import (
-    ORIGINAL_FOLDER,
-    REDACTED_FOLDER,
-    SHAREPOINT_FOLDER_PATH,
-    SHAREPOINT_SITE_ID,
     SUBSCRIPTION_META_FILE,
 )
 from src.email.email_processors.email_processor_base import EmailProcessorBase
+from src.utils.pdf_signature_index import (
+    PDF_SIGNATURE_INDEX_FILE,
+    PdfSignatureIndex,
+    get_drive_item_version,
+)
+from src.utils.reservation_date_index import (
+    RESERVATION_DATE_INDEX_FILE,
+    IndexedFile,
+    ReservationDateIndex,
+)
+from src.utils.parse_memo import (
+    PARSE_MEMO_FILE,
+    ParseMemo,
+    ParseMemoEntry,
+    UploadTarget,
+    hash_attachment_text,
+)
+from src.utils.pdf_markup import PdfMarkupEngine
+from src.utils.pdf_text_cache import CachedPdfDocument
+from src.utils.blob_cache import download_cached
+from src.utils.env_settings import get_int_from_env
+from src.utils.sharepoint_folders import FOLDER_CACHE
 from src.utils.subscription_meta import SubscriptionManager
-from src.utils.typed_o365 import _get_items
+from src.utils.typed_o365 import _download_bytes, _file_in_folder, _upload_bytes
 from src.utils.typed_pymupdf import (
-    _insert_pdf,
-    _open_empty_pdf,
+    PDF_LOCK,
     _open_pdf_from_bytes,
-    _open_pdf_from_path,
-    _pdf_tobytes,
 )
-from src.utils.is_test_mode import is_test_mode
+
+# Number of attachments of one message processed concurrently, 1 disables the worker pool.
+ATTACHMENT_WORKERS_ENV_VAR = "HALLENRESERVATION_ATTACHMENT_WORKERS"
+
+
+class PdfVariant(NamedTuple):
+    """A serialized PDF with the hash of its text signature, all an upload needs."""
+
+    content: bytes
+    signature_hash: str
+
+    @classmethod
+    def of(cls, pdf_doc: CachedPdfDocument) -> "PdfVariant":
+        return cls(pdf_doc.tobytes(), pdf_doc.signature_hash())
+
+
+class PreparedAttachment(NamedTuple):
+    """An attachment after all PDF work, ready to be uploaded."""
+
+    name: str
+    booking_id: str
+    text_hash: str
+    metas: List[AttachmentMeta]
+    original: PdfVariant
+    redacted: PdfVariant
+
+
+class UploadedAttachment(NamedTuple):
+    """An uploaded attachment with its immediate notification, if any."""
+
+    booking_id: str
+    text_hash: str
+    upload_targets: List[UploadTarget]
+    notification: Optional[OutgoingEmail]
 
 
 class ReservationEmailProcessor(EmailProcessorBase):
-    def __init__(self, message: Message, account: Account):
+    def __init__(
+        self,
+        message: Message,
+        account: Account,
+        max_workers: Optional[int] = None,
+        signature_index: Optional[PdfSignatureIndex] = None,
+        parse_memo: Optional[ParseMemo] = None,
+        date_index: Optional[ReservationDateIndex] = None,
+    ):
+        """
+        The persistent indexes are shared by all processors of a run, pass them in
+        when messages are processed concurrently.
+        """
         super().__init__(message, account)
+        if max_workers is None:
+            max_workers = get_int_from_env(ATTACHMENT_WORKERS_ENV_VAR, 1)
+        self.max_workers = max(1, max_workers)
         self.find_attachment_meta = FindAttachmentMeta()
         self.manager = SubscriptionManager(path=SUBSCRIPTION_META_FILE)
         self.email_sender = EmailSender(account=self.account)
+        if signature_index is None:
+            signature_index = PdfSignatureIndex(path=PDF_SIGNATURE_INDEX_FILE)
+        if parse_memo is None:
+            parse_memo = ParseMemo(path=PARSE_MEMO_FILE)
+        if date_index is None:
+            date_index = ReservationDateIndex(path=RESERVATION_DATE_INDEX_FILE)
+        self.signature_index = signature_index
+        self.parse_memo = parse_memo
+        self.date_index = date_index
+        # versions claimed in the parse memo, see release_claims
+        self._claims: List[Tuple[str, str]] = []
+        self._claims_lock = threading.Lock()
 
     def process(self) -> None:
+        try:
+            for uploaded in self.upload_attachments():
+                if uploaded.notification is not None:
+                    self.email_sender.send_emails([uploaded.notification])
+                self.record(uploaded)
+        finally:
+            self.release_claims()
+
+    def upload_attachments(self) -> List[UploadedAttachment]:
+        """
+        `process` without the notifications: the caller sends them, `record`s the
+        attachments whose notification was sent and calls `release_claims`.
+        """
         logging.info(
             f"... starting process for reservation message {self.message.subject}"
         )
 
         attachments = self.get_attachments()
-        for attachment in attachments:
-            try:
-                self.process_attachment(attachment)
-            except Exception as e:
-                # ToDo: handle this better: distinguish different exceptions and add retry
-                logging.warning(f"Error processing attachment {attachment.name}")
-                logging.warning(e)
-                raise e
+        if self.max_workers > 1 and len(attachments) > 1:
+            uploaded = self._process_attachments_concurrently(attachments)
+        else:
+            uploaded = []
+            for attachment in attachments:
+                uploaded_attachment = self._process_attachment_timed(attachment)
+                if uploaded_attachment is not None:
+                    uploaded.append(uploaded_attachment)
         logging.info(f"... done processing message {self.message.subject}")
+        return uploaded
+
+    def prepare(self) -> List[PreparedAttachment]:
+        """
+        The PDF work of `process` for all attachments, `upload` does the rest.
+        Lets a pipeline prepare the next message while this one is uploaded.
+        """
+        logging.info(
+            f"... starting process for reservation message {self.message.subject}"
+        )
+        prepared = []
+        for attachment in self.get_attachments():
+            prepared_attachment = self.prepare_attachment(attachment)
+            if prepared_attachment is not None:
+                prepared.append(prepared_attachment)
+        return prepared
+
+    def upload(self, prepared: List[PreparedAttachment]) -> List[UploadedAttachment]:
+        uploaded = [self.upload_attachment(attachment) for attachment in prepared]
+        logging.info(f"... done processing message {self.message.subject}")
+        return uploaded
+
+    def record(self, uploaded: UploadedAttachment) -> None:
+        """Call once the notification is sent, a failed attempt is redone."""
+        self.parse_memo.put(
+            ParseMemoEntry(
+                booking_id=uploaded.booking_id,
+                text_hash=uploaded.text_hash,
+                upload_targets=uploaded.upload_targets,
+            )
+        )
+
+    def release_claims(self) -> None:
+        """Lets re-sends of the versions not recorded be processed again."""
+        with self._claims_lock:
+            claims, self._claims = self._claims, []
+        for booking_id, text_hash in claims:
+            self.parse_memo.release(booking_id, text_hash)
+
+    def _claim(self, booking_id: str, text_hash: str) -> bool:
+        if not self.parse_memo.claim(booking_id, text_hash):
+            return False
+        with self._claims_lock:
+            self._claims.append((booking_id, text_hash))
+        return True
+
+    def _process_attachments_concurrently(
+        self, attachments: List[MessageAttachment]
+    ) -> List[UploadedAttachment]:
+        logging.info(
+            f"... processing {len(attachments)} attachments with {self.max_workers} workers"
+        )
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="attachment"
+        ) as executor:
+            futures = [
+                executor.submit(self._process_attachment_timed, attachment)
+                for attachment in attachments
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # fail fast: don't start attachments that are still queued
+                for future in futures:
+                    future.cancel()
+                raise
+        uploaded = [future.result() for future in futures]
+        return [attachment for attachment in uploaded if attachment is not None]
+
+    def _process_attachment_timed(
+        self, attachment: MessageAttachment
+    ) -> Optional[UploadedAttachment]:
+        start = time.perf_counter()
+        try:
+            uploaded = self.process_attachment(attachment)
+        except Exception as e:
+            # ToDo: handle this better: distinguish different exceptions and add retry
+            logging.warning(f"Error processing attachment {attachment.name}")
+            logging.warning(e)
+            raise e
+        logging.info(
+            f"... processed attachment {attachment.name} in {time.perf_counter() - start:.2f}s"
+        )
+        return uploaded
+
+    def process_attachment(
+        self, attachment: MessageAttachment
+    ) -> Optional[UploadedAttachment]:
+        prepared = self.prepare_attachment(attachment)
+        if prepared is None:
+            return None
+        return self.upload_attachment(prepared)
 
-    def process_attachment(self, attachment: MessageAttachment) -> None:
+    def prepare_attachment(
+        self, attachment: MessageAttachment
+    ) -> Optional[PreparedAttachment]:
+        """Everything up to the uploads, None if there is nothing to upload."""
         logging.info(f"... processing attachment {attachment.name}...")
         if not isinstance(attachment.name, str):
             raise ValueError(f"Attachment name is not a string: {attachment.name}")
         if not attachment.name.endswith(".pdf"):
             logging.info("... not a pdf")
-            return
+            return None
         if not isinstance(attachment.content, str):
             raise ValueError(
                 f"Unexpected attachment content type: {type(attachment.content)}"
             )
         pdf_content = base64.b64decode(attachment.content)
-        pdf_doc = _open_pdf_from_bytes(pdf_content)
-        cutoff_page_num = self.determine_pdf_cutoff(pdf_doc=pdf_doc)
-        if cutoff_page_num:
-            pdf_doc = self.cut_pdf_after_page_n(pdf_doc=pdf_doc, n=cutoff_page_num)
-        else:
-            logging.warning("... no cutoff page number detected!")
+        with PDF_LOCK:
+            pdf_doc = CachedPdfDocument(_open_pdf_from_bytes(pdf_content))
+            cutoff_page_num = self.determine_pdf_cutoff(pdf_doc=pdf_doc)
+            if cutoff_page_num:
+                pdf_doc = self.cut_pdf_after_page_n(pdf_doc=pdf_doc, n=cutoff_page_num)
+            else:
+                logging.warning("... no cutoff page number detected!")
 
-        pdf_text = self.read_pdf(pdf_doc)
+            pdf_text = self.read_pdf(pdf_doc)
         metas = self.find_attachment_meta.find(attachment_content=pdf_text)
         if not metas:
             raise ValueError(
                 f"Could not find meta information for attachment {attachment.name}"
             )
-        self.upload_to_sharepoint(pdf_doc=pdf_doc, metas=metas, redacted=False)
-        sensitive_content = metas[0].sensitive_content
-        pdf_doc_redacted = self.redact_pdf(
-            pdf_doc=pdf_doc, strings_to_redact=sensitive_content
+        booking_id = self.find_attachment_meta.parse(pdf_text).booking_id
+        text_hash = hash_attachment_text(pdf_text)
+        memo_entry = self.parse_memo.get(booking_id, text_hash)
+        if memo_entry is not None:
+            logging.info(
+                f"... attachment {attachment.name} is an unchanged re-send of booking {booking_id}, "
+                f"already uploaded as {sorted({t.filename for t in memo_entry.upload_targets})}, "
+                "skipping the uploads and immediate notifications"
+            )
+            return None
+        if not self._claim(booking_id, text_hash):
+            logging.info(
+                f"... attachment {attachment.name} is a re-send of booking {booking_id} "
+                "that is being processed, skipping"
+            )
+            return None
+        if booking_id in self.parse_memo:
+            logging.info(f"... booking {booking_id} changed since its last version")
+        # the original is serialized first, the document is redacted in place
+        original = PdfVariant.of(pdf_doc)
+        pdf_doc_redacted = self.redact_and_highlight_pdf(
+            pdf_doc=pdf_doc,
+            strings_to_redact=metas[0].sensitive_content,
+            strings_to_highlight=metas[0].locations,
         )
-        strings_to_highlight = metas[0].locations
-        pdf_doc_redacted = self.highlight_strings_in_pdf(
-            pdf_doc=pdf_doc_redacted, strings_to_highlight=strings_to_highlight
+        return PreparedAttachment(
+            name=attachment.name,
+            booking_id=booking_id,
+            text_hash=text_hash,
+            metas=metas,
+            original=original,
+            redacted=PdfVariant.of(pdf_doc_redacted),
+        )
+
+    def upload_attachment(self, prepared: PreparedAttachment) -> UploadedAttachment:
+        metas = prepared.metas
+        upload_targets = self.upload_to_sharepoint(
+            variant=prepared.original, metas=metas, redacted=False
+        )
+        upload_targets += self.upload_to_sharepoint(
+            variant=prepared.redacted, metas=metas, redacted=True
         )
-        self.upload_to_sharepoint(pdf_doc=pdf_doc_redacted, metas=metas, redacted=True)
         weekdays = {meta.date.weekday() for meta in metas}
         emails_to_notify = set()
         for weekday in weekdays:
             emails_to_notify.update(
                 self.manager.emails_with_notifications_for_weekday(weekday)
             )
+        notification = None
         if not emails_to_notify:
             logging.info(
-                f"... no immediate notifications to send for attachment {attachment.name}"
+                f"... no immediate notifications to send for attachment {prepared.name}"
             )
-            return
-        logging.info(
-            f"... sending immediate notifications to {emails_to_notify} for attachment {attachment.name}"
-        )
-        self.email_sender.send_immediate_notification_email(
-            pdf_doc=pdf_doc_redacted,
-            filename=attachment.name,
-            dates=sorted([meta.date for meta in metas]),
-            locations=self._sort_and_preprocess_booked_locations(metas[0].locations),
-            recipients=list(emails_to_notify),
+        else:
+            logging.info(
+                f"... immediate notifications to {emails_to_notify} for attachment {prepared.name}"
+            )
+            notification = self.email_sender.immediate_notification_email(
+                pdf_bytes=prepared.redacted.content,
+                filename=prepared.name,
+                dates=sorted([meta.date for meta in metas]),
+                locations=self._sort_and_preprocess_booked_locations(
+                    metas[0].locations
+                ),
+                recipients=list(emails_to_notify),
+                drive_item=self._uploaded_redacted_file(upload_targets),
+            )
+        return UploadedAttachment(
+            booking_id=prepared.booking_id,
+            text_hash=prepared.text_hash,
+            upload_targets=upload_targets,
+            notification=notification,
         )
 
     def _sort_and_preprocess_booked_locations(self, locations: Set[str]) -> List[str]:
@@ -129,16 +355,11 @@ class ReservationEmailProcessor(EmailProcessorBase):
                 location = location.replace(substring, replacement)
         return location
 
-    def read_pdf(self, doc: fitz.Document) -> str:
-        pdf_text = ""
-        for page in doc:  # type: ignore[attr-defined]
-            page_text = page.get_text()
-            pdf_text += page_text
-        return pdf_text
+    def read_pdf(self, doc: CachedPdfDocument) -> str:
+        return doc.full_text()
 
-    def determine_pdf_cutoff(self, pdf_doc: fitz.Document) -> Optional[int]:
-        first_page = pdf_doc[0]
-        page_text = first_page.get_text()  # type: ignore[attr-defined]
+    def determine_pdf_cutoff(self, pdf_doc: CachedPdfDocument) -> Optional[int]:
+        page_text = pdf_doc.page_text(0)
         detected_current_page, detected_expected_num_of_pages = (
             self.extract_page_number_from_pdf_text(page_text)
         )
@@ -151,33 +372,14 @@ class ReservationEmailProcessor(EmailProcessorBase):
             return None
         return detected_expected_num_of_pages
 
-    def redact_pdf(
-        self, pdf_doc: fitz.Document, strings_to_redact: Set[str]
-    ) -> fitz.Document:
-        redacted_doc = _open_empty_pdf()
-        _insert_pdf(redacted_doc, pdf_doc)
-
-        for page in redacted_doc:  # type: ignore[attr-defined]
-            for str_to_redact in strings_to_redact:
-                text_instances = page.search_for(str_to_redact)
-                for inst in text_instances:
-                    page.add_redact_annot(
-                        inst, fill=(0, 0, 0)
-                    )  # RGB (0,0,0) = black bar
-            # images=0 -> don't redact overlapping images, this drastically reduces file-size in some cases.
-            page.apply_redactions(images=0)
-        return redacted_doc
-
-    def highlight_strings_in_pdf(
-        self, pdf_doc: fitz.Document, strings_to_highlight: Set[str]
-    ) -> fitz.Document:
-        for page in pdf_doc:  # type: ignore[attr-defined]
-            for str_to_highlight in strings_to_highlight:
-                text_instances = page.search_for(str_to_highlight)
-                for inst in text_instances:
-                    highlight = page.add_highlight_annot(inst)
-                    highlight.set_colors(stroke=(1, 1, 0))  # RGB (1,1,0) = yellow
-                    highlight.update()
+    def redact_and_highlight_pdf(
+        self,
+        pdf_doc: CachedPdfDocument,
+        strings_to_redact: Set[str],
+        strings_to_highlight: Set[str],
+    ) -> CachedPdfDocument:
+        """Redacts and highlights in place, the unredacted content is lost."""
+        PdfMarkupEngine(strings_to_redact, strings_to_highlight).apply(pdf_doc)
         return pdf_doc
 
     def get_attachments(self) -> list[MessageAttachment]:
@@ -187,76 +389,123 @@ class ReservationEmailProcessor(EmailProcessorBase):
         return [att for att in self.message.attachments]
 
     def upload_to_sharepoint(
-        self, pdf_doc: fitz.Document, metas: List[AttachmentMeta], redacted: bool
-    ) -> None:
+        self, variant: PdfVariant, metas: List[AttachmentMeta], redacted: bool
+    ) -> List[UploadTarget]:
         logging.info(
             f"... uploading to sharepoint {'in redacted form' if redacted else ''}..."
         )
-        for meta in metas:
-            self.upload_single_file_to_sharepoint(pdf_doc, meta, redacted)
+        return [
+            self.upload_single_file_to_sharepoint(variant, meta, redacted)
+            for meta in metas
+        ]
+
+    def _uploaded_redacted_file(
+        self, upload_targets: List[UploadTarget]
+    ) -> Optional[File]:
+        """The first redacted upload, which notifications can link instead of attaching it."""
+        for target in upload_targets:
+            if target.redacted and target.item_id is not None:
+                folder = get_reservations_folder(
+                    account=self.account, year=target.year, redacted=True
+                )
+                return _file_in_folder(folder, target.item_id, target.filename)
+        return None
 
     def upload_single_file_to_sharepoint(
-        self, pdf_doc: fitz.Document, meta: AttachmentMeta, redacted: bool
-    ) -> None:
+        self, variant: PdfVariant, meta: AttachmentMeta, redacted: bool
+    ) -> UploadTarget:
         folder = get_reservations_folder(
             account=self.account, year=meta.date.year, redacted=redacted
         )
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            temp_file.write(_pdf_tobytes(pdf_doc))
-            temp_file_path = temp_file.name
-
-        try:
-            existing_files = [item for item in _get_items(folder)]
-            if meta.clean_filename in {item.name for item in existing_files}:
-                base_name, ext = meta.clean_filename.rsplit(".", 1)
-                existing_files_matching_base_name = [
-                    item for item in existing_files if item.name.startswith(base_name)
-                ]
-                for file in existing_files_matching_base_name:
-                    if self._sp_file_identical_to_local(file, temp_file_path):
-                        logging.info(
-                            f"... file with identical content already exists: {file.name}, skipping upload"
-                        )
-                        return
-                existing_suffixes = [
-                    name[len(base_name) + 1 : -len(ext) - 1]
-                    for name in {
-                        item.name for item in existing_files_matching_base_name
-                    }
-                ]
-                if "" in existing_suffixes:
-                    existing_suffixes.remove("")
-                existing_suffixes = [int(suffix) for suffix in existing_suffixes]
-                new_suffix = max(existing_suffixes) + 1 if existing_suffixes else 1
-                meta.clean_filename = f"{base_name}_{new_suffix}.{ext}"
-            new_file = folder.upload_file(temp_file_path, meta.clean_filename)
-            logging.info(f"... uploaded file: {new_file.name} to folder: {folder.name}")
-        finally:
-            try:
-                os.remove(temp_file_path)
-            except FileNotFoundError:
-                pass
-            except OSError as cleanup_error:
-                logging.warning(
-                    f"... failed to delete temporary file {temp_file_path}: {cleanup_error}"
+        local_signature_hash = variant.signature_hash
+        folder_index = FOLDER_CACHE.get_folder_index(folder)
+        base_name, ext = meta.clean_filename.rsplit(".", 1)
+        while True:
+            with folder_index.lock:
+                # an upload of the same base name is in flight, it might be identical
+                while folder_index.has_reservations(base_name):
+                    folder_index.wait_for_change()
+                candidates = (
+                    folder_index.items_with_base_name(base_name)
+                    if meta.clean_filename in folder_index
+                    else []
                 )
+            # compared without holding the folder lock, a comparison may download
+            for file in candidates:
+                if self._sp_file_identical_to_local(
+                    file, local_signature_hash, redacted
+                ):
+                    logging.info(
+                        f"... file with identical content already exists: {file.name}, skipping upload"
+                    )
+                    if redacted:
+                        self.date_index.add(
+                            meta.date.year, str(file.name), IndexedFile.from_file(file)
+                        )
+                    return UploadTarget(
+                        redacted=redacted,
+                        year=meta.date.year,
+                        filename=str(file.name),
+                        item_id=str(file.object_id),
+                    )
+            with folder_index.lock:
+                if folder_index.has_reservations(base_name) or (
+                    folder_index.items_with_base_name(base_name) != candidates
+                    and meta.clean_filename in folder_index
+                ):
+                    # another upload started or finished meanwhile, compare again
+                    continue
+                if meta.clean_filename in folder_index:
+                    new_suffix = folder_index.next_suffix(base_name)
+                    meta.clean_filename = f"{base_name}_{new_suffix}.{ext}"
+                folder_index.reserve(meta.clean_filename)
+                break
+        try:
+            # serialized once per variant, every date uploads the same buffer
+            new_file = _upload_bytes(folder, meta.clean_filename, variant.content)
+            if new_file is None:
+                raise RuntimeError(f"Upload of {meta.clean_filename} failed")
+        except Exception:
+            folder_index.release(meta.clean_filename)
+            # the cached folder might be stale, resolve it again next time
+            FOLDER_CACHE.invalidate()
+            raise
+        folder_index.add(new_file)
+        self.signature_index.put(
+            str(new_file.object_id),
+            get_drive_item_version(new_file),
+            local_signature_hash,
+        )
+        if redacted:
+            self.date_index.add(
+                meta.date.year, meta.clean_filename, IndexedFile.from_file(new_file)
+            )
+        logging.info(f"... uploaded file: {new_file.name} to folder: {folder.name}")
+        return UploadTarget(
+            redacted=redacted,
+            year=meta.date.year,
+            filename=meta.clean_filename,
+            item_id=str(new_file.object_id),
+        )
 
-    def _sp_file_identical_to_local(self, sp_file: File, local_file_path: str) -> bool:
-        with TemporaryDirectory() as td:
-            sp_file.download(to_path=td, name=sp_file.name)
-            sp_file_path = os.path.join(td, sp_file.name)
-            return self._pdf_text_signature(
-                local_file_path
-            ) == self._pdf_text_signature(sp_file_path)
+    def _sp_file_identical_to_local(
+        self, sp_file: File, local_signature_hash: str, redacted: bool
+    ) -> bool:
+        item_id = str(sp_file.object_id)
+        version = get_drive_item_version(sp_file)
+        sp_signature_hash = self.signature_index.get(item_id, version)
+        if sp_signature_hash is None:
+            # unredacted originals must never end up in the plaintext blob cache
+            content = download_cached(sp_file) if redacted else _download_bytes(sp_file)
+            sp_signature_hash = self._pdf_signature_hash(content)
+            self.signature_index.put(item_id, version, sp_signature_hash)
+        return sp_signature_hash == local_signature_hash
 
     @staticmethod
-    def _pdf_text_signature(file_path: str) -> str:
-        pages: List[str] = []
-        with _open_pdf_from_path(file_path) as doc:
-            for page in doc:
-                pages.append(" ".join(page.get_text("text").split()))
-        return f"{len(pages)}|" + "\f".join(pages)
+    def _pdf_signature_hash(content: bytes) -> str:
+        with PDF_LOCK, _open_pdf_from_bytes(content) as doc:
+            return CachedPdfDocument(doc).signature_hash()
 
     @staticmethod
     def extract_page_number_from_pdf_text(
@@ -268,33 +517,12 @@ class ReservationEmailProcessor(EmailProcessorBase):
         return None, None
 
     @staticmethod
-    def cut_pdf_after_page_n(pdf_doc: fitz.Document, n: int) -> fitz.Document:
-        new_doc = _open_empty_pdf()
-        _insert_pdf(new_doc, pdf_doc, from_page=0, to_page=n - 1)
-        return new_doc
+    def cut_pdf_after_page_n(pdf_doc: CachedPdfDocument, n: int) -> CachedPdfDocument:
+        pdf_doc.cut_after_page(n)
+        return pdf_doc
 
 
 def get_reservations_folder(account: Account, year: int, redacted: bool) -> Folder:
-    year_str = str(year)
-    sharepoint = account.sharepoint()
-    site = sharepoint.get_site(SHAREPOINT_SITE_ID)
-    drive = site.get_default_document_library()
-
-    base_path = SHAREPOINT_FOLDER_PATH
-    if is_test_mode():
-        base_path = f"{base_path}/TEST"
-    base_folder = f"{base_path}/{REDACTED_FOLDER if redacted else ORIGINAL_FOLDER}"
-
-    folder_path = f"{base_folder}/{year_str}"
-    try:
-        parent = drive.get_item_by_path(base_folder)
-    except Exception:
-        raise RuntimeError(f"Base path does not exist: {base_folder}")
-    try:
-        folder = drive.get_item_by_path(folder_path)
-    except Exception:
-        folder = parent.create_child_folder(year_str)
-        logging.info(f"... created folder: {folder_path}")
-    if not isinstance(folder, Folder):
-        raise RuntimeError(f"Expected {folder_path} to be a folder!")
-    return folder
+    return FOLDER_CACHE.get_reservations_folder(
+        account=account, year=year, redacted=redacted
+    )
@@ -1,15 +1,15 @@
-import fitz
 import html
 import logging
 import os
+import threading
 import traceback
-from typing import Dict, List
-from datetime import datetime
+from io import BytesIO
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+from datetime import datetime, timedelta
 from O365.message import Message
 from O365.account import Account
 from O365.drive import File
 
-from tempfile import TemporaryDirectory
 from src.config import (
     DEFAULT_FROM_ADDRESS,
     NOTIFICATION_PREFIX,
@@ -21,19 +21,71 @@ from src.config import (
 from src.email.email_templates.reminder_email_template import (
     template as reminder_email_template,
 )
-from src.email.email_templates.reminder_email_template import bullet_point_list_template
+from src.email.email_templates.reminder_email_template import (
+    bullet_point_list_template,
+    link_template,
+)
 from src.email.email_templates.subscription_update_confirmation_email_template import (
     template as subscription_update_confirmation_email_template,
 )
 from src.email.email_templates.immediate_notification_email_template import (
+    document_link_template,
     template as immediate_notification_email_template,
 )
-from src.utils.typed_o365 import _forward_message, _send_message, _set_message_body
-from src.utils.typed_pymupdf import _save_pdf
+from src.utils.blob_cache import download_cached
+from src.utils.env_settings import get_int_from_env
+from src.utils.graph_batch import MAX_BATCH_REQUESTS, BatchRequest, GraphBatchClient
+from src.utils.typed_o365 import (
+    _build_url,
+    _create_share_link,
+    _message_api_data,
+    _save_draft,
+    _send_message,
+    _set_message_body,
+)
 from src.utils.subscription_meta import SubscriptionMeta, SubscriptionManager
 
 
 EMAIL_NEWLINE_STR = "\n<br>\n"
+# Graph limits a sendMail request to 4 MB, base64 inflates attachments by a third.
+INLINE_ATTACHMENTS_LIMIT_BYTES = 3 * 1024 * 1024
+
+# (content, file name) of an in-memory attachment
+EmailAttachment = Tuple[bytes, str]
+
+
+class OutgoingEmail(NamedTuple):
+    subject: str
+    body: str
+    recipients: List[str]
+    attachments: List[EmailAttachment]
+
+
+class ForwardedEmail(NamedTuple):
+    """`message` forwarded with `comment` above its content."""
+
+    message: Message
+    subject: str
+    comment: str
+    recipients: List[str]
+
+
+Email = Union[OutgoingEmail, ForwardedEmail]
+
+
+# PDFs that already live in SharePoint are only linked instead of attached if a
+# share link scope is configured: "organization" links only open for members of
+# the organization, "anonymous" links work for subscribers outside of it and
+# expire after the days below. Without a scope PDFs are always attached.
+SHARE_LINK_SCOPE_ENV_VAR = "HALLENRESERVATION_SHARE_LINK_SCOPE"
+ORGANIZATION_SHARE_LINK_SCOPE = "organization"
+ANONYMOUS_SHARE_LINK_SCOPE = "anonymous"
+# With a scope, PDFs above this total size are linked, a negative value always
+# attaches them.
+LINK_ATTACHMENTS_ABOVE_KB_ENV_VAR = "HALLENRESERVATION_LINK_ATTACHMENTS_ABOVE_KB"
+DEFAULT_LINK_ATTACHMENTS_ABOVE_KB = INLINE_ATTACHMENTS_LIMIT_BYTES // 1024
+SHARE_LINK_EXPIRATION_DAYS_ENV_VAR = "HALLENRESERVATION_SHARE_LINK_EXPIRATION_DAYS"
+DEFAULT_SHARE_LINK_EXPIRATION_DAYS = 30
 
 
 class EmailSendingError(Exception):
@@ -44,36 +96,56 @@ class EmailSender:
     def __init__(self, account: Account):
         self.account = account
         self.mailbox = self.account.mailbox(resource=DEFAULT_FROM_ADDRESS)
+        self.share_link_scope = os.getenv(SHARE_LINK_SCOPE_ENV_VAR) or None
+        if self.share_link_scope not in (
+            None,
+            ORGANIZATION_SHARE_LINK_SCOPE,
+            ANONYMOUS_SHARE_LINK_SCOPE,
+        ):
+            raise EnvironmentError(
+                f"Environment variable '{SHARE_LINK_SCOPE_ENV_VAR}' must be "
+                f"'{ORGANIZATION_SHARE_LINK_SCOPE}' or '{ANONYMOUS_SHARE_LINK_SCOPE}', "
+                f"got {self.share_link_scope!r}"
+            )
+        link_above_kb = get_int_from_env(
+            LINK_ATTACHMENTS_ABOVE_KB_ENV_VAR, DEFAULT_LINK_ATTACHMENTS_ABOVE_KB
+        )
+        self.link_attachments_above_bytes = (
+            link_above_kb * 1024
+            if self.share_link_scope is not None and link_above_kb >= 0
+            else None
+        )
+        self.share_link_expiration_days = get_int_from_env(
+            SHARE_LINK_EXPIRATION_DAYS_ENV_VAR, DEFAULT_SHARE_LINK_EXPIRATION_DAYS
+        )
+        self.batch_client = GraphBatchClient(
+            self.account.connection, self.account.protocol.service_url
+        )
 
-    def send_alert_message_for_upload(self, message: Message, issue: Exception) -> None:
-        subject = f"HALLENRESERVATION UPLOAD ERROR: {message.subject}"
-        body = str(issue) + EMAIL_NEWLINE_STR + traceback.format_exc()
-        return self._forward_email(
+    def upload_alert(self, message: Message, issue: Exception) -> ForwardedEmail:
+        return ForwardedEmail(
             message=message,
-            subject=subject,
-            additional_body=body,
+            subject=f"HALLENRESERVATION UPLOAD ERROR: {message.subject}",
+            comment=_describe_issue(issue),
             recipients=[SUPPORT_EMAIL_ADDRESS],
         )
 
     def send_alert_message_for_reminder(self, issue: Exception) -> None:
         subject = "HALLENRESERVATION REMINDER ERROR"
-        body = str(issue) + EMAIL_NEWLINE_STR + traceback.format_exc()
         return self._send_email(
             subject=subject,
-            body=body,
+            body=_describe_issue(issue),
             recipients=[SUPPORT_EMAIL_ADDRESS],
             attachments=[],
         )
 
-    def send_alert_message_for_subscription_update(
+    def subscription_update_alert(
         self, message: Message, issue: Exception
-    ) -> None:
-        subject = f"HALLENRESERVATION SUBSCRIPTION UPDATE ERROR: {message.subject}"
-        body = str(issue) + EMAIL_NEWLINE_STR + traceback.format_exc()
-        return self._forward_email(
+    ) -> ForwardedEmail:
+        return ForwardedEmail(
             message=message,
-            subject=subject,
-            additional_body=body,
+            subject=f"HALLENRESERVATION SUBSCRIPTION UPDATE ERROR: {message.subject}",
+            comment=_describe_issue(issue),
             recipients=[SUPPORT_EMAIL_ADDRESS],
         )
 
@@ -83,9 +155,27 @@ class EmailSender:
         date: datetime,
         recipients: List[str],
     ) -> None:
+        return self._send_email(*self.reminder_email(reservations, date, recipients))
+
+    def reminder_email(
+        self,
+        reservations: Dict[str, File],
+        date: datetime,
+        recipients: List[str],
+    ) -> OutgoingEmail:
+        """The reminder about `reservations` on `date`, downloads the attachments."""
         subject = f"{REMINDER_PREFIX} Reservation vom {datetime.strftime(date, '%A, %d.%m.%Y')}"
+        links = None
+        if self._should_link(
+            sum(int(item.size or 0) for item in reservations.values())
+        ):
+            links = self._create_share_links(reservations)
         reservation_rows = "\n".join(
-            bullet_point_list_template.format(item=html.escape(filename))
+            bullet_point_list_template.format(
+                item=self._render_link(filename, links[filename])
+                if links
+                else html.escape(filename)
+            )
             for filename in reservations.keys()
         )
         text = reminder_email_template.format(
@@ -96,30 +186,101 @@ class EmailSender:
             support_email_address=SUPPORT_EMAIL_ADDRESS,
         )
 
-        logging.info("... downloading attachments ...")
-        attachments = []
-        with TemporaryDirectory() as td:
+        attachments: List[EmailAttachment] = []
+        if links:
+            logging.info("... linking reservations instead of attaching them ...")
+        else:
+            logging.info("... downloading attachments ...")
             for filename, item in reservations.items():
                 if item is None:
                     continue
-                item.download(to_path=td, name=filename)
-                local_path = os.path.join(td, filename)
-                attachments.append(local_path)
-            return self._send_email(
-                subject=subject,
-                body=text,
-                recipients=recipients,
-                attachments=attachments,
-            )
+                attachments.append((download_cached(item), filename))
+        return OutgoingEmail(
+            subject=subject,
+            body=text,
+            recipients=recipients,
+            attachments=attachments,
+        )
+
+    def send_emails(self, emails: List[OutgoingEmail]) -> None:
+        """
+        Sends independent emails through $batch. Raises once all emails have been
+        attempted if any of them failed.
+        """
+        failed = self.send_all(emails).count(False)
+        if failed:
+            raise EmailSendingError(f"failed to send {failed} of {len(emails)} emails!")
+        logging.info("... emails sent.")
+
+    def send_all(self, emails: Sequence[Email]) -> List[bool]:
+        """
+        Sends independent emails through $batch, returns which of them were
+        sent. Emails whose attachments are too large for sendMail are sent one
+        by one.
+        """
+        sent = [False] * len(emails)
+        batched: List[int] = []
+        requests = []
+        for index, email in enumerate(emails):
+            if isinstance(email, ForwardedEmail):
+                requests.append(self._forward_request(email))
+            elif (
+                sum(len(content) for content, _ in email.attachments)
+                > INLINE_ATTACHMENTS_LIMIT_BYTES
+            ):
+                try:
+                    self._send_email(*email)
+                    sent[index] = True
+                except EmailSendingError as e:
+                    logging.info(f"... failed to send email {email.subject}: {e}")
+                continue
+            else:
+                requests.append(self._send_mail_request(email))
+            batched.append(index)
+        if requests:
+            logging.info(f"... sending {len(requests)} emails batched ...")
+            for index, response in zip(batched, self.batch_client.execute(requests)):
+                sent[index] = response.ok
+                if not response.ok:
+                    logging.info(
+                        f"... failed to send email {emails[index].subject}: {response.status}"
+                    )
+        return sent
 
-    def send_immediate_notification_email(
+    def _send_mail_request(self, email: OutgoingEmail) -> BatchRequest:
+        msg = self._new_message(email.subject, email.body, email.recipients)
+        self._add_attachments(msg, email.attachments)
+        url = self.batch_client.relative_url(_build_url(self.mailbox, "/sendMail"))
+        return BatchRequest("POST", url, {"message": _message_api_data(msg)})
+
+    def _forward_request(self, email: ForwardedEmail) -> BatchRequest:
+        message_id = email.message.object_id
+        url = _build_url(email.message, f"/messages/{message_id}/forward")
+        return BatchRequest(
+            "POST",
+            self.batch_client.relative_url(url),
+            {
+                "comment": email.comment,
+                "message": {
+                    "subject": email.subject,
+                    "toRecipients": [
+                        {"emailAddress": {"address": recipient}}
+                        for recipient in email.recipients
+                    ],
+                },
+            },
+        )
+
+    def immediate_notification_email(
         self,
-        pdf_doc: fitz.Document,
+        pdf_bytes: bytes,
         filename: str,
         dates: List[datetime],
         locations: List[str],
         recipients: List[str],
-    ) -> None:
+        drive_item: Optional[File] = None,
+    ) -> OutgoingEmail:
+        """`drive_item` is the uploaded copy of the PDF, it is linked if the PDF is large."""
         subject = f"{NOTIFICATION_PREFIX} Neue Reservationsbestätigung"
         dates_str = "\n".join(
             bullet_point_list_template.format(
@@ -131,21 +292,65 @@ class EmailSender:
             bullet_point_list_template.format(item=html.escape(location))
             for location in locations
         )
+        links = None
+        if drive_item is not None and self._should_link(len(pdf_bytes)):
+            links = self._create_share_links({filename: drive_item})
+        document = ""
+        attachments: List[EmailAttachment] = [(pdf_bytes, filename)]
+        if links:
+            logging.info("... linking the confirmation instead of attaching it ...")
+            document = document_link_template.format(
+                url=html.escape(links[filename], quote=True), name=html.escape(filename)
+            )
+            attachments = []
         text = immediate_notification_email_template.format(
             dates=dates_str,
             locations=locations_str,
+            document=document,
             subscription_manage_url=SUBSCRIPTION_MANAGE_URL,
             support_email_address=SUPPORT_EMAIL_ADDRESS,
         )
-        with TemporaryDirectory() as td:
-            attachment_path = os.path.join(td, filename)
-            _save_pdf(pdf_doc, attachment_path)
-            return self._send_email(
-                subject=subject,
-                body=text,
-                recipients=recipients,
-                attachments=[attachment_path],
+        return OutgoingEmail(
+            subject=subject,
+            body=text,
+            recipients=recipients,
+            attachments=attachments,
+        )
+
+    def _should_link(self, attachments_size: int) -> bool:
+        return (
+            self.link_attachments_above_bytes is not None
+            and attachments_size > self.link_attachments_above_bytes
+        )
+
+    def _create_share_links(self, items: Dict[str, File]) -> Optional[Dict[str, str]]:
+        """Share links by file name, None if any link could not be created."""
+        if self.share_link_scope is None:
+            return None
+        links = {}
+        expiration_date = None
+        if self.share_link_scope == ANONYMOUS_SHARE_LINK_SCOPE:
+            expiration = datetime.now() + timedelta(
+                days=self.share_link_expiration_days
             )
+            expiration_date = expiration.strftime("%Y-%m-%d")
+        for filename, item in items.items():
+            try:
+                link = _create_share_link(item, self.share_link_scope, expiration_date)
+            except Exception as e:
+                logging.info(f"... could not create share link for {filename}: {e}")
+                link = None
+            if link is None:
+                logging.info("... falling back to attachments.")
+                return None
+            links[filename] = link
+        return links
+
+    @staticmethod
+    def _render_link(filename: str, url: str) -> str:
+        return link_template.format(
+            url=html.escape(url, quote=True), name=html.escape(filename)
+        )
 
     def send_subscription_update_confirmation_email(
         self, subscription_meta: SubscriptionMeta
@@ -180,35 +385,99 @@ class EmailSender:
         )
 
     def _send_email(
-        self, subject: str, body: str, recipients: List[str], attachments: List[str]
+        self,
+        subject: str,
+        body: str,
+        recipients: List[str],
+        attachments: List[EmailAttachment],
     ) -> None:
-        msg = self.mailbox.new_message()
+        msg = self._new_message(subject, body, recipients)
+        attachments_size = sum(len(content) for content, _ in attachments)
+        if attachments_size > INLINE_ATTACHMENTS_LIMIT_BYTES:
+            # sendMail only takes small inline attachments, larger ones are
+            # added to a draft, which O365 uploads through upload sessions
+            logging.info("... saving draft to upload large attachments ...")
+            if not _save_draft(msg):
+                raise EmailSendingError("failed to save draft!")
+            self._add_attachments(msg, attachments)
+            if not _save_draft(msg):
+                raise EmailSendingError("failed to upload attachments!")
+        else:
+            self._add_attachments(msg, attachments)
+        logging.info("... sending email ...")
+        if not _send_message(msg):
+            raise EmailSendingError("failed to send email!")
+        logging.info("... email sent.")
+
+    def _new_message(self, subject: str, body: str, recipients: List[str]) -> Message:
+        msg: Message = self.mailbox.new_message()
         msg.subject = subject
         _set_message_body(msg, body)
         msg.reply_to.add(SUPPORT_EMAIL_ADDRESS)
         for recipient in recipients:
             msg.bcc.add(recipient)
+        return msg
 
-        for attachment in attachments:
-            msg.attachments.add(attachment)
-        logging.info("... sending email ...")
-        if not _send_message(msg):
-            raise EmailSendingError("failed to send email!")
-        logging.info("... email sent.")
+    @staticmethod
+    def _add_attachments(msg: Message, attachments: List[EmailAttachment]) -> None:
+        for content, name in attachments:
+            msg.attachments.add([(BytesIO(content), name)])
 
-    def _forward_email(
-        self,
-        message: Message,
-        subject: str,
-        additional_body: str,
-        recipients: List[str],
+
+class EmailOutbox:
+    """
+    Collects the alerts and notifications of a run and sends them through
+    $batch. A full batch is sent right away, call `flush` for the rest once the
+    messages are handled. The emails of one `add` are sent together and their
+    callback learns which of them were sent, so the outcome can still decide
+    the read state of a message.
+    """
+
+    def __init__(
+        self, sender: EmailSender, flush_size: int = MAX_BATCH_REQUESTS
     ) -> None:
-        fwd = _forward_message(message)
-        fwd.subject = subject
-        _set_message_body(fwd, additional_body + EMAIL_NEWLINE_STR + fwd.body)
-        for recipient in recipients:
-            fwd.to.add(recipient)
-        logging.info("... forwarding email ...")
-        if not _send_message(fwd):
-            raise EmailSendingError("failed to forward email!")
-        logging.info("... email forwarded.")
+        self.sender = sender
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[List[Email], Callable[[List[bool]], None]]] = []
+        self._num_pending = 0
+
+    def add(self, emails: List[Email], on_sent: Callable[[List[bool]], None]) -> None:
+        with self._lock:
+            self._pending.append((emails, on_sent))
+            self._num_pending += len(emails)
+            full = self._num_pending >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Sends the pending emails, including those the callbacks add, and returns
+        the number that failed.
+        """
+        failed = 0
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._num_pending = 0
+            if not pending:
+                return failed
+            emails = [email for group, _ in pending for email in group]
+            try:
+                sent = self.sender.send_all(emails)
+            except Exception as e:
+                logging.info(f"... failed to send {len(emails)} emails: {e}")
+                sent = [False] * len(emails)
+            failed += sent.count(False)
+            start = 0
+            for group, on_sent in pending:
+                try:
+                    on_sent(sent[start : start + len(group)])
+                except Exception as e:
+                    logging.warning(f"... handling the outcome of an email failed: {e}")
+                start += len(group)
+
+
+def _describe_issue(issue: Exception) -> str:
+    """The issue with its traceback, also outside of the except block."""
+    return str(issue) + EMAIL_NEWLINE_STR + "".join(traceback.format_exception(issue))
@@ -19,6 +19,7 @@ template = """
       <ul style="margin:10px 0; padding-left:20px;">
         {locations}
       </ul>
+      {document}
       <p>
         Du erhältst diese Nachricht, weil du den Halleninfo-Service aktiviert hast.
         Du kannst deine Benachrichtigungseinstellungen hier anpassen oder den Service abbestellen:
@@ -40,3 +41,9 @@ template = """
   </tr>
 </table>
 """
+
+document_link_template = """
+      <p>
+        Die Reservationsbestätigung findest du hier: <a href="{url}">{name}</a>
+      </p>
+"""
@@ -36,6 +36,8 @@ template = """
 </table>
 """
 
+link_template = """<a href="{url}">{name}</a>"""
+
 bullet_point_list_template = """
   <li style="padding:4px 0; font-size:14px;">
     {item}
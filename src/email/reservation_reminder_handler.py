@@ -1,51 +1,138 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 import logging
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional
 from O365.account import Account
-from O365.drive import File
-from src.email.email_sender import EmailSender
+from O365.drive import File, Folder
+from src.email.email_sender import EmailSender, OutgoingEmail
 from src.utils.find_attachment_meta import get_date_string_from_date
 from src.email.email_processors.reservation_email_processor import (
     get_reservations_folder,
 )
-from src.utils.typed_o365 import _get_items
+from src.utils.reservation_date_index import (
+    RESERVATION_DATE_INDEX_FILE,
+    IndexedFile,
+    ReservationDateIndex,
+)
+from src.utils.typed_o365 import _file_in_folder, _get_items
+
+
+@dataclass
+class PlannedReminder:
+    lead_days: int
+    date: datetime
+    recipients: List[str]
+    reservations: Dict[str, File]
 
 
 class ReservationReminderHandler:
-    def __init__(self, account: Account):
+    def __init__(
+        self, account: Account, date_index: Optional[ReservationDateIndex] = None
+    ):
         self.account = account
         self.email_sender = EmailSender(account=account)
+        if date_index is None:
+            date_index = ReservationDateIndex(path=RESERVATION_DATE_INDEX_FILE)
+        self.date_index = date_index
 
     def remind_about_reservations_in_n_days(
         self, n: int, recipients: List[str]
     ) -> None:
-        logging.info(f"Reminding about reservations in {n} days: {recipients} ...")
+        self.send_reminders(self.plan_reminders({n: recipients}))
+
+    def plan_reminders(
+        self, recipients_per_lead_days: Dict[int, List[str]]
+    ) -> List[PlannedReminder]:
+        """
+        Resolves the reservations of all target dates at once, every year folder
+        involved (the next year's near year end) is resolved only once.
+        """
         today = datetime.now()
-        target_day = today + timedelta(days=n)
-        reservations_on_date = self.get_reservations_on_date(target_day)
-        if len(reservations_on_date) == 0:
+        target_days = {n: today + timedelta(days=n) for n in recipients_per_lead_days}
+        reservations_per_day = self.get_reservations_on_dates(target_days.values())
+        return [
+            PlannedReminder(
+                lead_days=n,
+                date=target_days[n],
+                recipients=recipients,
+                reservations=reservations_per_day[
+                    get_date_string_from_date(target_days[n])
+                ],
+            )
+            for n, recipients in recipients_per_lead_days.items()
+        ]
+
+    def send_reminders(self, plan: List[PlannedReminder]) -> None:
+        """All reminders of `plan` are sent together through one batch."""
+        emails: List[OutgoingEmail] = []
+        for reminder in plan:
             logging.info(
-                f"... no reservations found on date {target_day.strftime('%d.%m.%Y')}"
+                f"Reminding about reservations in {reminder.lead_days} days: {reminder.recipients} ..."
             )
+            if len(reminder.reservations) == 0:
+                logging.info(
+                    f"... no reservations found on date {reminder.date.strftime('%d.%m.%Y')}"
+                )
+                continue
+            logging.info(
+                f"... found {len(reminder.reservations)} reservations on date {reminder.date.strftime('%d.%m.%Y')}"
+            )
+            try:
+                emails.append(
+                    self.email_sender.reminder_email(
+                        reservations=reminder.reservations,
+                        date=reminder.date,
+                        recipients=reminder.recipients,
+                    )
+                )
+            except Exception:
+                # an indexed file might have been removed from SharePoint
+                self.date_index.invalidate(reminder.date.year)
+                raise
+        if not emails:
             return
-        logging.info(
-            f"... found {len(reservations_on_date)} reservations on date {target_day.strftime('%d.%m.%Y')}"
-        )
-        return self.email_sender.send_reminder_email(
-            reservations=reservations_on_date,
-            date=target_day,
-            recipients=recipients,
-        )
+        try:
+            self.email_sender.send_emails(emails)
+        except Exception:
+            for year in {reminder.date.year for reminder in plan}:
+                self.date_index.invalidate(year)
+            raise
 
     def get_reservations_on_date(self, date: datetime) -> Dict[str, File]:
-        target_string = get_date_string_from_date(date)
-        folder = get_reservations_folder(
-            account=self.account, year=date.year, redacted=True
-        )
-        files = {item.name: item for item in _get_items(folder)}
-        matching_files = {
-            filename: file
-            for filename, file in files.items()
-            if target_string in filename
+        return self.get_reservations_on_dates([date])[get_date_string_from_date(date)]
+
+    def get_reservations_on_dates(
+        self, dates: Iterable[datetime]
+    ) -> Dict[str, Dict[str, File]]:
+        """Reservations per date string (YYYY_MM_DD) of each of `dates`."""
+        dates = list(dates)
+        folders = {
+            year: self._get_year_folder(year) for year in {d.year for d in dates}
         }
-        return matching_files
+        result = {}
+        for date in dates:
+            date_string = get_date_string_from_date(date)
+            result[date_string] = {
+                filename: _file_in_folder(
+                    folders[date.year],
+                    file.item_id,
+                    filename,
+                    modified=file.modified,
+                    size=file.size,
+                )
+                for filename, file in self.date_index.files_on_date(date_string).items()
+            }
+        return result
+
+    def _get_year_folder(self, year: int) -> Folder:
+        folder = get_reservations_folder(account=self.account, year=year, redacted=True)
+        if self.date_index.needs_reconciliation(year):
+            logging.info(f"... reconciling reservation date index for {year}")
+            self.date_index.reconcile(
+                year,
+                (
+                    (str(item.name), IndexedFile.from_file(item))
+                    for item in _get_items(folder)
+                ),
+            )
+        return folder
@@ -1,16 +1,81 @@
+import argparse
 import logging
 from src.orchestrator import Orchestrator
+from src.utils.env_settings import get_float_from_env
 from src.utils.setup_logging import setup_logging_to_file
 from src.utils.is_test_mode import is_test_mode
 
 setup_logging_to_file()
 
+DAEMON_INTERVAL_ENV_VAR = "HALLENRESERVATION_DAEMON_INTERVAL_SECONDS"
+DEFAULT_DAEMON_INTERVAL_SECONDS = 60.0
+DEFAULT_WEBHOOK_HOST = "127.0.0.1"
+DEFAULT_WEBHOOK_PORT = 8080
+DEFAULT_POLL_FALLBACK_SECONDS = 15 * 60.0
+
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Process Hallenreservation emails.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and process incoming emails on an interval",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help=f"seconds between two runs in daemon mode (default: ${DAEMON_INTERVAL_ENV_VAR} or {DEFAULT_DAEMON_INTERVAL_SECONDS:.0f})",
+    )
+    parser.add_argument(
+        "--webhook-url",
+        default=None,
+        help="public https url Graph posts change notifications to, enables push-driven processing",
+    )
+    parser.add_argument(
+        "--webhook-host",
+        default=DEFAULT_WEBHOOK_HOST,
+        help=f"address the notification receiver binds to (default: {DEFAULT_WEBHOOK_HOST})",
+    )
+    parser.add_argument(
+        "--webhook-port",
+        type=int,
+        default=DEFAULT_WEBHOOK_PORT,
+        help=f"port the notification receiver listens on (default: {DEFAULT_WEBHOOK_PORT})",
+    )
+    parser.add_argument(
+        "--poll-fallback",
+        type=float,
+        default=DEFAULT_POLL_FALLBACK_SECONDS,
+        help=f"poll for unread messages if no notification arrived for this many seconds (default: {DEFAULT_POLL_FALLBACK_SECONDS:.0f})",
+    )
+    args = parser.parse_args()
+
     if is_test_mode():
         logging.info("Running in test mode")
     orchestrator = Orchestrator()
-    orchestrator.run()
+    if args.webhook_url:
+        try:
+            orchestrator.run_push_driven(
+                notification_url=args.webhook_url,
+                host=args.webhook_host,
+                port=args.webhook_port,
+                poll_fallback_seconds=args.poll_fallback,
+            )
+        except KeyboardInterrupt:
+            logging.info("Push-driven processing stopped.")
+    elif args.daemon:
+        interval_seconds = args.interval
+        if interval_seconds is None:
+            interval_seconds = get_float_from_env(
+                DAEMON_INTERVAL_ENV_VAR, DEFAULT_DAEMON_INTERVAL_SECONDS
+            )
+        try:
+            orchestrator.run_forever(interval_seconds=interval_seconds)
+        except KeyboardInterrupt:
+            logging.info("Daemon stopped.")
+    else:
+        orchestrator.run()
 
 
 if __name__ == "__main__":
@@ -1,18 +1,54 @@
 import logging
 import locale
+import os
 from datetime import datetime, timedelta, time
+from enum import Enum
+from time import monotonic, sleep
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 from pathlib import Path
+from O365.mailbox import Folder as MailboxFolder
 from O365.message import Message
 from src.utils.credentials import get_o365_credentials_from_env
-from src.email.email_sender import EmailSender, EmailSendingError
-from src.utils.fixed_o365_account import FixedAccount
+from src.email.email_sender import (
+    EmailOutbox,
+    EmailSender,
+    EmailSendingError,
+    ForwardedEmail,
+)
+from src.utils.fixed_o365_account import FixedAccount, StandInAccount
 from src.utils.is_test_mode import TEST_FILE_PREFIX, is_test_mode
-from src.utils.typed_o365 import _mark_as_read, _mark_as_unread
+from src.utils.message_query import (
+    DEFAULT_MESSAGE_BATCH_SIZE,
+    build_unread_messages_query,
+    process_all_unread,
+)
+from src.utils.typed_o365 import (
+    _get_message,
+    _get_messages,
+)
 from src.email.email_processors.reservation_email_processor import (
+    PreparedAttachment,
     ReservationEmailProcessor,
+    UploadedAttachment,
+)
+from src.utils.change_notifications import (
+    ChangeNotificationReceiver,
+    MailSubscription,
+    new_client_state,
+)
+from src.utils.env_settings import get_bool_from_env, get_int_from_env
+from src.utils.graph_batch import ReadStateBatch
+from src.utils.graph_metrics import GRAPH_METRICS
+from src.utils.mail_delta_sync import MailDeltaSync
+from src.utils.parse_memo import PARSE_MEMO_FILE, ParseMemo
+from src.utils.pdf_signature_index import PDF_SIGNATURE_INDEX_FILE, PdfSignatureIndex
+from src.utils.reservation_date_index import (
+    RESERVATION_DATE_INDEX_FILE,
+    ReservationDateIndex,
 )
 from src.utils.errors import NotAuthenticatedError
+from src.utils.pipeline_stage import DEFAULT_STAGE_QUEUE_SIZE, PipelineStage
 from src.config import (
     DEFAULT_FROM_ADDRESS,
     MONITORED_EMAIL_ADDRESS,
@@ -38,62 +74,475 @@ from src.email.email_processors.subscription_update_email_processor import (
 # sudo update-locale
 locale.setlocale(locale.LC_TIME, "de_CH.UTF-8")
 ZONEINFO = ZoneInfo("Europe/Zurich")
+REMINDER_TIME = time(9, 0)
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+NOTIFICATION_WAIT_SECONDS = 30.0
 TIMESTAMP_FILE = "last_reminder_run.txt"
+DELTA_LINK_FILE = "mail_delta_link.txt"
 if is_test_mode():
     TIMESTAMP_FILE = TEST_FILE_PREFIX + TIMESTAMP_FILE
+    DELTA_LINK_FILE = TEST_FILE_PREFIX + DELTA_LINK_FILE
+# Number of reservation messages processed concurrently, 1 processes messages one after another.
+PIPELINE_WORKERS_ENV_VAR = "HALLENRESERVATION_PIPELINE_WORKERS"
+PIPELINE_QUEUE_SIZE_ENV_VAR = "HALLENRESERVATION_PIPELINE_QUEUE_SIZE"
+MESSAGE_BATCH_SIZE_ENV_VAR = "HALLENRESERVATION_MESSAGE_BATCH_SIZE"
+# Poll the inbox incrementally via the Graph delta endpoint instead of querying all unread messages.
+DELTA_SYNC_ENV_VAR = "HALLENRESERVATION_DELTA_SYNC"
+# Send all Graph requests to a local stand-in (src/benchmarks/fake_graph.py) instead of Microsoft.
+GRAPH_STAND_IN_URL_ENV_VAR = "HALLENRESERVATION_GRAPH_URL"
+# Append the Graph call metrics of every run as a JSON line to this file.
+GRAPH_METRICS_FILE_ENV_VAR = "HALLENRESERVATION_GRAPH_METRICS_FILE"
+
+
+# a reservation message between the PDF and the upload stage of the pipeline
+PreparedReservation = Tuple[
+    Message, ReservationEmailProcessor, List[PreparedAttachment]
+]
+
+
+class MessageKind(Enum):
+    RESERVATION = "reservation"
+    SUBSCRIPTION_UPDATE = "subscription update"
+    UNKNOWN = "unknown"
 
 
 class Orchestrator:
     def __init__(self) -> None:
         self.account = self._set_up_account()
         self.email_sender = EmailSender(account=self.account)
+        # read state changes, alerts and notifications are applied in batches,
+        # see _process_messages
+        self.read_states = ReadStateBatch(self.email_sender.batch_client)
+        self.outbox = EmailOutbox(self.email_sender)
+        # loaded once and shared by all (concurrent) message processors
+        self.signature_index = PdfSignatureIndex(path=PDF_SIGNATURE_INDEX_FILE)
+        self.parse_memo = ParseMemo(path=PARSE_MEMO_FILE)
+        self.date_index = ReservationDateIndex(path=RESERVATION_DATE_INDEX_FILE)
         self._subscription_meta_modified = False
+        # messages deliberately kept unread in the current pass, e.g. after a failed alert
+        self._unhandled_message_ids: Set[str] = set()
+        self._failed_read_states = 0
+        self.pipeline_workers = get_int_from_env(PIPELINE_WORKERS_ENV_VAR, 1)
+        self.pipeline_queue_size = get_int_from_env(
+            PIPELINE_QUEUE_SIZE_ENV_VAR, DEFAULT_STAGE_QUEUE_SIZE
+        )
+        self.message_batch_size = get_int_from_env(
+            MESSAGE_BATCH_SIZE_ENV_VAR, DEFAULT_MESSAGE_BATCH_SIZE
+        )
+        self.delta_sync_enabled = get_bool_from_env(DELTA_SYNC_ENV_VAR, False)
+        self.graph_metrics_file = os.getenv(GRAPH_METRICS_FILE_ENV_VAR)
 
     def run(self) -> None:
-        self.process_incoming_emails()
-        self.send_reminders()
-        if self._subscription_meta_modified:
-            self.push_subscription_metas_to_sharepoint()
+        GRAPH_METRICS.reset()
+        try:
+            self.process_incoming_emails()
+            self.send_reminders()
+            if self._subscription_meta_modified:
+                self.push_subscription_metas_to_sharepoint()
+        finally:
+            self._report_graph_metrics()
+
+    def _report_graph_metrics(self) -> None:
+        logging.info(f"Run finished: {GRAPH_METRICS.summary()}")
+        if self.graph_metrics_file:
+            try:
+                GRAPH_METRICS.append_json(self.graph_metrics_file)
+            except OSError as e:
+                logging.warning(f"... could not write graph metrics: {e}")
+
+    def run_forever(self, interval_seconds: float) -> None:
+        """
+        Daemon mode: keeps the authenticated account and all caches alive and runs
+        a cycle every `interval_seconds`, waking up early for the reminder window.
+        """
+        logging.info(
+            f"Starting daemon mode, running every {interval_seconds:.0f} seconds ..."
+        )
+        while True:
+            started = monotonic()
+            try:
+                self.refresh_token_if_expiring()
+                self.run()
+            except Exception as e:
+                logging.warning("... daemon cycle failed.")
+                logging.warning(e)
+            remaining = interval_seconds - (monotonic() - started)
+            sleep(self._seconds_until_next_cycle(remaining))
+
+    def run_push_driven(
+        self,
+        notification_url: str,
+        host: str,
+        port: int,
+        poll_fallback_seconds: float,
+    ) -> None:
+        """
+        Processes messages as soon as Graph notifies about them. The regular unread
+        query still runs at start-up, when Graph reports missed notifications and
+        whenever no notification arrived for `poll_fallback_seconds`.
+        """
+        client_state = new_client_state()
+        receiver = ChangeNotificationReceiver(host, port, client_state)
+        receiver.start()
+        subscription = MailSubscription(
+            self.account,
+            resource=f"users/{MONITORED_EMAIL_ADDRESS}/mailFolders('Inbox')/messages",
+            notification_url=notification_url,
+            client_state=client_state,
+        )
+        last_poll = float("-inf")
+        try:
+            while True:
+                try:
+                    self.refresh_token_if_expiring()
+                    if receiver.consume_renewal_request():
+                        subscription.expire()
+                    subscription.ensure_active()
+                    message_ids = receiver.drain(timeout=NOTIFICATION_WAIT_SECONDS)
+                    # metrics are reported per batch of notifications (or poll)
+                    GRAPH_METRICS.reset()
+                    try:
+                        if message_ids:
+                            logging.info(
+                                f"Notified about {len(message_ids)} messages ..."
+                            )
+                            self._process_message_ids(message_ids)
+                        seconds_since_activity = min(
+                            receiver.seconds_since_last_notification(),
+                            monotonic() - last_poll,
+                        )
+                        if (
+                            receiver.consume_poll_request()
+                            or seconds_since_activity > poll_fallback_seconds
+                        ):
+                            logging.info("Polling for unread messages ...")
+                            self.process_incoming_emails()
+                            last_poll = monotonic()
+                        self.send_reminders()
+                        if self._subscription_meta_modified:
+                            self.push_subscription_metas_to_sharepoint()
+                    finally:
+                        if GRAPH_METRICS.snapshot():
+                            self._report_graph_metrics()
+                except Exception as e:
+                    logging.warning("... push-driven cycle failed.")
+                    logging.warning(e)
+        finally:
+            receiver.stop()
+            try:
+                subscription.delete()
+            except Exception as e:
+                logging.info("... failed to delete subscription.")
+                logging.info(e)
+
+    def refresh_token_if_expiring(self) -> None:
+        connection = self.account.connection
+        access_token = connection.token_backend.get_access_token(
+            username=connection.username
+        )
+        expires_on = access_token.get("expires_on") if access_token else None
+        if expires_on is not None:
+            expires_at = datetime.fromtimestamp(int(expires_on))
+            if expires_at - datetime.now() > TOKEN_REFRESH_MARGIN:
+                return
+        logging.info("... access token expires soon, refreshing.")
+        connection.refresh_token()
+
+    @staticmethod
+    def _seconds_until_next_cycle(remaining_interval_seconds: float) -> float:
+        now = datetime.now(ZONEINFO)
+        next_reminder_run = datetime.combine(now.date(), REMINDER_TIME, tzinfo=ZONEINFO)
+        if now >= next_reminder_run:
+            next_reminder_run += timedelta(days=1)
+        seconds_until_reminders = (next_reminder_run - now).total_seconds()
+        return max(0.0, min(remaining_interval_seconds, seconds_until_reminders))
 
     def process_incoming_emails(self) -> None:
         mailbox = self.account.mailbox(resource=MONITORED_EMAIL_ADDRESS)
         inbox = mailbox.inbox_folder()
-        messages = inbox.get_messages(
-            query="isRead eq false", order_by="receivedDateTime desc"
+        delta_sync = (
+            MailDeltaSync(inbox, path=DELTA_LINK_FILE)
+            if self.delta_sync_enabled
+            else None
         )
-        for message in messages:
-            logging.info(
-                f"Processing message {message.subject} from {message.sender.address} ..."
-            )
-            if self._is_reservation_email(message):
-                logging.info("... is reservation email")
-                self.process_incoming_reservation_email(message)
-            elif self._is_subscription_update_email(message):
-                logging.info("... is subscription update email")
-                self.process_subscription_update_email(message)
-                self._subscription_meta_modified = True
+        if delta_sync is not None:
+            self._unhandled_message_ids.clear()
+            self._failed_read_states = 0
+            self._process_messages(self._get_unread_messages(inbox, delta_sync))
+            if self._unhandled_message_ids or self._failed_read_states:
+                # the next run pulls the same changes again and retries them
+                logging.info(
+                    f"... {len(self._unhandled_message_ids)} messages left unread, "
+                    f"{self._failed_read_states} read state changes failed, "
+                    "keeping the previous delta link."
+                )
+            else:
+                delta_sync.commit()
+            return
+        process_all_unread(
+            lambda: self._get_unread_messages(inbox, None),
+            self._process_messages,
+            page_size=self.message_batch_size,
+        )
+
+    def _process_message_ids(self, message_ids: List[str]) -> None:
+        mailbox = self.account.mailbox(resource=MONITORED_EMAIL_ADDRESS)
+        messages = []
+        for message_id in message_ids:
+            try:
+                message = _get_message(mailbox, message_id)
+            except Exception as e:
+                logging.info(f"... could not fetch notified message {message_id}.")
+                logging.info(e)
+                continue
+            if message is None or message.is_read:
+                continue
+            messages.append(message)
+        self._process_messages(messages)
+
+    def _process_messages(self, messages: Iterable[Message]) -> None:
+        try:
+            if self.pipeline_workers > 1:
+                self._process_messages_pipelined(messages)
             else:
-                logging.info("... unknown email, skipping.")
-                _mark_as_read(message)
+                for message in messages:
+                    self._process_message(message)
+        finally:
+            # the outcome of the alerts and notifications decides read states
+            self.outbox.flush()
+            failed = self.read_states.flush()
+            if failed:
+                logging.info(
+                    f"... {failed} read state changes failed, "
+                    "their messages are processed again."
+                )
+                self._failed_read_states += failed
+
+    def _get_unread_messages(
+        self, inbox: MailboxFolder, delta_sync: Optional[MailDeltaSync]
+    ) -> Iterable[Message]:
+        if delta_sync is not None:
+            try:
+                changed_messages = delta_sync.get_changed_messages()
+                return [message for message in changed_messages if not message.is_read]
+            except Exception as e:
+                logging.info("... delta sync failed, falling back to full query.")
+                logging.info(e)
+                delta_sync.reset()
+        # only the fields needed for classification are transferred
+        query = build_unread_messages_query()
+        return _get_messages(
+            inbox,
+            limit=None,
+            query=query,
+            order_by="receivedDateTime desc",
+            batch=self.message_batch_size,
+        )
+
+    def _process_message(self, message: Message) -> None:
+        kind = self._classify_message(message)
+        if kind == MessageKind.RESERVATION:
+            self.process_incoming_reservation_email(message)
+        elif kind == MessageKind.SUBSCRIPTION_UPDATE:
+            self._process_subscription_update_message(message)
+        else:
+            self._skip_unknown_message(message)
+
+    def _process_messages_pipelined(self, messages: Iterable[Message]) -> None:
+        """
+        Fetching (this thread), classification and processing run as separate
+        stages connected by bounded queues. Reservation messages go through a PDF
+        stage and an upload stage with several workers each, so slow uploads
+        don't hold up the PDF work of the next messages. Subscription updates stay
+        sequential as they modify the subscription meta file.
+        """
+        logging.info(
+            f"Processing messages pipelined with {self.pipeline_workers} workers ..."
+        )
+        upload_stage: PipelineStage[PreparedReservation] = PipelineStage(
+            "reservation-upload",
+            self._upload_reservation,
+            workers=self.pipeline_workers,
+            queue_size=self.pipeline_queue_size,
+        )
+
+        def prepare_reservation(message: Message) -> None:
+            prepared = self._prepare_reservation(message)
+            if prepared is not None:
+                upload_stage.put(prepared)
+
+        processing_stages: Dict[MessageKind, PipelineStage[Message]] = {
+            MessageKind.RESERVATION: PipelineStage(
+                "reservation-pdf",
+                prepare_reservation,
+                workers=self.pipeline_workers,
+                queue_size=self.pipeline_queue_size,
+            ),
+            MessageKind.SUBSCRIPTION_UPDATE: PipelineStage(
+                "subscription-update",
+                self._process_subscription_update_message,
+                queue_size=self.pipeline_queue_size,
+            ),
+            MessageKind.UNKNOWN: PipelineStage(
+                "unknown",
+                self._skip_unknown_message,
+                queue_size=self.pipeline_queue_size,
+            ),
+        }
+
+        def classify(message: Message) -> None:
+            processing_stages[self._classify_message(message)].put(message)
+
+        classification_stage = PipelineStage(
+            "classification", classify, queue_size=self.pipeline_queue_size
+        )
+        try:
+            for message in messages:
+                classification_stage.put(message)
+        finally:
+            classification_stage.close()
+            for stage in processing_stages.values():
+                stage.close()
+            upload_stage.close()
+        logging.info("... done processing messages pipelined.")
+
+    def _classify_message(self, message: Message) -> MessageKind:
+        logging.info(
+            f"Processing message {message.subject} from {message.sender.address} ..."
+        )
+        if self._is_reservation_email(message):
+            logging.info("... is reservation email")
+            return MessageKind.RESERVATION
+        if self._is_subscription_update_email(message):
+            logging.info("... is subscription update email")
+            return MessageKind.SUBSCRIPTION_UPDATE
+        return MessageKind.UNKNOWN
+
+    def _process_subscription_update_message(self, message: Message) -> None:
+        self.process_subscription_update_email(self._with_body(message))
+        self._subscription_meta_modified = True
+
+    def _with_body(self, message: Message) -> Message:
+        """Messages are listed without their body, fetch the full message."""
+        mailbox = self.account.mailbox(resource=MONITORED_EMAIL_ADDRESS)
+        full_message = _get_message(mailbox, message.object_id)
+        if full_message is None:
+            logging.warning(f"... could not fetch body of message {message.subject}")
+            return message
+        return full_message
+
+    def _skip_unknown_message(self, message: Message) -> None:
+        logging.info(f"... unknown email {message.subject}, skipping.")
+        self.read_states.mark_as_read(message)
 
     def process_incoming_reservation_email(self, message: Message) -> None:
+        processor = None
         try:
-            processor = ReservationEmailProcessor(message=message, account=self.account)
-            processor.process()
-            logging.info("... done, marking as read.")
-            _mark_as_read(message)
+            processor = self._reservation_processor(message)
+            uploaded = processor.upload_attachments()
         except Exception as e:
-            logging.info("... failed, sending alert message...")
-            try:
-                self.email_sender.send_alert_message_for_upload(
-                    message=message, issue=e
+            self._handle_failed_reservation(message, e, processor)
+            return
+        self._send_notifications(message, processor, uploaded)
+
+    def _prepare_reservation(self, message: Message) -> Optional[PreparedReservation]:
+        processor = None
+        try:
+            processor = self._reservation_processor(message)
+            return message, processor, processor.prepare()
+        except Exception as e:
+            self._handle_failed_reservation(message, e, processor)
+            return None
+
+    def _upload_reservation(self, prepared: PreparedReservation) -> None:
+        message, processor, attachments = prepared
+        try:
+            uploaded = processor.upload(attachments)
+        except Exception as e:
+            self._handle_failed_reservation(message, e, processor)
+            return
+        self._send_notifications(message, processor, uploaded)
+
+    def _send_notifications(
+        self,
+        message: Message,
+        processor: ReservationEmailProcessor,
+        uploaded: List[UploadedAttachment],
+    ) -> None:
+        """Queues the notifications, the message is marked as read once they are sent."""
+        notified = [
+            (attachment, attachment.notification)
+            for attachment in uploaded
+            if attachment.notification is not None
+        ]
+        for attachment in uploaded:
+            if attachment.notification is None:
+                processor.record(attachment)
+        if not notified:
+            processor.release_claims()
+            logging.info("... done, marking as read.")
+            self.read_states.mark_as_read(message)
+            return
+
+        def on_sent(sent: List[bool]) -> None:
+            for (attachment, _), was_sent in zip(notified, sent):
+                if was_sent:
+                    processor.record(attachment)
+            processor.release_claims()
+            if all(sent):
+                logging.info(f"... notified about {message.subject}, marking as read.")
+                self.read_states.mark_as_read(message)
+            else:
+                self._handle_failed_reservation(
+                    message,
+                    EmailSendingError(
+                        f"failed to send {sent.count(False)} of {len(sent)} "
+                        "immediate notifications!"
+                    ),
                 )
-                logging.info("... marking as read.")
-                _mark_as_read(message)
-            except EmailSendingError as ese:
-                logging.info("... failed to send alert message for upload error.")
-                logging.info(ese)
-                _mark_as_unread(message)
+
+        self.outbox.add([notification for _, notification in notified], on_sent)
+
+    def _reservation_processor(self, message: Message) -> ReservationEmailProcessor:
+        return ReservationEmailProcessor(
+            message=message,
+            account=self.account,
+            signature_index=self.signature_index,
+            parse_memo=self.parse_memo,
+            date_index=self.date_index,
+        )
+
+    def _handle_failed_reservation(
+        self,
+        message: Message,
+        e: Exception,
+        processor: Optional[ReservationEmailProcessor] = None,
+    ) -> None:
+        if processor is not None:
+            processor.release_claims()
+        logging.info("... failed, sending alert message...")
+        self._send_alert(message, self.email_sender.upload_alert(message, e))
+
+    def _send_alert(self, message: Message, alert: ForwardedEmail) -> None:
+        """Queues the alert, the message is marked as read once it is sent."""
+
+        def on_sent(sent: List[bool]) -> None:
+            if all(sent):
+                logging.info(
+                    f"... alert about {message.subject} sent, marking as read."
+                )
+                self.read_states.mark_as_read(message)
+            else:
+                logging.info(
+                    f"... failed to send alert about {message.subject}, keeping unread."
+                )
+                self._keep_unread(message)
+
+        self.outbox.add([alert], on_sent)
+
+    def _keep_unread(self, message: Message) -> None:
+        self._unhandled_message_ids.add(message.object_id)
+        self.read_states.mark_as_unread(message)
 
     def process_subscription_update_email(self, message: Message) -> None:
         try:
@@ -102,26 +551,19 @@ class Orchestrator:
             )
             processor.process()
             logging.info("... done, marking as read.")
-            _mark_as_read(message)
+            self.read_states.mark_as_read(message)
         except Exception as e:
             logging.info("... failed, sending alert message...")
-            try:
-                self.email_sender.send_alert_message_for_subscription_update(
-                    message=message, issue=e
-                )
-                logging.info("... marking as read.")
-                _mark_as_read(message)
-            except EmailSendingError as ese:
-                logging.info("... failed to send message. Keep as unread.")
-                logging.info(ese)
-                _mark_as_unread(message)
+            self._send_alert(
+                message, self.email_sender.subscription_update_alert(message, e)
+            )
 
     def send_reminders(self) -> None:
         try:
             last_reminders_timestamp = self._load_last_processed_reminders_timestamp()
             now = datetime.now(ZONEINFO)
             yesterday = (now - timedelta(days=1)).date()
-            today_nine_am = datetime.combine(now.date(), time(9, 0), tzinfo=ZONEINFO)
+            today_nine_am = datetime.combine(now.date(), REMINDER_TIME, tzinfo=ZONEINFO)
 
             if not (
                 last_reminders_timestamp.date() <= yesterday and now >= today_nine_am
@@ -142,11 +584,11 @@ class Orchestrator:
                 f"... identified targets per lead day number: {targets_per_lead_day_number}"
             )
 
-            reservation_reminder = ReservationReminderHandler(account=self.account)
-            for lead_days, targets in targets_per_lead_day_number.items():
-                reservation_reminder.remind_about_reservations_in_n_days(
-                    n=lead_days, recipients=targets
-                )
+            reservation_reminder = ReservationReminderHandler(
+                account=self.account, date_index=self.date_index
+            )
+            plan = reservation_reminder.plan_reminders(targets_per_lead_day_number)
+            reservation_reminder.send_reminders(plan)
 
             logging.info("... done processing reminders.")
             self._dump_last_processed_reminders_timestamp(now)
@@ -188,6 +630,10 @@ class Orchestrator:
         return True
 
     def _set_up_account(self) -> FixedAccount:
+        graph_url = os.getenv(GRAPH_STAND_IN_URL_ENV_VAR)
+        if graph_url:
+            logging.warning(f"Using the Graph stand-in at {graph_url}")
+            return StandInAccount.for_graph_url(graph_url)
         credentials = get_o365_credentials_from_env()
         account = FixedAccount(credentials)
 
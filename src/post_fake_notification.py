@@ -0,0 +1,19 @@
+import argparse
+from src.utils.change_notifications import post_fake_notification
+
+
+def main() -> None:
+    """Stands in for Graph and posts a change notification to a local receiver."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("url", help="url of the notification receiver")
+    parser.add_argument("client_state", help="client state the receiver expects")
+    parser.add_argument("message_ids", nargs="+", help="ids of the notified messages")
+    args = parser.parse_args()
+    status = post_fake_notification(
+        args.url, message_ids=args.message_ids, client_state=args.client_state
+    )
+    print(f"Receiver answered with status {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from O365.drive import File
+from src.config import SUBSCRIPTION_META_FILE
+from src.utils.env_settings import get_int_from_env
+from src.utils.is_test_mode import TEST_FILE_PREFIX, is_test_mode
+from src.utils.pdf_signature_index import get_drive_item_version
+from src.utils.typed_o365 import _download_bytes
+
+BLOB_CACHE_DIR = str(Path(SUBSCRIPTION_META_FILE).with_name("blob_cache"))
+BLOB_CACHE_MAX_MB_ENV_VAR = "HALLENRESERVATION_BLOB_CACHE_MAX_MB"
+BLOB_CACHE_MAX_FILES_ENV_VAR = "HALLENRESERVATION_BLOB_CACHE_MAX_FILES"
+# small enough for an SD card, large enough for the reminders of several weeks
+DEFAULT_BLOB_CACHE_MAX_MB = 64
+DEFAULT_BLOB_CACHE_MAX_FILES = 1000
+
+
+class BlobCache:
+    """
+    Bounded on-disk LRU cache for the content of SharePoint items, keyed by item
+    id and item version. Each item keeps only its latest version. The
+    modification time of a cache file is its last use, so the recency order
+    survives restarts without an index file.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int) -> None:
+        self.directory = Path(directory)
+        if is_test_mode():
+            self.directory = self.directory.with_name(
+                TEST_FILE_PREFIX + self.directory.name
+            )
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        # cache file name -> size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._load()
+
+    def get(self, item_id: str, version: str) -> Optional[bytes]:
+        name = self._file_name(item_id, version)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            path = self.directory / name
+            try:
+                content = path.read_bytes()
+                os.utime(path)
+            except OSError:
+                self._forget(name)
+                return None
+            self._entries.move_to_end(name)
+            return content
+
+    def put(self, item_id: str, version: str, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+        name = self._file_name(item_id, version)
+        with self._lock:
+            item_prefix = name.split("-", 1)[0] + "-"
+            for stale in [n for n in self._entries if n.startswith(item_prefix)]:
+                self._remove(stale)
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                temp_path = self.directory / (name + ".tmp")
+                temp_path.write_bytes(content)
+                os.replace(temp_path, self.directory / name)
+            except OSError as e:
+                logging.warning(f"... could not write blob cache file {name}: {e}")
+                return
+            self._entries[name] = len(content)
+            self._size += len(content)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._entries and (
+            self._size > self.max_bytes or len(self._entries) > self.max_files
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, name: str) -> None:
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"... could not remove blob cache file {name}: {e}")
+        self._forget(name)
+
+    def _forget(self, name: str) -> None:
+        self._size -= self._entries.pop(name, 0)
+
+    def _load(self) -> None:
+        if not self.directory.is_dir():
+            return
+        files = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp":
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def _file_name(item_id: str, version: str) -> str:
+        item_hash = hashlib.sha256(item_id.encode("utf-8")).hexdigest()[:32]
+        version_hash = hashlib.sha256(version.encode("utf-8")).hexdigest()[:16]
+        return f"{item_hash}-{version_hash}"
+
+
+_blob_cache: Optional[BlobCache] = None
+_blob_cache_lock = threading.Lock()
+
+
+def get_blob_cache() -> BlobCache:
+    global _blob_cache
+    with _blob_cache_lock:
+        if _blob_cache is None:
+            max_mb = get_int_from_env(
+                BLOB_CACHE_MAX_MB_ENV_VAR, DEFAULT_BLOB_CACHE_MAX_MB
+            )
+            _blob_cache = BlobCache(
+                BLOB_CACHE_DIR,
+                max_bytes=max_mb * 1024 * 1024,
+                max_files=get_int_from_env(
+                    BLOB_CACHE_MAX_FILES_ENV_VAR, DEFAULT_BLOB_CACHE_MAX_FILES
+                ),
+            )
+        return _blob_cache
+
+
+def download_cached(file: File) -> bytes:
+    """
+    The content of `file`, downloaded only if the cache has no copy of its
+    current version. Items without a modification time are always downloaded,
+    their version is unknown. The cache is stored in plaintext, only use it for
+    redacted items.
+    """
+    if file.modified is None:
+        return _download_bytes(file)
+    cache = get_blob_cache()
+    item_id = str(file.object_id)
+    version = get_drive_item_version(file)
+    content = cache.get(item_id, version)
+    if content is None:
+        content = _download_bytes(file)
+        cache.put(item_id, version, content)
+    return content
@@ -0,0 +1,234 @@
+import datetime as dt
+import hmac
+import json
+import logging
+import queue
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+from O365.account import Account
+
+# Graph allows at most 10080 minutes for Outlook message subscriptions.
+SUBSCRIPTION_LIFETIME = dt.timedelta(days=3)
+SUBSCRIPTION_RENEWAL_MARGIN = dt.timedelta(hours=12)
+MAX_NOTIFICATION_BODY_BYTES = 1024 * 1024
+LIFECYCLE_EVENTS_REQUIRING_POLL = {"missed", "subscriptionRemoved"}
+LIFECYCLE_EVENTS_REQUIRING_RENEWAL = {"reauthorizationRequired", "subscriptionRemoved"}
+
+
+class ChangeNotificationReceiver:
+    """
+    Minimal HTTP endpoint for Graph change notifications. It answers the
+    subscription validation handshake, checks the client state of each
+    notification and queues the ids of the notified messages.
+    """
+
+    def __init__(self, host: str, port: int, client_state: str) -> None:
+        self.client_state = client_state
+        self.message_ids: "queue.Queue[str]" = queue.Queue()
+        self._last_notification_at = monotonic()
+        self._poll_requested = threading.Event()
+        self._renewal_requested = threading.Event()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="notifications", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        return int(self._server.server_address[1])
+
+    def start(self) -> None:
+        self._thread.start()
+        logging.info(f"... listening for change notifications on port {self.port}")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def seconds_since_last_notification(self) -> float:
+        return monotonic() - self._last_notification_at
+
+    def consume_poll_request(self) -> bool:
+        requested = self._poll_requested.is_set()
+        self._poll_requested.clear()
+        return requested
+
+    def consume_renewal_request(self) -> bool:
+        requested = self._renewal_requested.is_set()
+        self._renewal_requested.clear()
+        return requested
+
+    def drain(self, timeout: float) -> List[str]:
+        """Waits up to `timeout` seconds for the first id, then returns all queued ids."""
+        try:
+            message_ids = [self.message_ids.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                message_ids.append(self.message_ids.get_nowait())
+            except queue.Empty:
+                break
+        # the same message can be notified more than once
+        return list(dict.fromkeys(message_ids))
+
+    def handle_notifications(self, payload: Dict[str, Any]) -> int:
+        accepted = 0
+        for notification in payload.get("value", []):
+            if not isinstance(notification, dict):
+                continue
+            if not hmac.compare_digest(
+                str(notification.get("clientState", "")), self.client_state
+            ):
+                logging.warning("... ignoring notification with invalid client state")
+                continue
+            self._last_notification_at = monotonic()
+            lifecycle_event = notification.get("lifecycleEvent")
+            if lifecycle_event is not None:
+                logging.info(f"... received lifecycle notification {lifecycle_event}")
+                if lifecycle_event in LIFECYCLE_EVENTS_REQUIRING_POLL:
+                    self._poll_requested.set()
+                if lifecycle_event in LIFECYCLE_EVENTS_REQUIRING_RENEWAL:
+                    self._renewal_requested.set()
+                continue
+            message_id = (notification.get("resourceData") or {}).get("id")
+            if message_id:
+                self.message_ids.put(str(message_id))
+                accepted += 1
+        return accepted
+
+    def _make_handler(self) -> type[BaseHTTPRequestHandler]:
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                query = parse_qs(urlparse(self.path).query)
+                validation_tokens = query.get("validationToken")
+                if validation_tokens:
+                    # subscription handshake: echo the token as plain text
+                    self._respond(200, validation_tokens[0], "text/plain")
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_NOTIFICATION_BODY_BYTES:
+                    self._respond(400, "invalid body length")
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._respond(400, "invalid json")
+                    return
+                if not isinstance(payload, dict):
+                    self._respond(400, "invalid payload")
+                    return
+                receiver.handle_notifications(payload)
+                self._respond(202, "")
+
+            def _respond(
+                self, status: int, body: str, content_type: str = "text/plain"
+            ) -> None:
+                encoded = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug(format % args)
+
+        return Handler
+
+
+class MailSubscription:
+    """Creates and renews the Graph subscription for new messages of a folder."""
+
+    def __init__(
+        self, account: Account, resource: str, notification_url: str, client_state: str
+    ) -> None:
+        self.account = account
+        self.resource = resource
+        self.notification_url = notification_url
+        self.client_state = client_state
+        self.subscription_id: Optional[str] = None
+        self.expires_at: Optional[dt.datetime] = None
+
+    def ensure_active(self) -> None:
+        now = dt.datetime.now(dt.timezone.utc)
+        if (
+            self.subscription_id is not None
+            and self.expires_at is not None
+            and self.expires_at - now > SUBSCRIPTION_RENEWAL_MARGIN
+        ):
+            return
+        expiration = now + SUBSCRIPTION_LIFETIME
+        subscriptions = self.account.subscriptions()
+        result = None
+        if self.subscription_id is not None:
+            logging.info(f"... renewing subscription {self.subscription_id}")
+            try:
+                result = subscriptions.renew_subscription(
+                    self.subscription_id, expiration_datetime=expiration
+                )
+            except Exception as e:
+                logging.info("... renewing failed, creating a new subscription.")
+                logging.info(e)
+        if result is None:
+            logging.info(f"... creating subscription for {self.resource}")
+            result = subscriptions.create_subscription(
+                self.notification_url,
+                resource=self.resource,
+                change_type="created",
+                expiration_datetime=expiration,
+                client_state=self.client_state,
+                # lifecycle events (missed, reauthorizationRequired, ...) share the endpoint
+                lifecycle_notification_url=self.notification_url,
+            )
+        if result is None:
+            raise RuntimeError(f"Could not subscribe to {self.resource}")
+        self.subscription_id = str(result["id"])
+        self.expires_at = expiration
+
+    def expire(self) -> None:
+        """The next `ensure_active` renews the subscription, or recreates it if it was removed."""
+        self.expires_at = None
+
+    def delete(self) -> None:
+        if self.subscription_id is None:
+            return
+        self.account.subscriptions().delete_subscription(self.subscription_id)
+        self.subscription_id = None
+
+
+def new_client_state() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def post_fake_notification(
+    url: str, message_ids: List[str], client_state: str, subscription_id: str = "fake"
+) -> int:
+    """Posts a notification in the Graph format, stands in for Graph in local tests."""
+    payload = {
+        "value": [
+            {
+                "subscriptionId": subscription_id,
+                "clientState": client_state,
+                "changeType": "created",
+                "resource": f"messages/{message_id}",
+                "resourceData": {"id": message_id},
+            }
+            for message_id in message_ids
+        ]
+    }
+    request = Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urlopen(request) as response:
+        return int(response.status)
@@ -0,0 +1,32 @@
+import os
+
+
+def get_int_from_env(env_var_key: str, default: int) -> int:
+    value = os.getenv(env_var_key)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise EnvironmentError(
+            f"Environment variable '{env_var_key}' must be an integer, got {value!r}"
+        )
+
+
+def get_float_from_env(env_var_key: str, default: float) -> float:
+    value = os.getenv(env_var_key)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise EnvironmentError(
+            f"Environment variable '{env_var_key}' must be a number, got {value!r}"
+        )
+
+
+def get_bool_from_env(env_var_key: str, default: bool) -> bool:
+    value = os.getenv(env_var_key)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() == "true"
@@ -1,14 +1,26 @@
 import logging
 import re
 import unicodedata
-from typing import List, Optional, Set, Any
+from dataclasses import dataclass, field
+from typing import List, Optional, Set, Tuple, Any
 from datetime import datetime
 from pydantic import BaseModel
 
 from src.utils.errors import ClassificationError
 
 DATE_REGEX_STR = r"\b\d{2}\.\d{2}\.\d{4}\b"
+DATE_REGEX = re.compile(DATE_REGEX_STR)
 PAGE_NUMBER_REGEX = re.compile(r"Seite (\d+)/(\d+)")
+# Note: at least Defintivie Buchungsbestätigung as well as "Geänderte definitive Buchungsbestätigung" or "Provisorische Buchungsbestätigung" are possible
+BOOKING_ID_REGEX = re.compile(r"Buchungsbestätigung \((\d+)\)")
+RENTAL_OPTIONS_REGEX = re.compile(r"Mietoptionen(.*?)Kosten", re.DOTALL)
+PHONE_NUMBER_REGEX = re.compile(
+    r"(?<!\d)(?:(?:\+41|0041)[\s.-]?|0)\d{2}[\s.-]?\d{3}[\s.-]?\d{2}[\s.-]?\d{2}(?!\d)",
+    re.MULTILINE,
+)
+EMAIL_ADDRESS_REGEX = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9_.-]+\.[a-zA-Z0-9-._]+")
+LOCATION_FOLLOWING_LINE_PREFIX = "Adresse"
+MAX_ADDRESS_BLOCK_LINES = 10
 
 
 class AttachmentMeta(BaseModel):
@@ -18,20 +30,38 @@ class AttachmentMeta(BaseModel):
     locations: Set[str] = set()
 
 
+@dataclass
+class ParsedAttachmentContent:
+    booking_id: str
+    address_block: List[str]
+    dates: List[datetime]
+    locations: Set[str] = field(default_factory=set)
+    phone_numbers: Set[str] = field(default_factory=set)
+    email_addresses: Set[str] = field(default_factory=set)
+
+    @property
+    def organization(self) -> Optional[str]:
+        return self.address_block[0] if self.address_block else None
+
+    @property
+    def sensitive_content(self) -> Set[str]:
+        return self.phone_numbers | self.email_addresses | set(self.address_block)
+
+
 class FindAttachmentMeta:
+    """
+    Extracts the booking meta data from the text of a confirmation. The text is
+    parsed once by `parse`, the `_find_*` methods are views on the result of the
+    last parse.
+    """
+
+    def __init__(self) -> None:
+        self._last_parse: Optional[Tuple[str, ParsedAttachmentContent]] = None
+
     def find(self, attachment_content: str) -> List[AttachmentMeta]:
-        booking_id = self._find_booking_id(attachment_content)
-        if not booking_id:
-            logging.warning("Could not find booking ID in attachment content!")
-            raise ClassificationError(
-                "Could not find booking ID in attachment content!"
-            )
-        org = self._find_organization(attachment_content, booking_id=booking_id)
-        dates = self._find_dates(attachment_content)
-        locations = self._find_booked_locations(
-            attachment_content, booking_id=booking_id
-        )
-        sensitive_content = self._find_sensitive_content(attachment_content)
+        parsed = self.parse(attachment_content)
+        org = parsed.organization
+        sensitive_content = parsed.sensitive_content
         sensitive_content = self._remove_string_from_sensitive_content(
             sensitive_content, ""
         )
@@ -40,123 +70,140 @@ class FindAttachmentMeta:
                 sensitive_content, org
             )
         metas = []
-        for date in dates:
-            clean_filename = (
-                f"Reservation_{get_date_string_from_date(date)}_{org}_{booking_id}.pdf"
-            )
+        for date in parsed.dates:
+            clean_filename = f"Reservation_{get_date_string_from_date(date)}_{org}_{parsed.booking_id}.pdf"
             clean_filename = clean_filename_for_sharepoint(clean_filename)
             metas.append(
                 AttachmentMeta(
                     clean_filename=clean_filename,
                     date=date,
                     sensitive_content=sensitive_content,
-                    locations=locations,
+                    locations=parsed.locations,
                 )
             )
         return metas
 
+    def parse(self, attachment_content: str) -> ParsedAttachmentContent:
+        if self._last_parse is not None and self._last_parse[0] is attachment_content:
+            return self._last_parse[1]
+        booking_id = self._parse_booking_id(attachment_content)
+        address_block = self._parse_address_block(attachment_content, booking_id)
+        parsed = ParsedAttachmentContent(
+            booking_id=booking_id,
+            address_block=address_block,
+            dates=self._parse_dates(attachment_content),
+            locations=self._parse_booked_locations(attachment_content, booking_id),
+            phone_numbers=set(PHONE_NUMBER_REGEX.findall(attachment_content)),
+            email_addresses=set(EMAIL_ADDRESS_REGEX.findall(attachment_content)),
+        )
+        self._last_parse = (attachment_content, parsed)
+        return parsed
+
     def _find_organization(
         self, attachment_content: str, booking_id: str
     ) -> Optional[str]:
-        address_block = self._find_address_block(
-            attachment_content, booking_id=booking_id
-        )
-        return address_block[0] if address_block else None
+        return self.parse(attachment_content).organization
 
     def _find_address_block(
         self, attachment_content: str, booking_id: str
     ) -> List[str]:
-        if booking_id + "\n" != attachment_content[: len(booking_id) + 1]:
+        return self.parse(attachment_content).address_block
+
+    def _find_booking_id(self, attachment_content: str) -> Optional[str]:
+        return self.parse(attachment_content).booking_id
+
+    def _find_dates(self, attachment_content: str) -> List[datetime]:
+        return self.parse(attachment_content).dates
+
+    def _find_sensitive_content(self, attachment_content: str) -> Set[str]:
+        return self.parse(attachment_content).sensitive_content
+
+    def _find_phone_numbers(self, attachment_content: str) -> Set[str]:
+        return self.parse(attachment_content).phone_numbers
+
+    def _find_email_addresses(self, attachment_content: str) -> Set[str]:
+        return self.parse(attachment_content).email_addresses
+
+    def _find_booked_locations(
+        self, attachment_content: str, booking_id: str
+    ) -> Set[str]:
+        return self.parse(attachment_content).locations
+
+    def _remove_string_from_sensitive_content(
+        self, sensitive_content: Set[str], string_to_remove: str
+    ) -> Set[str]:
+        if string_to_remove in sensitive_content:
+            sensitive_content.remove(string_to_remove)
+        return sensitive_content
+
+    @staticmethod
+    def _parse_booking_id(attachment_content: str) -> str:
+        matches = BOOKING_ID_REGEX.search(attachment_content)
+        if matches:
+            return matches.group(1)
+        logging.warning("No booking ID found!")
+        raise ClassificationError("No booking ID found!")
+
+    @staticmethod
+    def _parse_address_block(attachment_content: str, booking_id: str) -> List[str]:
+        if not attachment_content.startswith(booking_id + "\n"):
             logging.warning(
                 f"Booking ID {booking_id} does not match start of attachment content!"
             )
             raise ClassificationError(
                 "Booking ID does not match start of attachment content!"
             )
-        lines = attachment_content[len(booking_id) + 1 :].splitlines()
+        # the block ends before the line that repeats the booking id
         address_block = []
-        for line in lines:
+        lines = attachment_content[len(booking_id) + 1 :].splitlines()
+        for num_lines, line in enumerate(lines):
             if booking_id in line:
                 break
-            address_block.append(line)
-        if len(address_block) > 10:
-            logging.warning(
-                "Address block is too long! This might indicate an error in the detection."
-            )
-            raise ClassificationError("Address block is too long!")
-        address_block = [line.strip() for line in address_block if line.strip()]
-        address_block = [
-            line for line in address_block if not re.search(DATE_REGEX_STR, line)
-        ]
+            if num_lines == MAX_ADDRESS_BLOCK_LINES:
+                logging.warning(
+                    "Address block is too long! This might indicate an error in the detection."
+                )
+                raise ClassificationError("Address block is too long!")
+            line = line.strip()
+            if line and not DATE_REGEX.search(line):
+                address_block.append(line)
         return address_block
 
-    def _find_booking_id(self, attachment_content: str) -> Optional[str]:
-        matches = re.search(
-            r"Buchungsbestätigung \((\d+)\)", attachment_content
-        )  # Note: at least Defintivie Buchungsbestätigung as well as "Geänderte definitive Buchungsbestätigung" or "Provisorische Buchungsbestätigung" are possible
-        if matches:
-            booking_id = matches.group(1)
-            return booking_id
-        logging.warning("No booking ID found!")
-        raise ClassificationError("No booking ID found!")
-
-    def _find_dates(self, attachment_content: str) -> List[datetime]:
-        subsequences = re.findall(
-            r"Mietoptionen(.*?)Kosten", attachment_content, re.DOTALL
-        )
+    @staticmethod
+    def _parse_dates(attachment_content: str) -> List[datetime]:
         found_dates = []
-        for subseq in subsequences:
-            dates = re.findall(DATE_REGEX_STR, subseq)
-            found_dates.extend(dates)
+        for match in RENTAL_OPTIONS_REGEX.finditer(attachment_content):
+            found_dates.extend(DATE_REGEX.findall(match.group(1)))
         if len(found_dates) == 0:
             logging.warning("No dates found!")
             raise ClassificationError("No dates found!")
         unique_dates = list(set(found_dates))
         return [datetime.strptime(date, "%d.%m.%Y") for date in unique_dates]
 
-    def _find_sensitive_content(self, attachment_content: str) -> Set[str]:
-        sensitive_content = set()
-        sensitive_content.update(self._find_phone_numbers(attachment_content))
-        sensitive_content.update(self._find_email_addresses(attachment_content))
-        booking_id = self._find_booking_id(attachment_content)
-        if booking_id:
-            sensitive_content.update(
-                set(self._find_address_block(attachment_content, booking_id=booking_id))
-            )
-        return sensitive_content
-
-    def _remove_string_from_sensitive_content(
-        self, sensitive_content: Set[str], string_to_remove: str
-    ) -> Set[str]:
-        if string_to_remove in sensitive_content:
-            sensitive_content.remove(string_to_remove)
-        return sensitive_content
-
-    def _find_phone_numbers(self, attachment_content: str) -> Set[str]:
-        phone_number_regex = r"(?<!\d)(?:(?:\+41|0041)[\s.-]?|0)\d{2}[\s.-]?\d{3}[\s.-]?\d{2}[\s.-]?\d{2}(?!\d)"
-        phone_numbers = re.findall(phone_number_regex, attachment_content, re.MULTILINE)
-        return set(phone_numbers)
-
-    def _find_email_addresses(self, attachment_content: str) -> Set[str]:
-        email_regex = r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9_.-]+\.[a-zA-Z0-9-._]+"
-        email_addresses = re.findall(email_regex, attachment_content)
-        return set(email_addresses)
-
-    def _find_booked_locations(
-        self, attachment_content: str, booking_id: str
-    ) -> Set[str]:
+    @staticmethod
+    def _parse_booked_locations(attachment_content: str, booking_id: str) -> Set[str]:
+        """
+        A booked location is the line before a line starting with "Adresse". On
+        page breaks the booking ID and page numbers interfere with the detection,
+        so they are removed and empty lines are skipped beforehand.
+        """
         booked_locations = set()
-        # on pagebreaks the booking ID and page numbers interfere with the detection of the booked locations, so we remove them beforehand
-        attachment_content = attachment_content.replace(
-            booking_id, ""
-        )  # Remove booking ID to avoid false positives
-        attachment_content = re.sub(
-            PAGE_NUMBER_REGEX, "", attachment_content
-        )  # Remove page numbers to avoid false positives
-        attachment_content = re.sub(r"\n+", "\n", attachment_content)
-        subsequences = re.findall(r"\n(.*?)\nAdresse", attachment_content)
-        for subseq in subsequences:
-            booked_locations.add(subseq.strip())
+        raw_lines = attachment_content.split("\n")
+        lines = []
+        for raw_line in raw_lines:
+            line = PAGE_NUMBER_REGEX.sub("", raw_line.replace(booking_id, ""))
+            if line:
+                lines.append(line)
+        # without a line break in front the first line can't be a location
+        first_candidate = 0 if raw_lines[0].replace(booking_id, "") == "" else 1
+        i = first_candidate
+        while i + 1 < len(lines):
+            if lines[i + 1].startswith(LOCATION_FOLLOWING_LINE_PREFIX):
+                booked_locations.add(lines[i].strip())
+                # the "Adresse" line itself can't be the next location
+                i += 2
+            else:
+                i += 1
         return booked_locations
 
 
@@ -0,0 +1,91 @@
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from O365.drive import File
+
+SUFFIXED_STEM_REGEX = re.compile(r"^(.*)_(\d+)$")
+
+
+class FolderIndex:
+    """
+    In-memory index over the file names of a SharePoint folder.
+    Files are grouped by base name, where "name.pdf" and "name_3.pdf" both
+    belong to the base name "name" (suffix None and 3 respectively).
+
+    Concurrent uploaders must hold `lock` while choosing a name and reserve it
+    before releasing the lock, so two uploads never pick the same name. A
+    reservation is resolved by `add` or `release`, uploaders of the same base
+    name wait for it with `wait_for_change` to compare against the new file.
+    """
+
+    def __init__(self, items: Iterable[File]) -> None:
+        self.lock = threading.RLock()
+        self._changed = threading.Condition(self.lock)
+        self._items_by_name: Dict[str, Optional[File]] = {}
+        self._suffixes_by_base_name: Dict[str, Dict[str, Optional[int]]] = {}
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._items_by_name
+
+    def __len__(self) -> int:
+        return len(self._items_by_name)
+
+    def add(self, item: File) -> None:
+        with self.lock:
+            self._register(item.name, item)
+            self._changed.notify_all()
+
+    def reserve(self, name: str) -> None:
+        with self.lock:
+            self._register(name, None)
+
+    def release(self, name: str) -> None:
+        with self.lock:
+            if self._items_by_name.get(name, False) is not None:
+                return
+            del self._items_by_name[name]
+            for base_name, _ in self._split_name(name):
+                self._suffixes_by_base_name.get(base_name, {}).pop(name, None)
+            self._changed.notify_all()
+
+    def items(self) -> List[File]:
+        return [item for item in self._items_by_name.values() if item is not None]
+
+    def items_with_base_name(self, base_name: str) -> List[File]:
+        names = self._suffixes_by_base_name.get(base_name, {})
+        items = [self._items_by_name[name] for name in names]
+        return [item for item in items if item is not None]
+
+    def has_reservations(self, base_name: str) -> bool:
+        names = self._suffixes_by_base_name.get(base_name, {})
+        return any(self._items_by_name[name] is None for name in names)
+
+    def wait_for_change(self) -> None:
+        """Blocks until a file is added or a reservation released, hold `lock`."""
+        self._changed.wait()
+
+    def next_suffix(self, base_name: str) -> int:
+        suffixes = [
+            suffix
+            for suffix in self._suffixes_by_base_name.get(base_name, {}).values()
+            if suffix is not None
+        ]
+        return max(suffixes) + 1 if suffixes else 1
+
+    def _register(self, name: str, item: Optional[File]) -> None:
+        self._items_by_name[name] = item
+        for base_name, suffix in self._split_name(name):
+            self._suffixes_by_base_name.setdefault(base_name, {})[name] = suffix
+
+    @staticmethod
+    def _split_name(name: str) -> List[Tuple[str, Optional[int]]]:
+        stem = name.rsplit(".", 1)[0]
+        # the stem itself might end in digits (e.g. the booking id), so the
+        # name is registered both as unsuffixed and as suffixed candidate.
+        candidates: List[Tuple[str, Optional[int]]] = [(stem, None)]
+        match = SUFFIXED_STEM_REGEX.match(stem)
+        if match:
+            candidates.append((match.group(1), int(match.group(2))))
+        return candidates
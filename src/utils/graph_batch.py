@@ -0,0 +1,274 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from time import sleep
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from O365.connection import Connection
+from O365.message import Message
+from requests.exceptions import HTTPError
+from src.utils.graph_metrics import GRAPH_METRICS
+from src.utils.typed_o365 import _build_url
+
+# Graph accepts at most 20 requests per $batch call.
+MAX_BATCH_REQUESTS = 20
+# Outlook rejects requests above 4 MB, a batch is one request.
+MAX_BATCH_BODY_BYTES = 4 * 1024 * 1024
+MAX_BATCH_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 1.0
+MAX_RETRY_AFTER_SECONDS = 60.0
+# throttled or temporarily failing requests, the same statuses O365 retries
+RETRIABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class BatchRequest:
+    method: str
+    # relative to the service url, e.g. "/users/{mailbox}/messages/{id}"
+    url: str
+    body: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class BatchResponse:
+    # 0 if Graph returned no response for the request
+    status: int
+    body: Any = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+class GraphBatchClient:
+    """
+    Submits independent requests through the Graph JSON $batch endpoint, up to
+    MAX_BATCH_REQUESTS per call. Every request gets its own response; throttled
+    or unavailable requests are retried individually in a later batch, the
+    others are not sent again. A request too large for a batch is sent on its
+    own.
+    """
+
+    def __init__(
+        self,
+        connection: Connection,
+        service_url: str,
+        max_attempts: int = MAX_BATCH_ATTEMPTS,
+        backoff_seconds: float = RETRY_BACKOFF_SECONDS,
+    ) -> None:
+        self.connection = connection
+        self.service_url = service_url
+        self.batch_url = service_url.rstrip("/") + "/$batch"
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+    def relative_url(self, url: str) -> str:
+        """`url` as built by O365, relative to the service url for use in a batch."""
+        if url.startswith(self.service_url):
+            url = url[len(self.service_url) :]
+        return "/" + url.lstrip("/")
+
+    def execute(self, requests: Sequence[BatchRequest]) -> List[BatchResponse]:
+        """The responses in the order of `requests`, failed ones have a non 2xx status."""
+        responses = [BatchResponse(status=0) for _ in requests]
+        pending = list(range(len(requests)))
+        sizes = [_body_size(request) for request in requests]
+        for attempt in range(1, self.max_attempts + 1):
+            retry = []
+            retry_after = 0.0
+            for chunk in self._chunks(sizes, pending):
+                if sizes[chunk[0]] > MAX_BATCH_BODY_BYTES:
+                    results = {chunk[0]: self._send(requests[chunk[0]])}
+                else:
+                    results = self._post(requests, chunk)
+                for index, response in results.items():
+                    responses[index] = response
+                    if response.status in RETRIABLE_STATUSES:
+                        retry.append(index)
+                        retry_after = max(
+                            retry_after, self._retry_after(response, attempt)
+                        )
+            if not retry or attempt == self.max_attempts:
+                break
+            logging.info(
+                f"... retrying {len(retry)} batched requests in {retry_after:.1f} s"
+            )
+            sleep(retry_after)
+            pending = retry
+        return responses
+
+    def _post(
+        self, requests: Sequence[BatchRequest], indices: List[int]
+    ) -> Dict[int, BatchResponse]:
+        payload = {
+            "requests": [
+                self._request_data(index, requests[index]) for index in indices
+            ]
+        }
+        try:
+            with GRAPH_METRICS.measure("batch"):
+                response = self.connection.post(self.batch_url, data=payload)
+                data: Dict[str, Any] = response.json()
+        except HTTPError as e:
+            # the requests of a failed batch call fail (or are retried if it was
+            # throttled), the other chunks are still sent
+            failure = _failure(e)
+            if failure.status not in RETRIABLE_STATUSES:
+                logging.warning(f"... batch of {len(indices)} requests failed: {e}")
+            return {index: failure for index in indices}
+        results = {index: BatchResponse(status=0) for index in indices}
+        for item in data.get("responses", []):
+            index = int(item["id"])
+            if index in results:
+                results[index] = BatchResponse(
+                    status=int(item.get("status", 0)),
+                    body=item.get("body"),
+                    headers=dict(item.get("headers") or {}),
+                )
+        return results
+
+    def _send(self, request: BatchRequest) -> BatchResponse:
+        url = self.service_url.rstrip("/") + request.url
+        try:
+            with GRAPH_METRICS.measure("unbatched"):
+                response = self.connection.oauth_request(
+                    url, request.method, data=request.body
+                )
+        except HTTPError as e:
+            logging.warning(f"... {request.method} {request.url} failed: {e}")
+            return _failure(e)
+        try:
+            body = response.json() if response.content else None
+        except ValueError:
+            body = None
+        return BatchResponse(
+            status=response.status_code, body=body, headers=dict(response.headers)
+        )
+
+    @staticmethod
+    def _request_data(index: int, request: BatchRequest) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "id": str(index),
+            "method": request.method,
+            "url": request.url,
+        }
+        if request.body is not None:
+            data["body"] = request.body
+            data["headers"] = {"Content-Type": "application/json"}
+        return data
+
+    @staticmethod
+    def _chunks(sizes: Sequence[int], indices: List[int]) -> Iterator[List[int]]:
+        chunk: List[int] = []
+        chunk_bytes = 0
+        for index in indices:
+            num_bytes = sizes[index]
+            if num_bytes > MAX_BATCH_BODY_BYTES:
+                # would exceed the limit alone, sent outside of a batch
+                yield [index]
+                continue
+            if chunk and (
+                len(chunk) == MAX_BATCH_REQUESTS
+                or chunk_bytes + num_bytes > MAX_BATCH_BODY_BYTES
+            ):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(index)
+            chunk_bytes += num_bytes
+        if chunk:
+            yield chunk
+
+    def _retry_after(self, response: BatchResponse, attempt: int) -> float:
+        backoff = self.backoff_seconds * 2 ** (attempt - 1)
+        headers = {key.lower(): value for key, value in response.headers.items()}
+        try:
+            retry_after = float(headers.get("retry-after", backoff))
+        except ValueError:
+            retry_after = backoff
+        return min(retry_after, MAX_RETRY_AFTER_SECONDS)
+
+
+def _body_size(request: BatchRequest) -> int:
+    return len(json.dumps(request.body or {}))
+
+
+def _failure(e: HTTPError) -> BatchResponse:
+    if e.response is None:
+        return BatchResponse(status=0)
+    return BatchResponse(
+        status=e.response.status_code, headers=dict(e.response.headers)
+    )
+
+
+class ReadStateBatch:
+    """
+    Collects read state changes of messages and applies them through $batch,
+    the last change of a message wins. A full batch is applied right away, call
+    `flush` for the rest once the messages are handled.
+    """
+
+    def __init__(
+        self, client: GraphBatchClient, flush_size: int = MAX_BATCH_REQUESTS
+    ) -> None:
+        self.client = client
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        # message url -> is read
+        self._pending: Dict[str, bool] = {}
+        # failures of full batches, reported by the next flush
+        self._failed = 0
+
+    def mark_as_read(self, message: Message) -> None:
+        self._set(message, True)
+
+    def mark_as_unread(self, message: Message) -> None:
+        self._set(message, False)
+
+    def flush(self) -> int:
+        """
+        Applies the pending changes, returns the number that failed since the
+        last flush, including those of full batches applied meanwhile.
+        """
+        failed = self._apply()
+        with self._lock:
+            failed, self._failed = failed + self._failed, 0
+        return failed
+
+    def _apply(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        urls = list(pending)
+        requests = [
+            BatchRequest("PATCH", url, {"isRead": pending[url]}) for url in urls
+        ]
+        try:
+            responses = self.client.execute(requests)
+        except Exception as e:
+            logging.warning(
+                f"... failed to update the read state of {len(urls)} messages."
+            )
+            logging.warning(e)
+            return len(urls)
+        failed = 0
+        for url, response in zip(urls, responses):
+            if not response.ok:
+                failed += 1
+                logging.warning(
+                    f"... failed to update the read state of {url}: {response.status}"
+                )
+        return failed
+
+    def _set(self, message: Message, is_read: bool) -> None:
+        url = self.client.relative_url(
+            _build_url(message, f"/messages/{message.object_id}")
+        )
+        with self._lock:
+            self._pending[url] = is_read
+            full = len(self._pending) >= self.flush_size
+        if full:
+            failed = self._apply()
+            with self._lock:
+                self._failed += failed
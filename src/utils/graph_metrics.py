@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class OperationStats:
+    calls: int = 0
+    errors: int = 0
+    bytes: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class GraphMetrics:
+    """
+    Calls, transferred bytes and latency of the Graph operations in typed_o365,
+    per operation since the last reset. A call is one wrapper invocation, O365
+    retries and pagination requests within it are not counted separately.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: Dict[str, OperationStats] = {}
+        self._started = time.monotonic()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._operations = {}
+            self._started = time.monotonic()
+
+    def record(
+        self, operation: str, seconds: float, num_bytes: int = 0, failed: bool = False
+    ) -> None:
+        with self._lock:
+            stats = self._operations.setdefault(operation, OperationStats())
+            stats.calls += 1
+            stats.errors += failed
+            stats.bytes += num_bytes
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    @contextmanager
+    def measure(self, operation: str) -> Iterator[None]:
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(operation, time.perf_counter() - start, failed=failed)
+
+    def measure_iterable(
+        self, operation: str, fetch: Callable[[], Iterable[T]]
+    ) -> Iterator[T]:
+        """
+        Counts one call for `fetch` and the iteration over its result, which is
+        deferred to the first item. Only the time spent in `fetch` and in fetching
+        the next item is measured, pages O365 loads lazily are included.
+        """
+        seconds = 0.0
+        failed = True
+        suspended = False
+        start = time.perf_counter()
+        try:
+            for item in fetch():
+                seconds += time.perf_counter() - start
+                suspended = True
+                yield item
+                suspended = False
+                start = time.perf_counter()
+            failed = False
+        finally:
+            if not suspended:
+                seconds += time.perf_counter() - start
+            self.record(operation, seconds, failed=failed)
+
+    def snapshot(self) -> Dict[str, OperationStats]:
+        with self._lock:
+            return {
+                name: OperationStats(**asdict(s))
+                for name, s in self._operations.items()
+            }
+
+    def summary(self) -> str:
+        operations = sorted(
+            self.snapshot().items(),
+            key=lambda item: item[1].total_seconds,
+            reverse=True,
+        )
+        calls = sum(stats.calls for _, stats in operations)
+        seconds = sum(stats.total_seconds for _, stats in operations)
+        num_bytes = sum(stats.bytes for _, stats in operations)
+        parts: List[str] = [
+            f"{calls} Graph calls in {seconds:.2f} s, {num_bytes / 1e6:.2f} MB"
+        ]
+        for name, stats in operations:
+            part = (
+                f"{name}: {stats.calls}x {stats.total_seconds:.2f} s"
+                f" (max {stats.max_seconds:.2f} s)"
+            )
+            if stats.bytes:
+                part += f" {stats.bytes / 1e6:.2f} MB"
+            if stats.errors:
+                part += f" {stats.errors} failed"
+            parts.append(part)
+        return "; ".join(parts)
+
+    def append_json(self, path: str) -> None:
+        """Appends the metrics as one JSON line, so runs can be compared over time."""
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "run_seconds": time.monotonic() - self._started,
+            "operations": {
+                name: asdict(stats) for name, stats in self.snapshot().items()
+            },
+        }
+        with Path(path).open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+# Shared by all Graph wrappers, the orchestrator resets it at the start of each run.
+GRAPH_METRICS = GraphMetrics()
@@ -0,0 +1,95 @@
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, cast
+from O365.mailbox import Folder as MailboxFolder
+from O365.message import Message
+from src.utils.message_query import CLASSIFIER_FIELDS
+from src.utils.typed_o365 import _build_url
+
+DELTA_PAGE_SIZE = 50
+NEXT_LINK_KEY = "@odata.nextLink"
+DELTA_LINK_KEY = "@odata.deltaLink"
+REMOVED_KEY = "@removed"
+
+
+class MailDeltaSync:
+    """
+    Incremental polling of a mail folder through the Graph delta endpoint.
+    The delta link returned by the last complete round is persisted, so each
+    run only transfers the messages that changed since. Without a stored link
+    the first round enumerates the whole folder once.
+
+    The new delta link is only persisted by `commit`, call it once all returned
+    messages have been handled, so an interrupted run pulls them again.
+    """
+
+    def __init__(
+        self,
+        folder: MailboxFolder,
+        path: str,
+        select: List[str] = CLASSIFIER_FIELDS,
+        page_size: int = DELTA_PAGE_SIZE,
+    ) -> None:
+        self.folder = folder
+        self.path = Path(path)
+        self.select = select
+        self.page_size = page_size
+        self._pending_delta_link: Optional[str] = None
+
+    def get_changed_messages(self) -> List[Message]:
+        url = self._load_delta_link()
+        params: Optional[Dict[str, str]] = None
+        if url is None:
+            logging.info("... no delta link stored, starting initial delta sync")
+            url = _build_url(
+                self.folder, f"/mailFolders/{self.folder.folder_id}/messages/delta"
+            )
+            params = {"$select": ",".join(self.select)}
+
+        messages: List[Message] = []
+        delta_link: Optional[str] = None
+        while url:
+            response = self.folder.con.get(
+                url,
+                params=params,
+                headers={"Prefer": f"odata.maxpagesize={self.page_size}"},
+            )
+            if not response:
+                raise RuntimeError(f"Delta request failed for {url}")
+            data: Dict[str, Any] = response.json()
+            messages.extend(
+                self._to_message(item)
+                for item in data.get("value", [])
+                if REMOVED_KEY not in item
+            )
+            # the next and delta links already contain all query parameters
+            params = None
+            url = data.get(NEXT_LINK_KEY)
+            delta_link = data.get(DELTA_LINK_KEY, delta_link)
+
+        if delta_link is None:
+            raise RuntimeError("Delta sync finished without a delta link")
+        self._pending_delta_link = delta_link
+        logging.info(f"... delta sync returned {len(messages)} changed messages")
+        return messages
+
+    def commit(self) -> None:
+        if self._pending_delta_link is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(self._pending_delta_link, encoding="utf-8")
+        self._pending_delta_link = None
+
+    def reset(self) -> None:
+        self._pending_delta_link = None
+        self.path.unlink(missing_ok=True)
+
+    def _load_delta_link(self) -> Optional[str]:
+        if not self.path.exists():
+            return None
+        delta_link = self.path.read_text(encoding="utf-8").strip()
+        return delta_link or None
+
+    def _to_message(self, data: Dict[str, Any]) -> Message:
+        constructor = cast(Callable[..., Message], self.folder.message_constructor)
+        return constructor(parent=self.folder, **{self.folder._cloud_data_key: data})
@@ -0,0 +1,78 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Set
+
+from O365.message import Message
+
+# Fields the message classifiers and processors need up front, bodies and
+# attachments are fetched lazily for matched messages only.
+CLASSIFIER_FIELDS = [
+    "id",
+    "subject",
+    "sender",
+    "from",
+    "isRead",
+    # without it O365 takes the message for a draft and refuses to mark or forward it
+    "isDraft",
+    "hasAttachments",
+    "receivedDateTime",
+]
+DEFAULT_MESSAGE_BATCH_SIZE = 25
+# Graph rejects $orderby properties that are not part of $filter for some
+# queries ("InefficientFilter"), so receivedDateTime is always filtered on first.
+RECEIVED_DATE_TIME_FILTER = "receivedDateTime ge 1900-01-01T00:00:00Z"
+
+
+@dataclass
+class MessageQuery:
+    filters: List[str] = field(default_factory=list)
+    select: List[str] = field(default_factory=list)
+
+    def as_params(self) -> Dict[str, str]:
+        params = {}
+        if self.filters:
+            params["$filter"] = " and ".join(self.filters)
+        if self.select:
+            params["$select"] = ",".join(self.select)
+        return params
+
+
+def build_unread_messages_query(select: List[str] = CLASSIFIER_FIELDS) -> MessageQuery:
+    """
+    All unread messages. Subjects and senders are not filtered: the classifiers
+    decide what is processed, and unknown messages must be fetched as well so
+    they are marked as read.
+    """
+    return MessageQuery(
+        filters=[RECEIVED_DATE_TIME_FILTER, "isRead eq false"], select=list(select)
+    )
+
+
+def process_all_unread(
+    get_unread_messages: Callable[[], Iterable[Message]],
+    process_messages: Callable[[Iterable[Message]], None],
+    page_size: int,
+) -> None:
+    """
+    Graph pages the unread query with $skip over the re-evaluated filter, so
+    marking messages as read while paging skips unread ones further back. The
+    query is repeated while it yields messages not seen before, unless the
+    messages fit into a single page, where nothing can have been skipped.
+    """
+    seen_ids: Set[str] = set()
+    while True:
+        num_seen = len(seen_ids)
+        fetched_ids: Set[str] = set()
+        process_messages(_unseen(get_unread_messages(), seen_ids, fetched_ids))
+        if len(seen_ids) == num_seen or len(fetched_ids) < page_size:
+            return
+
+
+def _unseen(
+    messages: Iterable[Message], seen_ids: Set[str], fetched_ids: Set[str]
+) -> Iterator[Message]:
+    for message in messages:
+        fetched_ids.add(message.object_id)
+        if message.object_id in seen_ids:
+            continue
+        seen_ids.add(message.object_id)
+        yield message
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from src.config import SUBSCRIPTION_META_FILE
+from src.utils.is_test_mode import TEST_FILE_PREFIX, is_test_mode
+
+PARSE_MEMO_FILE = str(Path(SUBSCRIPTION_META_FILE).with_name("parse_memo.jsonl"))
+
+
+@dataclass
+class UploadTarget:
+    redacted: bool
+    year: int
+    filename: str
+    item_id: Optional[str] = None
+
+
+@dataclass
+class ParseMemoEntry:
+    """
+    Only what is needed to recognize an unchanged re-send. The metas hold the
+    sensitive content of the confirmation and are parsed again from the text.
+    """
+
+    booking_id: str
+    text_hash: str
+    upload_targets: List[UploadTarget] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "booking_id": self.booking_id,
+            "text_hash": self.text_hash,
+            "upload_targets": [asdict(target) for target in self.upload_targets],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ParseMemoEntry":
+        return cls(
+            booking_id=str(data["booking_id"]),
+            text_hash=str(data["text_hash"]),
+            upload_targets=[
+                UploadTarget(**target) for target in data.get("upload_targets", [])
+            ],
+        )
+
+
+class ParseMemo:
+    """
+    Persistent record of the last fully processed version of each booking,
+    stored as JSON lines, later lines win over earlier ones. A confirmation whose
+    booking id and text hash match the record was already uploaded and its
+    immediate notifications were sent, so a re-send is neither uploaded nor
+    notified again. Versions being processed are claimed in memory, so a re-send
+    arriving meanwhile is skipped as well.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        if is_test_mode():
+            self.path = self.path.with_name(TEST_FILE_PREFIX + self.path.name)
+        self._num_lines = 0
+        self._has_sensitive_lines = False
+        self._lock = threading.Lock()
+        self._claimed: Set[Tuple[str, str]] = set()
+        self._entries: Dict[str, ParseMemoEntry] = self._load()
+        # earlier versions stored the metas, including the sensitive content
+        if self._has_sensitive_lines or self._num_lines > 2 * len(self._entries) + 100:
+            self._compact()
+
+    def get(self, booking_id: str, text_hash: str) -> Optional[ParseMemoEntry]:
+        entry = self._entries.get(booking_id)
+        if entry is None or entry.text_hash != text_hash:
+            return None
+        return entry
+
+    def __contains__(self, booking_id: str) -> bool:
+        return booking_id in self._entries
+
+    def claim(self, booking_id: str, text_hash: str) -> bool:
+        """False if the version is already being processed, `put` or `release` end the claim."""
+        with self._lock:
+            if (booking_id, text_hash) in self._claimed:
+                return False
+            self._claimed.add((booking_id, text_hash))
+            return True
+
+    def release(self, booking_id: str, text_hash: str) -> None:
+        with self._lock:
+            self._claimed.discard((booking_id, text_hash))
+
+    def put(self, entry: ParseMemoEntry) -> None:
+        with self._lock:
+            self._claimed.discard((entry.booking_id, entry.text_hash))
+            self._entries[entry.booking_id] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry.to_dict()) + "\n")
+            self._num_lines += 1
+
+    def _load(self) -> Dict[str, ParseMemoEntry]:
+        entries: Dict[str, ParseMemoEntry] = {}
+        if not self.path.exists():
+            return entries
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                self._num_lines += 1
+                try:
+                    data = json.loads(line)
+                    entry = ParseMemoEntry.from_dict(data)
+                except (ValueError, KeyError, TypeError):
+                    logging.warning(f"Skipping invalid line in {self.path}: {line!r}")
+                    continue
+                self._has_sensitive_lines |= "metas" in data
+                entries[entry.booking_id] = entry
+        return entries
+
+    def _compact(self) -> None:
+        # write to a temporary file first, so an interrupted compaction loses nothing
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with temp_path.open("w", encoding="utf-8") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry.to_dict()) + "\n")
+        os.replace(temp_path, self.path)
+        self._num_lines = len(self._entries)
+
+
+def hash_attachment_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,101 @@
+import re
+from typing import Dict, Iterable, List, Set
+import fitz
+from src.utils.pdf_text_cache import CachedPdfDocument
+from src.utils.typed_pymupdf import PDF_LOCK, _rects_intersect
+
+REDACTION_FILL = (0, 0, 0)  # RGB (0,0,0) = black bar
+HIGHLIGHT_STROKE = (1, 1, 0)  # RGB (1,1,0) = yellow
+
+
+class NeedleMatcher:
+    """
+    Finds which of many strings occur in a text with one compiled alternation
+    per round instead of one scan per string. Like MuPDF's search it ignores case
+    and the amount of whitespace between words, so it never reports fewer
+    strings than `search_for` would find.
+    """
+
+    def __init__(self, needles: Iterable[str]) -> None:
+        self._patterns: Dict[str, str] = {}
+        for needle in needles:
+            tokens = needle.split()
+            if tokens:
+                self._patterns[needle] = r"\s*".join(re.escape(t) for t in tokens)
+
+    def present(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        remaining = dict(self._patterns)
+        # alternation matches don't overlap, a string hidden by an overlapping
+        # match of another one is found in the next round
+        while remaining:
+            names = list(remaining)
+            regex = re.compile(
+                "|".join(f"(?P<n{i}>{remaining[n]})" for i, n in enumerate(names)),
+                re.IGNORECASE,
+            )
+            matched = {
+                names[int(str(match.lastgroup)[1:])] for match in regex.finditer(text)
+            }
+            if not matched:
+                break
+            found |= matched
+            for needle in matched:
+                del remaining[needle]
+        return found
+
+
+class PdfMarkupEngine:
+    """
+    Redacts and highlights strings in a single pass over each page. The targets
+    of both kinds are located with the document's cached search text pages, only
+    strings present on a page are searched for, and the page is modified in
+    place instead of working on a copy of the document.
+    """
+
+    def __init__(
+        self, strings_to_redact: Iterable[str], strings_to_highlight: Iterable[str]
+    ) -> None:
+        self.strings_to_redact = set(strings_to_redact)
+        # ordered, so the highlights are added in a stable order
+        self._highlight_order = list(dict.fromkeys(strings_to_highlight))
+        self.strings_to_highlight = set(self._highlight_order)
+        self._matcher = NeedleMatcher(
+            self.strings_to_redact | self.strings_to_highlight
+        )
+
+    def apply(self, pdf_doc: CachedPdfDocument) -> None:
+        with PDF_LOCK:
+            for page_num in range(pdf_doc.page_count):
+                self._apply_to_page(pdf_doc, page_num)
+            # redactions removed text, the cached text is stale
+            pdf_doc.invalidate()
+
+    def _apply_to_page(self, pdf_doc: CachedPdfDocument, page_num: int) -> None:
+        present = self._matcher.present(pdf_doc.search_text(page_num))
+        redactions: List[fitz.Rect] = []
+        highlights_by_needle: Dict[str, List[fitz.Rect]] = {}
+        for needle in present:
+            rects = pdf_doc.search(page_num, needle)
+            if needle in self.strings_to_redact:
+                redactions.extend(rects)
+            if needle in self.strings_to_highlight:
+                highlights_by_needle[needle] = rects
+
+        page = pdf_doc.page(page_num)
+        for rect in redactions:
+            page.add_redact_annot(rect, fill=REDACTION_FILL)
+        # images=0 -> don't redact overlapping images, this drastically reduces file-size in some cases.
+        page.apply_redactions(images=0)
+        highlights: List[fitz.Rect] = []
+        for needle in self._highlight_order:
+            rects = highlights_by_needle.get(needle, [])
+            if any(_rects_intersect(a, b) for a in rects for b in redactions):
+                # the redaction may have removed part of the text, or only
+                # touched the neighbouring line, search the redacted page
+                rects = page.search_for(needle)
+            highlights.extend(rects)
+        for rect in highlights:
+            highlight = page.add_highlight_annot(rect)
+            highlight.set_colors(stroke=HIGHLIGHT_STROKE)
+            highlight.update()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from O365.drive import File
+from src.config import SUBSCRIPTION_META_FILE
+from src.utils.is_test_mode import TEST_FILE_PREFIX, is_test_mode
+
+PDF_SIGNATURE_INDEX_FILE = str(
+    Path(SUBSCRIPTION_META_FILE).with_name("pdf_signatures.jsonl")
+)
+
+
+class PdfSignatureIndex:
+    """
+    Persistent map from SharePoint item id and item version to the hash of the
+    item's PDF text signature, stored as JSON lines. Entries are appended as they
+    are computed, later lines win over earlier ones.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        if is_test_mode():
+            self.path = self.path.with_name(TEST_FILE_PREFIX + self.path.name)
+        self._num_lines = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[str, str]] = self._load()
+        if self._num_lines > 2 * len(self._entries) + 100:
+            self._compact()
+
+    def get(self, item_id: str, version: str) -> Optional[str]:
+        entry = self._entries.get(item_id)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def put(self, item_id: str, version: str, signature_hash: str) -> None:
+        with self._lock:
+            if self._entries.get(item_id) == (version, signature_hash):
+                return
+            self._entries[item_id] = (version, signature_hash)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(self._to_line(item_id, version, signature_hash))
+            self._num_lines += 1
+
+    def _load(self) -> Dict[str, Tuple[str, str]]:
+        entries: Dict[str, Tuple[str, str]] = {}
+        if not self.path.exists():
+            return entries
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                self._num_lines += 1
+                try:
+                    data = json.loads(line)
+                    entries[data["id"]] = (data["version"], data["signature"])
+                except (ValueError, KeyError, TypeError):
+                    logging.warning(f"Skipping invalid line in {self.path}: {line!r}")
+        return entries
+
+    def _compact(self) -> None:
+        # write to a temporary file first, so an interrupted compaction loses nothing
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with temp_path.open("w", encoding="utf-8") as f:
+            for item_id, (version, signature_hash) in self._entries.items():
+                f.write(self._to_line(item_id, version, signature_hash))
+        os.replace(temp_path, self.path)
+        self._num_lines = len(self._entries)
+
+    @staticmethod
+    def _to_line(item_id: str, version: str, signature_hash: str) -> str:
+        return (
+            json.dumps({"id": item_id, "version": version, "signature": signature_hash})
+            + "\n"
+        )
+
+
+def get_drive_item_version(item: File) -> str:
+    """
+    Identifies the content version of a drive item. O365's DriveItem drops the
+    eTag and cTag of the listing, reading them would take an extra request per
+    item and defeat the index. SharePoint sets lastModifiedDateTime on every
+    upload of new content, so together with the size it changes whenever the
+    content does; a changed version only costs a download, never a wrong match.
+    """
+    modified = item.modified.isoformat() if item.modified else ""
+    return f"{modified}|{item.size}"
+
+
+def hash_pdf_text_signature(signature: str) -> str:
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()
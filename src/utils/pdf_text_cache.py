@@ -0,0 +1,112 @@
+from typing import Any, Dict, List, Optional
+import fitz
+from src.utils.pdf_signature_index import hash_pdf_text_signature
+from src.utils.typed_pymupdf import PDF_LOCK, _pdf_tobytes, _select_pages
+
+# Flags `Page.search_for` uses when it creates its own text page, a cached text
+# page must be built with the same flags to find the same rectangles.
+SEARCH_TEXTPAGE_FLAGS = (
+    fitz.TEXT_DEHYPHENATE
+    | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_PRESERVE_LIGATURES
+    | fitz.TEXT_MEDIABOX_CLIP
+)
+
+
+class CachedPdfDocument:
+    """
+    Wraps a PDF document and extracts the text and the search text page of each
+    page at most once, on first use. The cutoff detection, the full text, the
+    dedupe signature and the string searches are all served from this cache.
+
+    The serialized bytes are cached as well, so every upload and email of one
+    variant reuses the same buffer. The caches describe the document as it was
+    when they were filled, call `invalidate` after modifying its pages.
+    """
+
+    def __init__(self, doc: fitz.Document) -> None:
+        self.doc = doc
+        self._pages: Dict[int, Any] = {}
+        self._texts: Dict[int, str] = {}
+        self._search_textpages: Dict[int, Any] = {}
+        self._signature: Optional[str] = None
+        self._signature_hash: Optional[str] = None
+        self._bytes: Optional[bytes] = None
+
+    @property
+    def page_count(self) -> int:
+        return len(self.doc)
+
+    def page(self, page_num: int) -> Any:
+        with PDF_LOCK:
+            page = self._pages.get(page_num)
+            if page is None:
+                page = self.doc[page_num]
+                self._pages[page_num] = page
+            return page
+
+    def page_text(self, page_num: int) -> str:
+        with PDF_LOCK:
+            text = self._texts.get(page_num)
+            if text is None:
+                text = str(self.page(page_num).get_text())
+                self._texts[page_num] = text
+            return text
+
+    def full_text(self) -> str:
+        return "".join(self.page_text(i) for i in range(self.page_count))
+
+    def search(self, page_num: int, needle: str) -> List[fitz.Rect]:
+        with PDF_LOCK:
+            textpage = self._search_textpage(page_num)
+            return list(self.page(page_num).search_for(needle, textpage=textpage))
+
+    def search_text(self, page_num: int) -> str:
+        """The page text as `search` sees it, i.e. with hyphenated words joined."""
+        with PDF_LOCK:
+            return str(self._search_textpage(page_num).extractText())
+
+    def signature(self) -> str:
+        """Whitespace-normalized text of all pages, used to detect identical files."""
+        if self._signature is None:
+            pages = [
+                " ".join(self.page_text(i).split()) for i in range(self.page_count)
+            ]
+            self._signature = f"{len(pages)}|" + "\f".join(pages)
+        return self._signature
+
+    def signature_hash(self) -> str:
+        if self._signature_hash is None:
+            self._signature_hash = hash_pdf_text_signature(self.signature())
+        return self._signature_hash
+
+    def cut_after_page(self, n: int) -> None:
+        """Drops all pages after the first `n` in place, keeping their cached text."""
+        with PDF_LOCK:
+            texts = {i: t for i, t in self._texts.items() if i < n}
+            _select_pages(self.doc, range(min(n, self.page_count)))
+            self.invalidate()
+            self._texts = texts
+
+    def tobytes(self) -> bytes:
+        """The serialized document, compressed once and reused until `invalidate`."""
+        with PDF_LOCK:
+            if self._bytes is None:
+                self._bytes = _pdf_tobytes(self.doc)
+            return self._bytes
+
+    def _search_textpage(self, page_num: int) -> Any:
+        textpage = self._search_textpages.get(page_num)
+        if textpage is None:
+            textpage = self.page(page_num).get_textpage(flags=SEARCH_TEXTPAGE_FLAGS)
+            self._search_textpages[page_num] = textpage
+        return textpage
+
+    def invalidate(self) -> None:
+        with PDF_LOCK:
+            self._pages.clear()
+            self._texts.clear()
+            self._search_textpages.clear()
+            self._signature = None
+            self._signature_hash = None
+            self._bytes = None
@@ -0,0 +1,59 @@
+import logging
+import queue
+import threading
+from typing import Callable, Generic, List, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_STAGE_QUEUE_SIZE = 10
+
+
+class _Stop:
+    pass
+
+
+class PipelineStage(Generic[T]):
+    """
+    A pipeline stage with a bounded input queue served by a fixed number of
+    worker threads. `put` blocks while the queue is full, which throttles the
+    upstream stage. Exceptions raised by the handler are logged and do not stop
+    the stage, handlers are expected to deal with their own failures.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[T], None],
+        workers: int = 1,
+        queue_size: int = DEFAULT_STAGE_QUEUE_SIZE,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self._queue: "queue.Queue[T | _Stop]" = queue.Queue(maxsize=queue_size)
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item: T) -> None:
+        self._queue.put(item)
+
+    def close(self) -> None:
+        """Processes all queued items and stops the workers."""
+        for _ in self._threads:
+            self._queue.put(_Stop())
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if isinstance(item, _Stop):
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                logging.warning(f"... unexpected error in pipeline stage {self.name}")
+                logging.warning(e)
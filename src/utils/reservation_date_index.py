@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+from O365.drive import File
+from src.config import SUBSCRIPTION_META_FILE
+from src.utils.is_test_mode import TEST_FILE_PREFIX, is_test_mode
+
+RESERVATION_DATE_INDEX_FILE = str(
+    Path(SUBSCRIPTION_META_FILE).with_name("reservation_dates.jsonl")
+)
+# SharePoint stays the source of truth, a year is listed again once its last
+# reconciliation is older than this (or the index was invalidated).
+RECONCILE_INTERVAL = timedelta(hours=24)
+# the date part of the Reservation_YYYY_MM_DD_... file names
+FILENAME_DATE_REGEX = re.compile(r"\d{4}_\d{2}_\d{2}")
+
+
+class IndexedFile(NamedTuple):
+    item_id: str
+    # modification time and size identify the item's version, see get_drive_item_version
+    modified: Optional[str] = None
+    size: int = 0
+
+    @classmethod
+    def from_file(cls, file: File) -> "IndexedFile":
+        modified = file.modified.isoformat() if file.modified else None
+        return cls(str(file.object_id), modified, int(file.size or 0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.item_id, "modified": self.modified, "size": self.size}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IndexedFile":
+        return cls(str(data["id"]), data.get("modified"), int(data.get("size", 0)))
+
+
+class ReservationDateIndex:
+    """
+    Persistent index of the redacted reservation files by the date in their
+    name, stored as JSON lines. A line adds one uploaded file, replaces all files
+    of a year with a fresh SharePoint listing or marks a year as stale; later
+    lines win. A year listing replaces the previous one of the year by
+    rewriting the file, so it holds at most one listing per year.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        if is_test_mode():
+            self.path = self.path.with_name(TEST_FILE_PREFIX + self.path.name)
+        self._num_lines = 0
+        # years with a listing in the file, and listings replaced by a later one
+        self._listed_years: Set[int] = set()
+        self._num_superseded = 0
+        self._lock = threading.Lock()
+        # year -> file name -> file
+        self._files: Dict[int, Dict[str, IndexedFile]] = {}
+        self._reconciled: Dict[int, datetime] = {}
+        # date string -> file name -> file
+        self._files_by_date: Dict[str, Dict[str, IndexedFile]] = {}
+        self._load()
+        num_files = sum(len(files) for files in self._files.values())
+        if self._num_superseded or self._num_lines > 2 * num_files + 100:
+            self._compact()
+
+    def needs_reconciliation(self, year: int, now: Optional[datetime] = None) -> bool:
+        with self._lock:
+            reconciled = self._reconciled.get(year)
+        if reconciled is None:
+            return True
+        return (now or datetime.now()) - reconciled > RECONCILE_INTERVAL
+
+    def files_on_date(self, date_string: str) -> Dict[str, IndexedFile]:
+        """The reservation files on `date_string` (YYYY_MM_DD) by name."""
+        with self._lock:
+            return dict(self._files_by_date.get(date_string, {}))
+
+    def add(self, year: int, name: str, file: IndexedFile) -> None:
+        with self._lock:
+            if self._files.get(year, {}).get(name) == file:
+                return
+            self._add(year, name, file)
+            self._append(self._file_record(year, name, file))
+
+    def reconcile(self, year: int, files: Iterable[Tuple[str, IndexedFile]]) -> None:
+        """Replaces the files of `year` with a listing of its SharePoint folder."""
+        with self._lock:
+            reconciled = datetime.now()
+            self._replace_year(year, dict(files), reconciled)
+            if year in self._listed_years:
+                # appending would keep the previous listing of the year around
+                self._compact()
+            else:
+                self._append(self._year_record(year))
+                self._listed_years.add(year)
+
+    def invalidate(self, year: int) -> None:
+        """The next lookup for `year` lists SharePoint again, e.g. after a stale item id."""
+        with self._lock:
+            if self._reconciled.pop(year, None) is not None:
+                self._append({"year": year, "stale": True})
+
+    def _add(self, year: int, name: str, file: IndexedFile) -> None:
+        self._files.setdefault(year, {})[name] = file
+        for date_string in FILENAME_DATE_REGEX.findall(name):
+            self._files_by_date.setdefault(date_string, {})[name] = file
+
+    def _replace_year(
+        self, year: int, files: Dict[str, IndexedFile], reconciled: datetime
+    ) -> None:
+        for name in self._files.pop(year, {}):
+            for date_string in FILENAME_DATE_REGEX.findall(name):
+                names = self._files_by_date.get(date_string, {})
+                names.pop(name, None)
+                if not names:
+                    self._files_by_date.pop(date_string, None)
+        self._files[year] = {}
+        for name, file in files.items():
+            self._add(year, name, file)
+        self._reconciled[year] = reconciled
+
+    def _year_record(self, year: int) -> Dict[str, object]:
+        return {
+            "year": year,
+            "reconciled": self._reconciled[year].isoformat(),
+            "files": {
+                name: file.to_dict() for name, file in self._files.get(year, {}).items()
+            },
+        }
+
+    @staticmethod
+    def _file_record(year: int, name: str, file: IndexedFile) -> Dict[str, object]:
+        return {"year": year, "name": name, **file.to_dict()}
+
+    def _append(self, record: Dict[str, object]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        self._num_lines += 1
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                self._num_lines += 1
+                try:
+                    data = json.loads(line)
+                    year = int(data["year"])
+                    if data.get("stale"):
+                        self._reconciled.pop(year, None)
+                    elif "files" in data:
+                        if year in self._listed_years:
+                            self._num_superseded += 1
+                        self._listed_years.add(year)
+                        self._replace_year(
+                            year,
+                            {
+                                str(name): IndexedFile.from_dict(file)
+                                for name, file in data["files"].items()
+                            },
+                            datetime.fromisoformat(data["reconciled"]),
+                        )
+                    else:
+                        self._add(year, str(data["name"]), IndexedFile.from_dict(data))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    logging.warning(f"Skipping invalid line in {self.path}: {line!r}")
+
+    def _compact(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so an interrupted compaction loses nothing
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with temp_path.open("w", encoding="utf-8") as f:
+            for year in self._files:
+                if year in self._reconciled:
+                    f.write(json.dumps(self._year_record(year)) + "\n")
+                else:
+                    for name, file in self._files[year].items():
+                        f.write(json.dumps(self._file_record(year, name, file)) + "\n")
+        os.replace(temp_path, self.path)
+        self._listed_years = set(self._reconciled) & set(self._files)
+        self._num_superseded = 0
+        self._num_lines = sum(
+            1 if year in self._reconciled else len(files)
+            for year, files in self._files.items()
+        )
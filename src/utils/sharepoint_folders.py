@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+from O365.account import Account
+from O365.drive import Drive, Folder
+from src.config import (
+    ORIGINAL_FOLDER,
+    REDACTED_FOLDER,
+    SHAREPOINT_FOLDER_PATH,
+    SHAREPOINT_SITE_ID,
+)
+from src.utils.folder_index import FolderIndex
+from src.utils.is_test_mode import is_test_mode
+from src.utils.typed_o365 import (
+    _create_child_folder,
+    _get_item_by_path,
+    _get_items,
+)
+
+FOLDER_CACHE_TTL_SECONDS = 15 * 60
+
+# (year, redacted, test mode); year None is the reservations base folder,
+# year and redacted None is the SharePoint base folder itself.
+FolderKey = Tuple[Optional[int], Optional[bool], bool]
+
+T = TypeVar("T")
+
+
+class SharePointFolderCache:
+    """
+    Caches the resolved SharePoint drive and folders for the duration of a run,
+    so site, drive and year folders are only looked up once.
+    Any failed lookup invalidates the whole cache.
+    """
+
+    def __init__(self, ttl_seconds: float = FOLDER_CACHE_TTL_SECONDS) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._account: Optional[Account] = None
+        self._drive: Optional[Tuple[float, Drive]] = None
+        self._folders: Dict[FolderKey, Tuple[float, Folder]] = {}
+        self._indexes: Dict[str, Tuple[float, FolderIndex]] = {}
+        self._lock = threading.RLock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._drive = None
+            self._folders = {}
+            self._indexes = {}
+
+    def get_drive(self, account: Account) -> Drive:
+        with self._lock:
+            self._ensure_account(account)
+            if self._drive is not None and self._is_fresh(self._drive[0]):
+                return self._drive[1]
+            drive = self._resolve(lambda: self._lookup_drive(account))
+            self._drive = (time.monotonic(), drive)
+            return drive
+
+    def get_base_folder(self, account: Account) -> Folder:
+        key: FolderKey = (None, None, is_test_mode())
+        return self._get_folder(
+            key, lambda: self._lookup_folder(account, get_base_folder_path())
+        )
+
+    def get_reservations_base_folder(self, account: Account, redacted: bool) -> Folder:
+        key: FolderKey = (None, redacted, is_test_mode())
+        base_folder = get_reservations_base_folder_path(redacted=redacted)
+
+        def lookup() -> Folder:
+            try:
+                return self._lookup_folder(account, base_folder)
+            except Exception:
+                raise RuntimeError(f"Base path does not exist: {base_folder}")
+
+        return self._get_folder(key, lookup)
+
+    def get_reservations_folder(
+        self, account: Account, year: int, redacted: bool
+    ) -> Folder:
+        key: FolderKey = (year, redacted, is_test_mode())
+        return self._get_folder(
+            key, lambda: self._lookup_year_folder(account, year, redacted)
+        )
+
+    def get_folder_index(self, folder: Folder) -> FolderIndex:
+        """
+        Lists the folder once and keeps the index, callers are expected to
+        add the files they upload so the index does not need to be re-fetched.
+        """
+        key = str(folder.object_id)
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and self._is_fresh(cached[0]):
+                return cached[1]
+            index = self._resolve(lambda: FolderIndex(_get_items(folder)))
+            self._indexes[key] = (time.monotonic(), index)
+            return index
+
+    def _get_folder(self, key: FolderKey, lookup: Callable[[], Folder]) -> Folder:
+        with self._lock:
+            cached = self._folders.get(key)
+            if cached is not None and self._is_fresh(cached[0]):
+                return cached[1]
+            folder = self._resolve(lookup)
+            self._folders[key] = (time.monotonic(), folder)
+            return folder
+
+    def _lookup_year_folder(
+        self, account: Account, year: int, redacted: bool
+    ) -> Folder:
+        year_str = str(year)
+        parent = self.get_reservations_base_folder(account, redacted=redacted)
+        folder_path = f"{get_reservations_base_folder_path(redacted)}/{year_str}"
+        try:
+            folder = _get_item_by_path(self.get_drive(account), folder_path)
+        except Exception:
+            folder = _create_child_folder(parent, year_str)
+            logging.info(f"... created folder: {folder_path}")
+        if not isinstance(folder, Folder):
+            raise RuntimeError(f"Expected {folder_path} to be a folder!")
+        return folder
+
+    def _lookup_folder(self, account: Account, folder_path: str) -> Folder:
+        folder = _get_item_by_path(self.get_drive(account), folder_path)
+        if not isinstance(folder, Folder):
+            raise RuntimeError(f"Expected {folder_path} to be a folder!")
+        return folder
+
+    @staticmethod
+    def _lookup_drive(account: Account) -> Drive:
+        sharepoint = account.sharepoint()
+        site = sharepoint.get_site(SHAREPOINT_SITE_ID)
+        drive = site.get_default_document_library()
+        if not isinstance(drive, Drive):
+            raise RuntimeError("Could not access SharePoint document library!")
+        return drive
+
+    def _resolve(self, lookup: Callable[[], T]) -> T:
+        try:
+            return lookup()
+        except Exception:
+            self.invalidate()
+            raise
+
+    def _ensure_account(self, account: Account) -> None:
+        if account is not self._account:
+            self.invalidate()
+            self._account = account
+
+    def _is_fresh(self, resolved_at: float) -> bool:
+        return time.monotonic() - resolved_at < self.ttl_seconds
+
+
+FOLDER_CACHE = SharePointFolderCache()
+
+
+def get_base_folder_path() -> str:
+    base_path = SHAREPOINT_FOLDER_PATH
+    if is_test_mode():
+        base_path = f"{base_path}/TEST"
+    return base_path
+
+
+def get_reservations_base_folder_path(redacted: bool) -> str:
+    return (
+        f"{get_base_folder_path()}/{REDACTED_FOLDER if redacted else ORIGINAL_FOLDER}"
+    )
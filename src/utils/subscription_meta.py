@@ -1,14 +1,18 @@
 from dataclasses import dataclass, asdict
 from datetime import datetime
 import logging
+import os
 from pathlib import Path
 import json
-import tempfile
-from typing import Dict, List, Optional, Union
+from collections import Counter
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple, TypeVar, Union
 from O365.account import Account
-from src.config import SHAREPOINT_FOLDER_PATH, SHAREPOINT_SITE_ID
+from src.utils.sharepoint_folders import FOLDER_CACHE, get_base_folder_path
 from src.utils.is_test_mode import is_test_mode, TEST_FILE_PREFIX
+from src.utils.typed_o365 import _upload_bytes
 
+K = TypeVar("K")
 SUBSCRIPTION_META_VALUE_TYPES = Union[int, List[int], Optional[int], bool, str]
 WEEKDAY_NAMES_DE = [
     "Montag",
@@ -64,56 +68,55 @@ class SubscriptionManager:
         if is_test_mode():
             self.path = TEST_FILE_PREFIX + self.path
         self._subscription_metas = self.load_subscriptions(self.path)
+        # inverted indexes over the metas, the inner dicts are insertion ordered sets
+        self._notification_emails_by_weekday: Dict[int, Dict[str, None]] = {}
+        self._reminder_emails_by_weekday_and_lead_days: Dict[
+            Tuple[int, int], Dict[str, None]
+        ] = {}
+        self._lead_days_counts: Counter[int] = Counter()
+        for meta in self._subscription_metas.values():
+            self._index(meta)
 
     def push_metas_to_sharepoint(self, account: Account) -> None:
         logging.info("Pushing subscription metas to SharePoint...")
-        sharepoint = account.sharepoint()
-        site = sharepoint.get_site(SHAREPOINT_SITE_ID)
-        drive = site.get_default_document_library()
-        folder_path = SHAREPOINT_FOLDER_PATH
-        if is_test_mode():
-            folder_path = f"{folder_path}/TEST"
         try:
-            folder = drive.get_item_by_path(folder_path)
+            folder = FOLDER_CACHE.get_base_folder(account)
         except Exception as e:
             raise RuntimeError(
-                f"Could not access SharePoint folder at path {folder_path}: {e}"
+                f"Could not access SharePoint folder at path {get_base_folder_path()}: {e}"
             )
         target_file_name = "subscription_metas.txt"
         if is_test_mode():
             target_file_name = TEST_FILE_PREFIX + target_file_name
         pretty_content = self.get_subscription_meta_list_as_pretty_string()
-        with tempfile.TemporaryDirectory() as temp_dir:
-            upload_path = Path(temp_dir) / target_file_name
-            upload_path.write_text(pretty_content, encoding="utf-8")
-            new_file = folder.upload_file(str(upload_path), target_file_name)
+        try:
+            new_file = _upload_bytes(
+                folder, target_file_name, pretty_content.encode("utf-8")
+            )
+            if new_file is None:
+                raise RuntimeError(f"Upload of {target_file_name} failed")
+        except Exception:
+            FOLDER_CACHE.invalidate()
+            raise
         logging.info(
             f"... uploaded subscription metas to SharePoint file {new_file.name} to folder {folder.name}"
         )
 
     @property
-    def subscription_metas(self) -> Dict[str, SubscriptionMeta]:
-        return self._subscription_metas
+    def subscription_metas(self) -> Mapping[str, SubscriptionMeta]:
+        # read-only, changes must go through the manager to keep the indexes in sync
+        return MappingProxyType(self._subscription_metas)
 
     @property
     def max_lead_days(self) -> int:
-        if not self.subscription_metas:
-            return -1
-        lead_days = [
-            meta.reminder_lead_days
-            for meta in self.subscription_metas.values()
-            if meta.reminder_lead_days is not None
-        ]
-        if not lead_days:
-            return -1
-        return max(lead_days)
+        return max(self._lead_days_counts, default=-1)
 
     @property
     def emails_per_lead_day_number_with_reminder_due_today(
         self,
     ) -> Dict[int, List[str]]:
         result = {}
-        for n in range(self.max_lead_days + 1):
+        for n in sorted(self._lead_days_counts):
             emails = self.emails_with_reminders_due_today_for_event_in_n_days(n=n)
             if emails:
                 result[n] = emails
@@ -131,38 +134,66 @@ class SubscriptionManager:
     @staticmethod
     def dump_subscriptions(subs: Dict[str, SubscriptionMeta], path: str | Path) -> None:
         path = Path(path)
-        with path.open("w", encoding="utf-8") as f:
+        # write to a temporary file first, so concurrent readers never see a partial file
+        temp_path = path.with_name(path.name + ".tmp")
+        with temp_path.open("w", encoding="utf-8") as f:
             json.dump(
                 {key: value.to_dict() for key, value in subs.items()}, f, indent=2
             )
+        os.replace(temp_path, path)
 
     def dump_to_file(self) -> None:
         self.dump_subscriptions(self._subscription_metas, self.path)
 
     def add_or_update_subscription(self, meta: SubscriptionMeta) -> None:
+        previous = self._subscription_metas.get(meta.email)
+        if previous is not None:
+            self._unindex(previous)
         self._subscription_metas[meta.email] = meta
+        self._index(meta)
         self.dump_to_file()
 
     def remove_subscription(self, email: str) -> None:
         if email in self._subscription_metas:
-            del self._subscription_metas[email]
+            self._unindex(self._subscription_metas.pop(email))
             self.dump_to_file()
 
+    def _index(self, meta: SubscriptionMeta) -> None:
+        for weekday in set(meta.weekdays):
+            if meta.immediate_notifications:
+                self._notification_emails_by_weekday.setdefault(weekday, {})[
+                    meta.email
+                ] = None
+            if meta.reminder_lead_days is not None:
+                self._reminder_emails_by_weekday_and_lead_days.setdefault(
+                    (weekday, meta.reminder_lead_days), {}
+                )[meta.email] = None
+        if meta.reminder_lead_days is not None:
+            self._lead_days_counts[meta.reminder_lead_days] += 1
+
+    def _unindex(self, meta: SubscriptionMeta) -> None:
+        for weekday in set(meta.weekdays):
+            _discard(self._notification_emails_by_weekday, weekday, meta.email)
+            if meta.reminder_lead_days is not None:
+                _discard(
+                    self._reminder_emails_by_weekday_and_lead_days,
+                    (weekday, meta.reminder_lead_days),
+                    meta.email,
+                )
+        if meta.reminder_lead_days is not None:
+            self._lead_days_counts[meta.reminder_lead_days] -= 1
+            if self._lead_days_counts[meta.reminder_lead_days] == 0:
+                del self._lead_days_counts[meta.reminder_lead_days]
+
     def emails_with_notifications_for_weekday(self, weekday: int) -> List[str]:
-        return [
-            meta.email
-            for meta in self.subscription_metas.values()
-            if weekday in meta.weekdays and meta.immediate_notifications
-        ]
+        return list(self._notification_emails_by_weekday.get(weekday, {}))
 
     def emails_with_reminders_due_today_for_event_in_n_days(self, n: int) -> List[str]:
         current_weekday = datetime.now().weekday()
         target_weekday = (current_weekday + n) % 7
-        return [
-            meta.email
-            for meta in self.subscription_metas.values()
-            if target_weekday in meta.weekdays and meta.reminder_lead_days == n
-        ]
+        return list(
+            self._reminder_emails_by_weekday_and_lead_days.get((target_weekday, n), {})
+        )
 
     def pretty_print_subscriptions(self) -> None:
         result = self.get_subscription_meta_list_as_pretty_string()
@@ -185,3 +216,12 @@ class SubscriptionManager:
             f"    Erinnerungen: {str(meta.reminder_lead_days) + ' Tage im Voraus' if meta.reminder_lead_days is not None else 'Keine'}\n"
         )
         return result
+
+
+def _discard(index: Dict[K, Dict[str, None]], key: K, email: str) -> None:
+    emails = index.get(key)
+    if emails is None:
+        return
+    emails.pop(email, None)
+    if not emails:
+        del index[key]
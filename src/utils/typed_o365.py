@@ -1,49 +1,229 @@
-from typing import Iterable, Protocol, cast
+import time
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Protocol, cast
+from O365.mailbox import Folder as MailboxFolder
 from O365.message import Message
-from O365.drive import File, Folder
+from O365.drive import Drive, DriveItem, File, Folder
+from src.utils.graph_metrics import GRAPH_METRICS
 
 
-class _MessageReadState(Protocol):
-    def mark_as_read(self) -> None: ...
+class _MessageSend(Protocol):
+    def send(self) -> bool: ...
 
-    def mark_as_unread(self) -> None: ...
 
+def _send_message(message: _MessageSend) -> bool:
+    with GRAPH_METRICS.measure("send_message"):
+        return message.send()
 
-def _mark_as_read(message: Message) -> None:
-    cast(_MessageReadState, message).mark_as_read()
 
+class _MessageBody(Protocol):
+    body: str
 
-def _mark_as_unread(message: Message) -> None:
-    cast(_MessageReadState, message).mark_as_unread()
 
+def _set_message_body(message: Message, body: str) -> None:
+    cast(_MessageBody, message).body = body
 
-class _MessageForward(Protocol):
-    def forward(self) -> Message: ...
 
+class _MessageApiData(Protocol):
+    def to_api_data(self) -> Dict[str, Any]: ...
 
-class _MessageSend(Protocol):
-    def send(self) -> bool: ...
 
+def _message_api_data(message: Message) -> Dict[str, Any]:
+    """The JSON representation of `message` that sendMail expects."""
+    return cast(_MessageApiData, message).to_api_data()
 
-def _forward_message(message: _MessageForward) -> Message:
-    return message.forward()
 
+class _FolderItems(Protocol):
+    def get_items(self) -> Iterable[File]: ...
 
-def _send_message(message: _MessageSend) -> bool:
-    return message.send()
 
+def _get_items(folder: Folder) -> Iterable[File]:
+    return GRAPH_METRICS.measure_iterable(
+        "get_items", lambda: cast(_FolderItems, folder).get_items()
+    )
 
-class _MessageBody(Protocol):
-    body: str
 
+class _DriveItemByPath(Protocol):
+    def get_item_by_path(self, item_path: str) -> DriveItem: ...
 
-def _set_message_body(message: Message, body: str) -> None:
-    cast(_MessageBody, message).body = body
 
+def _get_item_by_path(drive: Drive, item_path: str) -> DriveItem:
+    with GRAPH_METRICS.measure("get_item_by_path"):
+        return cast(_DriveItemByPath, drive).get_item_by_path(item_path)
 
-class _FolderItems(Protocol):
-    def get_items(self) -> Iterable[File]: ...
 
+class _FolderCreateChild(Protocol):
+    def create_child_folder(self, name: str) -> Folder: ...
 
-def _get_items(folder: Folder) -> Iterable[File]:
-    return cast(_FolderItems, folder).get_items()
+
+def _create_child_folder(folder: Folder, name: str) -> Folder:
+    with GRAPH_METRICS.measure("create_child_folder"):
+        return cast(_FolderCreateChild, folder).create_child_folder(name)
+
+
+class _FolderMessage(Protocol):
+    def get_message(self, object_id: str) -> Optional[Message]: ...
+
+
+def _get_message(folder: MailboxFolder, object_id: str) -> Optional[Message]:
+    with GRAPH_METRICS.measure("get_message"):
+        return cast(_FolderMessage, folder).get_message(object_id=object_id)
+
+
+class _FolderMessages(Protocol):
+    def get_messages(
+        self,
+        limit: Optional[int],
+        *,
+        query: object,
+        order_by: Optional[str],
+        batch: Optional[int],
+    ) -> Iterable[Message]: ...
+
+
+def _get_messages(
+    folder: MailboxFolder,
+    limit: Optional[int],
+    query: object,
+    order_by: Optional[str],
+    batch: Optional[int],
+) -> Iterable[Message]:
+    return GRAPH_METRICS.measure_iterable(
+        "get_messages",
+        lambda: cast(_FolderMessages, folder).get_messages(
+            limit, query=query, order_by=order_by, batch=batch
+        ),
+    )
+
+
+class _ApiComponentUrl(Protocol):
+    def build_url(self, endpoint: str) -> str: ...
+
+
+def _build_url(component: object, endpoint: str) -> str:
+    return cast(_ApiComponentUrl, component).build_url(endpoint)
+
+
+# Graph accepts simple uploads up to 4 MiB, larger files go through an upload
+# session in chunks that must be a multiple of 320 KiB.
+UPLOAD_SESSION_THRESHOLD_BYTES = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 10 * 320 * 1024
+
+
+class _FolderUploadStream(Protocol):
+    def upload_file(
+        self,
+        item: None,
+        item_name: str,
+        *,
+        chunk_size: int,
+        upload_in_chunks: bool,
+        stream: BinaryIO,
+        stream_size: int,
+    ) -> Optional[File]: ...
+
+
+def _upload_stream(
+    folder: Folder, item_name: str, stream: BinaryIO, stream_size: int
+) -> Optional[File]:
+    """Uploads from a file-like object, returns None if Graph rejected the upload."""
+    start = time.perf_counter()
+    file = None
+    try:
+        file = cast(_FolderUploadStream, folder).upload_file(
+            None,
+            item_name,
+            chunk_size=UPLOAD_CHUNK_SIZE,
+            upload_in_chunks=stream_size > UPLOAD_SESSION_THRESHOLD_BYTES,
+            stream=stream,
+            stream_size=stream_size,
+        )
+        return file
+    finally:
+        GRAPH_METRICS.record(
+            "upload_file", time.perf_counter() - start, stream_size, file is None
+        )
+
+
+def _upload_bytes(folder: Folder, item_name: str, content: bytes) -> Optional[File]:
+    return _upload_stream(folder, item_name, BytesIO(content), len(content))
+
+
+def _file_in_folder(
+    folder: Folder,
+    item_id: str,
+    name: str,
+    modified: Optional[str] = None,
+    size: int = 0,
+) -> File:
+    """A File for a known item of `folder`, built without a Graph request."""
+    cloud_data = {
+        "id": item_id,
+        "name": name,
+        "file": {},
+        "size": size,
+        "parentReference": {"id": folder.object_id, "driveId": folder.drive_id},
+    }
+    if modified is not None:
+        cloud_data["lastModifiedDateTime"] = modified
+    return File(parent=folder, **{folder._cloud_data_key: cloud_data})  # type: ignore[no-untyped-call]
+
+
+class _FileDownload(Protocol):
+    def download(self, *, output: BytesIO) -> bool: ...
+
+
+def _download_bytes(file: File) -> bytes:
+    output = BytesIO()
+    start = time.perf_counter()
+    downloaded = False
+    try:
+        downloaded = cast(_FileDownload, file).download(output=output)
+    finally:
+        GRAPH_METRICS.record(
+            "download",
+            time.perf_counter() - start,
+            output.getbuffer().nbytes,
+            not downloaded,
+        )
+    if not downloaded:
+        raise RuntimeError(f"Could not download {file.name}")
+    return output.getvalue()
+
+
+class _SharePermission(Protocol):
+    share_link: Optional[str]
+
+
+class _DriveItemShare(Protocol):
+    def share_with_link(
+        self,
+        share_type: str,
+        share_scope: str,
+        share_expiration_date: Optional[str] = None,
+    ) -> Optional[_SharePermission]: ...
+
+
+def _create_share_link(
+    item: DriveItem, share_scope: str, expiration_date: Optional[str] = None
+) -> Optional[str]:
+    """
+    A view link to `item`, Graph returns the existing link if there is one.
+    `expiration_date` is formatted YYYY-MM-DD.
+    """
+    with GRAPH_METRICS.measure("create_share_link"):
+        permission = cast(_DriveItemShare, item).share_with_link(
+            share_type="view",
+            share_scope=share_scope,
+            share_expiration_date=expiration_date,
+        )
+    return permission.share_link if permission is not None else None
+
+
+class _MessageDraft(Protocol):
+    def save_draft(self) -> bool: ...
+
+
+def _save_draft(message: Message) -> bool:
+    with GRAPH_METRICS.measure("save_draft"):
+        return cast(_MessageDraft, message).save_draft()
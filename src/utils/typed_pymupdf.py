@@ -1,24 +1,25 @@
-from typing import Callable, Protocol, cast
+import threading
+from typing import Callable, Protocol, Sequence, cast
 
 import fitz
 
+# MuPDF is not thread-safe: worker threads must hold this lock while they
+# access any document. PDF work is therefore serial by design; hold the lock
+# only around PyMuPDF calls, never around downloads or uploads, so workers
+# overlap their network I/O with each other's PDF work.
+PDF_LOCK = threading.RLock()
+
 
 class _PdfBytes(Protocol):
     def tobytes(self, garbage: int, deflate: bool, clean: bool) -> bytes: ...
 
 
-class _PdfInsert(Protocol):
-    def insert_pdf(
-        self,
-        docsrc: fitz.Document,
-        *,
-        from_page: int = 0,
-        to_page: int = -1,
-    ) -> None: ...
+class _RectIntersects(Protocol):
+    def intersects(self, other: fitz.Rect) -> bool: ...
 
 
-class _PdfSave(Protocol):
-    def save(self, filename: str) -> None: ...
+class _PdfSelect(Protocol):
+    def select(self, pages: Sequence[int]) -> None: ...
 
 
 def _open_pdf_from_bytes(content: bytes) -> fitz.Document:
@@ -26,11 +27,6 @@ def _open_pdf_from_bytes(content: bytes) -> fitz.Document:
     return open_pdf(stream=content, filetype="pdf")
 
 
-def _open_pdf_from_path(file_path: str) -> fitz.Document:
-    open_pdf = cast(Callable[..., fitz.Document], fitz.open)
-    return open_pdf(file_path)
-
-
 def _open_empty_pdf() -> fitz.Document:
     open_pdf = cast(Callable[..., fitz.Document], fitz.open)
     return open_pdf()
@@ -40,19 +36,10 @@ def _pdf_tobytes(pdf_doc: fitz.Document) -> bytes:
     return cast(_PdfBytes, pdf_doc).tobytes(garbage=4, deflate=True, clean=True)
 
 
-def _insert_pdf(
-    target: fitz.Document,
-    source: fitz.Document,
-    *,
-    from_page: int = 0,
-    to_page: int = -1,
-) -> None:
-    cast(_PdfInsert, target).insert_pdf(
-        source,
-        from_page=from_page,
-        to_page=to_page,
-    )
+def _select_pages(pdf_doc: fitz.Document, pages: Sequence[int]) -> None:
+    """Keeps only the given pages, in place."""
+    cast(_PdfSelect, pdf_doc).select(pages)
 
 
-def _save_pdf(pdf_doc: fitz.Document, file_path: str) -> None:
-    cast(_PdfSave, pdf_doc).save(file_path)
+def _rects_intersect(a: fitz.Rect, b: fitz.Rect) -> bool:
+    return cast(_RectIntersects, a).intersects(b)
@@ -0,0 +1,84 @@
+import os
+from pathlib import Path
+
+from src.utils.blob_cache import BlobCache
+
+
+def _cache(path: Path, max_bytes: int = 100, max_files: int = 10) -> BlobCache:
+    return BlobCache(str(path), max_bytes=max_bytes, max_files=max_files)
+
+
+def test_hit_needs_the_same_version(tmp_path: Path) -> None:
+    cache = _cache(tmp_path)
+    cache.put("a", "v1", b"one")
+
+    assert cache.get("a", "v1") == b"one"
+    assert cache.get("a", "v2") is None
+    assert cache.get("b", "v1") is None
+
+
+def test_new_version_replaces_the_old_one(tmp_path: Path) -> None:
+    cache = _cache(tmp_path)
+    cache.put("a", "v1", b"one")
+    cache.put("a", "v2", b"two")
+
+    assert cache.get("a", "v1") is None
+    assert cache.get("a", "v2") == b"two"
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_size_limit_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = _cache(tmp_path, max_bytes=30)
+    cache.put("a", "v", b"a" * 10)
+    cache.put("b", "v", b"b" * 10)
+    cache.put("c", "v", b"c" * 10)
+    cache.get("a", "v")
+
+    cache.put("d", "v", b"d" * 10)
+
+    assert cache.get("b", "v") is None
+    assert [cache.get(item, "v") is not None for item in "acd"] == [True] * 3
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) == 30
+
+
+def test_oversized_content_is_not_cached(tmp_path: Path) -> None:
+    cache = _cache(tmp_path, max_bytes=30)
+    cache.put("a", "v", b"a" * 10)
+
+    cache.put("b", "v", b"b" * 31)
+
+    assert cache.get("b", "v") is None
+    assert cache.get("a", "v") == b"a" * 10
+
+
+def test_file_limit_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = _cache(tmp_path, max_files=2)
+    cache.put("a", "v", b"a")
+    cache.put("b", "v", b"b")
+    cache.get("a", "v")
+
+    cache.put("c", "v", b"c")
+
+    assert cache.get("b", "v") is None
+    assert cache.get("a", "v") == b"a"
+    assert cache.get("c", "v") == b"c"
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_reload_keeps_the_recency_order_and_enforces_the_limits(
+    tmp_path: Path,
+) -> None:
+    cache = _cache(tmp_path)
+    for age, item in enumerate("cba"):
+        cache.put(item, "v", item.encode() * 10)
+        # the modification time is the last use, "c" is the oldest
+        path = tmp_path / BlobCache._file_name(item, "v")
+        os.utime(path, (1000 + age, 1000 + age))
+    (tmp_path / "partial.tmp").write_bytes(b"x")
+
+    reloaded = _cache(tmp_path, max_bytes=20)
+
+    assert reloaded.get("c", "v") is None
+    assert reloaded.get("b", "v") == b"b" * 10
+    assert reloaded.get("a", "v") == b"a" * 10
+    assert len(list(tmp_path.iterdir())) == 2
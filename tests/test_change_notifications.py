@@ -0,0 +1,103 @@
+import json
+from typing import Any, Dict, Iterator, List
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from src.utils.change_notifications import ChangeNotificationReceiver
+
+CLIENT_STATE = "secret-state"
+
+
+@pytest.fixture
+def receiver() -> Iterator[ChangeNotificationReceiver]:
+    receiver = ChangeNotificationReceiver("127.0.0.1", 0, CLIENT_STATE)
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def _post(receiver: ChangeNotificationReceiver, path: str, body: bytes) -> Any:
+    request = Request(
+        f"http://127.0.0.1:{receiver.port}{path}", data=body, method="POST"
+    )
+    return urlopen(request, timeout=5)
+
+
+def _notification(message_id: str, **fields: Any) -> Dict[str, Any]:
+    return {"clientState": CLIENT_STATE, "resourceData": {"id": message_id}, **fields}
+
+
+def _payload(*notifications: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    return {"value": list(notifications)}
+
+
+def test_validation_token_is_echoed(receiver: ChangeNotificationReceiver) -> None:
+    with _post(receiver, "/?validationToken=abc%20123", b"") as response:
+        assert response.status == 200
+        assert response.headers["Content-Type"] == "text/plain"
+        assert response.read() == b"abc 123"
+
+
+def test_notifications_are_queued(receiver: ChangeNotificationReceiver) -> None:
+    body = json.dumps(_payload(_notification("a"), _notification("a"))).encode()
+
+    with _post(receiver, "/", body) as response:
+        assert response.status == 202
+
+    assert receiver.drain(timeout=1) == ["a"]
+
+
+def test_invalid_payload_is_rejected(receiver: ChangeNotificationReceiver) -> None:
+    with pytest.raises(HTTPError) as error:
+        _post(receiver, "/", b"[1, 2]")
+
+    assert error.value.code == 400
+    error.value.close()
+
+
+def test_invalid_client_state_is_ignored(receiver: ChangeNotificationReceiver) -> None:
+    accepted = receiver.handle_notifications(
+        _payload(
+            _notification("forged", clientState="secret-statf"),
+            _notification("missing", clientState=None),
+            _notification("valid"),
+        )
+    )
+
+    assert accepted == 1
+    assert receiver.drain(timeout=0) == ["valid"]
+
+
+@pytest.mark.parametrize(
+    "event, poll, renewal",
+    [
+        ("missed", True, False),
+        ("reauthorizationRequired", False, True),
+        ("subscriptionRemoved", True, True),
+    ],
+)
+def test_lifecycle_events_request_a_poll_or_renewal(
+    receiver: ChangeNotificationReceiver, event: str, poll: bool, renewal: bool
+) -> None:
+    accepted = receiver.handle_notifications(
+        _payload({"clientState": CLIENT_STATE, "lifecycleEvent": event})
+    )
+
+    assert accepted == 0
+    assert receiver.consume_poll_request() is poll
+    assert receiver.consume_renewal_request() is renewal
+    # requests are consumed once
+    assert not receiver.consume_poll_request()
+    assert not receiver.consume_renewal_request()
+
+
+def test_lifecycle_events_need_the_client_state(
+    receiver: ChangeNotificationReceiver,
+) -> None:
+    receiver.handle_notifications(
+        _payload({"clientState": "other", "lifecycleEvent": "missed"})
+    )
+
+    assert not receiver.consume_poll_request()
@@ -0,0 +1,208 @@
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, List, Optional, Sequence, Set, cast
+
+import pytest
+from O365.account import Account
+from O365.drive import File
+from O365.message import Message
+
+from src.config import SUPPORT_EMAIL_ADDRESS
+from src.email import email_sender
+from src.email.email_sender import (
+    INLINE_ATTACHMENTS_LIMIT_BYTES,
+    SHARE_LINK_SCOPE_ENV_VAR,
+    Email,
+    EmailOutbox,
+    EmailSender,
+    OutgoingEmail,
+)
+from src.utils.graph_batch import BatchRequest, BatchResponse, GraphBatchClient
+
+PDF = b"%PDF" + b"x" * INLINE_ATTACHMENTS_LIMIT_BYTES
+FILENAME = "Reservation_2030_01_07_Turnverein Musterdorf_4711.pdf"
+
+
+def _sender() -> EmailSender:
+    account = SimpleNamespace(
+        mailbox=lambda resource: None,
+        connection=None,
+        protocol=SimpleNamespace(service_url="https://graph"),
+    )
+    return EmailSender(cast(Account, account))
+
+
+@pytest.fixture
+def share_links(monkeypatch: pytest.MonkeyPatch) -> List[Any]:
+    created: List[Any] = []
+
+    def create_share_link(
+        item: File, scope: str, expiration_date: Optional[str]
+    ) -> str:
+        created.append((scope, expiration_date))
+        return "https://sharepoint/link"
+
+    monkeypatch.setattr(email_sender, "_create_share_link", create_share_link)
+    return created
+
+
+def _notification(sender: EmailSender) -> OutgoingEmail:
+    return sender.immediate_notification_email(
+        pdf_bytes=PDF,
+        filename=FILENAME,
+        dates=[datetime(2030, 1, 7)],
+        locations=["Turnhalle"],
+        recipients=["a@b.ch"],
+        drive_item=cast(File, SimpleNamespace(size=len(PDF))),
+    )
+
+
+def test_default_send_attaches_the_pdf(
+    monkeypatch: pytest.MonkeyPatch, share_links: List[Any]
+) -> None:
+    monkeypatch.delenv(SHARE_LINK_SCOPE_ENV_VAR, raising=False)
+
+    email = _notification(_sender())
+
+    assert email.attachments == [(PDF, FILENAME)]
+    assert share_links == []
+
+
+@pytest.mark.parametrize("scope", ["organization", "anonymous"])
+def test_configured_scope_links_large_pdfs(
+    monkeypatch: pytest.MonkeyPatch, share_links: List[Any], scope: str
+) -> None:
+    monkeypatch.setenv(SHARE_LINK_SCOPE_ENV_VAR, scope)
+
+    email = _notification(_sender())
+
+    assert email.attachments == []
+    assert "https://sharepoint/link" in email.body
+    assert [created_scope for created_scope, _ in share_links] == [scope]
+    # only anonymous links expire
+    assert (share_links[0][1] is not None) is (scope == "anonymous")
+
+
+def test_unknown_scope_is_rejected(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv(SHARE_LINK_SCOPE_ENV_VAR, "everyone")
+
+    with pytest.raises(EnvironmentError):
+        _sender()
+
+
+class Recorder:
+    """Stands in for the sender, sends all emails but those it is told to fail."""
+
+    def __init__(self) -> None:
+        self.calls: List[List[str]] = []
+        self.failing: Set[str] = set()
+
+    def send_all(self, emails: Sequence[Email]) -> List[bool]:
+        self.calls.append([email.subject for email in emails])
+        return [email.subject not in self.failing for email in emails]
+
+
+def _email(subject: str) -> OutgoingEmail:
+    return OutgoingEmail(subject=subject, body="", recipients=[], attachments=[])
+
+
+def test_outbox_sends_groups_together_and_reports_their_outcome() -> None:
+    recorder = Recorder()
+    recorder.failing = {"b"}
+    outbox = EmailOutbox(cast(EmailSender, recorder))
+    outcomes: List[List[bool]] = []
+
+    outbox.add([_email("a"), _email("b")], outcomes.append)
+    outbox.add([_email("c")], outcomes.append)
+    assert recorder.calls == []
+
+    assert outbox.flush() == 1
+    assert recorder.calls == [["a", "b", "c"]]
+    assert outcomes == [[True, False], [True]]
+
+
+def test_outbox_sends_a_full_batch_right_away() -> None:
+    recorder = Recorder()
+    outbox = EmailOutbox(cast(EmailSender, recorder), flush_size=2)
+
+    outbox.add([_email("a")], lambda sent: None)
+    outbox.add([_email("b")], lambda sent: None)
+    outbox.add([_email("c")], lambda sent: None)
+
+    assert recorder.calls == [["a", "b"]]
+    assert outbox.flush() == 0
+    assert recorder.calls == [["a", "b"], ["c"]]
+
+
+def test_outbox_sends_emails_added_by_callbacks() -> None:
+    recorder = Recorder()
+    recorder.failing = {"notification"}
+    outbox = EmailOutbox(cast(EmailSender, recorder))
+    alerts: List[List[bool]] = []
+
+    def on_sent(sent: List[bool]) -> None:
+        if not all(sent):
+            outbox.add([_email("alert")], alerts.append)
+
+    outbox.add([_email("notification")], on_sent)
+
+    assert outbox.flush() == 1
+    assert recorder.calls == [["notification"], ["alert"]]
+    assert alerts == [[True]]
+
+
+def test_outbox_fails_all_emails_of_a_failed_send() -> None:
+    def send_all(emails: Sequence[Email]) -> List[bool]:
+        raise ConnectionError("offline")
+
+    outbox = EmailOutbox(cast(EmailSender, SimpleNamespace(send_all=send_all)))
+    outcomes: List[List[bool]] = []
+    outbox.add([_email("a"), _email("b")], outcomes.append)
+
+    assert outbox.flush() == 2
+    assert outcomes == [[False, False]]
+
+
+class BatchClient:
+    def __init__(self, statuses: List[int]) -> None:
+        self.statuses = statuses
+        self.requests: List[BatchRequest] = []
+
+    def relative_url(self, url: str) -> str:
+        return url.removeprefix("https://graph")
+
+    def execute(self, requests: Sequence[BatchRequest]) -> List[BatchResponse]:
+        self.requests += requests
+        return [BatchResponse(status) for status in self.statuses]
+
+
+def test_alerts_are_forwarded_through_the_batch() -> None:
+    sender = _sender()
+    client = BatchClient([202, 503])
+    sender.batch_client = cast(GraphBatchClient, client)
+    message = cast(
+        Message,
+        SimpleNamespace(
+            object_id="m1",
+            subject="Reservation 4711",
+            build_url=lambda endpoint: "https://graph/users/m@b.ch" + endpoint,
+        ),
+    )
+    alerts = [
+        sender.upload_alert(message, ValueError("no dates found")),
+        sender.subscription_update_alert(message, ValueError("invalid")),
+    ]
+
+    assert sender.send_all(alerts) == [True, False]
+    request = client.requests[0]
+    assert (request.method, request.url) == (
+        "POST",
+        "/users/m@b.ch/messages/m1/forward",
+    )
+    assert request.body is not None
+    assert "no dates found" in request.body["comment"]
+    assert "ValueError" in request.body["comment"]
+    assert request.body["message"]["subject"].endswith("Reservation 4711")
+    assert request.body["message"]["toRecipients"] == [
+        {"emailAddress": {"address": SUPPORT_EMAIL_ADDRESS}}
+    ]
@@ -0,0 +1,136 @@
+from typing import List, Set, Tuple
+
+import pytest
+
+from src.utils.errors import ClassificationError
+from src.utils.find_attachment_meta import FindAttachmentMeta
+
+# expected results are those of the parser before it was rewritten to parse
+# the text once, including its quirks (dates in the address block are dropped,
+# the organization is not redacted, the line before a repeated "Adresse" line
+# is not a location)
+MULTI_LINE_ADDRESS_BLOCK = (
+    "4711\nJugendriege Beispiel\n  Abteilung Geräteturnen  \n\nHans Beispiel\n"
+    "c/o Familie Muster\nBeispielweg 3\nPostfach 12\n3000 Bern 1\n"
+    "Definitive Buchungsbestätigung (4711)\nSeite 1/1\nMietoptionen\n"
+    "21.03.2033 17:00 - 18:30\nKosten\nGymnastikraum\n"
+    "Adresse Beispielweg 5, 3000 Bern\n"
+)
+CASES: List[Tuple[str, List[str], Set[str], Set[str]]] = [
+    (
+        "4711\nTurnverein Musterdorf\nErika Muster\nMusterstrasse 12\n8000 Zürich\n"
+        "Tel. 079 123 45 67\nerika.muster@example.ch\n"
+        "Definitive Buchungsbestätigung (4711)\nSeite 1/1\nMietoptionen\n"
+        "07.01.2030 18:00 - 20:00\n14.01.2030 18:00 - 20:00\nKosten\n"
+        "Mehrzweckhalle: Halle A / Dusche\nAdresse Schulhausstrasse 5, 8000 Zürich\n"
+        "Turnhalle Schulhaus Nord\nAdresse Nordstrasse 1, 8000 Zürich\n",
+        [
+            "Reservation_2030_01_07_Turnverein Musterdorf_4711.pdf",
+            "Reservation_2030_01_14_Turnverein Musterdorf_4711.pdf",
+        ],
+        {
+            "079 123 45 67",
+            "8000 Zürich",
+            "Erika Muster",
+            "Musterstrasse 12",
+            "Tel. 079 123 45 67",
+            "erika.muster@example.ch",
+        },
+        {"Mehrzweckhalle: Halle A / Dusche", "Turnhalle Schulhaus Nord"},
+    ),
+    (
+        # a page break between a location and its address
+        "815\nFC Beispiel\n+41 44 123 45 67\n0041-79-765-43-21\nkontakt@fc.example.ch\n"
+        "Geänderte definitive Buchungsbestätigung (815)\nSeite 1/2\nMietoptionen\n"
+        "03.02.2031 19:00 - 21:00\nKosten\nTurnhalle West\n815\nSeite 2/2\n"
+        "Adresse Weststrasse 3\nMietoptionen\n03.02.2031 19:00 - 21:00\n"
+        "10.02.2031 19:00 - 21:00\nKosten\nHalle Ost\nAdresse Oststrasse 9\n",
+        [
+            "Reservation_2031_02_03_FC Beispiel_815.pdf",
+            "Reservation_2031_02_10_FC Beispiel_815.pdf",
+        ],
+        {"+41 44 123 45 67", "0041-79-765-43-21", "kontakt@fc.example.ch"},
+        {"Halle Ost", "Turnhalle West"},
+    ),
+    (
+        "99\nVerein 01.01.2000\nMax Muster\n044 987 65 43\n"
+        "Provisorische Buchungsbestätigung (99)\nMietoptionen\n05.05.2032\nKosten\n"
+        "Aula\nAdresse Platz 1\nAdresse Platz 2\n",
+        ["Reservation_2032_05_05_Max Muster_99.pdf"],
+        {"044 987 65 43"},
+        {"Aula"},
+    ),
+    (
+        # a multi-line address block with indented and empty lines
+        MULTI_LINE_ADDRESS_BLOCK,
+        ["Reservation_2033_03_21_Jugendriege Beispiel_4711.pdf"],
+        {
+            "Abteilung Geräteturnen",
+            "Hans Beispiel",
+            "c/o Familie Muster",
+            "Beispielweg 3",
+            "Postfach 12",
+            "3000 Bern 1",
+        },
+        {"Gymnastikraum"},
+    ),
+]
+
+ERRORS = [
+    ("4711\nVerein\nMietoptionen\n07.01.2030\nKosten\n", "No booking ID found!"),
+    (
+        "Verein\nBuchungsbestätigung (4711)\nMietoptionen\n07.01.2030\nKosten\n",
+        "Booking ID does not match start of attachment content!",
+    ),
+    (
+        "4711\nVerein\nBuchungsbestätigung (4711)\nMietoptionen\nKosten\n",
+        "No dates found!",
+    ),
+    (
+        "4711\n"
+        + "".join(f"Zeile {i}\n" for i in range(11))
+        + "Buchungsbestätigung (4711)\nMietoptionen\n07.01.2030\nKosten\n",
+        "Address block is too long!",
+    ),
+]
+
+
+@pytest.mark.parametrize("text, filenames, sensitive_content, locations", CASES)
+def test_find_matches_previous_parser(
+    text: str, filenames: List[str], sensitive_content: Set[str], locations: Set[str]
+) -> None:
+    metas = FindAttachmentMeta().find(text)
+
+    assert sorted(meta.clean_filename for meta in metas) == filenames
+    for meta in metas:
+        assert meta.sensitive_content == sensitive_content
+        assert meta.locations == locations
+
+
+@pytest.mark.parametrize("text, message", ERRORS)
+def test_find_raises_like_previous_parser(text: str, message: str) -> None:
+    with pytest.raises(ClassificationError, match=message):
+        FindAttachmentMeta().find(text)
+
+
+def test_find_views_share_one_parse() -> None:
+    text = CASES[0][0]
+    finder = FindAttachmentMeta()
+
+    assert finder._find_booking_id(text) == "4711"
+    assert finder._find_organization(text, "4711") == "Turnverein Musterdorf"
+    assert finder.parse(text) is finder.parse(text)
+
+
+def test_address_block_keeps_the_line_order() -> None:
+    finder = FindAttachmentMeta()
+
+    assert finder._find_address_block(MULTI_LINE_ADDRESS_BLOCK, "4711") == [
+        "Jugendriege Beispiel",
+        "Abteilung Geräteturnen",
+        "Hans Beispiel",
+        "c/o Familie Muster",
+        "Beispielweg 3",
+        "Postfach 12",
+        "3000 Bern 1",
+    ]
@@ -0,0 +1,73 @@
+import threading
+from types import SimpleNamespace
+from typing import cast
+
+from O365.drive import File
+
+from src.utils.folder_index import FolderIndex
+
+
+def _index(*names: str) -> FolderIndex:
+    return FolderIndex(cast(File, SimpleNamespace(name=name)) for name in names)
+
+
+def test_suffixed_names_share_the_base_name() -> None:
+    index = _index("a_4711.pdf", "a_4711_2.pdf", "b.pdf")
+
+    assert "a_4711.pdf" in index
+    assert len(index) == 3
+    assert [f.name for f in index.items_with_base_name("a_4711")] == [
+        "a_4711.pdf",
+        "a_4711_2.pdf",
+    ]
+    assert index.next_suffix("a_4711") == 3
+    assert index.next_suffix("b") == 1
+
+
+def test_base_names_sharing_a_prefix_do_not_interfere() -> None:
+    index = _index("a_47.pdf", "a_4711_5.pdf")
+
+    assert [f.name for f in index.items_with_base_name("a_47")] == ["a_47.pdf"]
+    assert index.next_suffix("a_47") == 1
+    assert index.next_suffix("a_4711") == 6
+
+
+def test_reserved_names_count_until_released() -> None:
+    index = _index("a.pdf")
+
+    index.reserve("a_1.pdf")
+    assert "a_1.pdf" in index
+    assert index.next_suffix("a") == 2
+    assert [f.name for f in index.items()] == ["a.pdf"]
+
+    index.release("a_1.pdf")
+    assert "a_1.pdf" not in index
+    assert index.next_suffix("a") == 1
+
+
+def test_release_keeps_uploaded_files() -> None:
+    index = _index()
+    index.reserve("a.pdf")
+    index.add(cast(File, SimpleNamespace(name="a.pdf")))
+
+    index.release("a.pdf")
+
+    assert "a.pdf" in index
+
+
+def test_waiters_wake_up_when_a_reservation_is_resolved() -> None:
+    index = _index("a.pdf")
+    index.reserve("a_1.pdf")
+    assert index.has_reservations("a")
+    assert not index.has_reservations("b")
+
+    def upload() -> None:
+        with index.lock:
+            index.add(cast(File, SimpleNamespace(name="a_1.pdf")))
+
+    with index.lock:
+        threading.Thread(target=upload).start()
+        while index.has_reservations("a"):
+            index.wait_for_change()
+
+    assert [f.name for f in index.items_with_base_name("a")] == ["a.pdf", "a_1.pdf"]
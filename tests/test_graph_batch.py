@@ -0,0 +1,153 @@
+import json
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Set, cast
+
+import pytest
+from O365.connection import Connection
+from O365.message import Message
+from requests import Response
+from requests.exceptions import HTTPError
+
+from src.utils.graph_batch import (
+    MAX_BATCH_BODY_BYTES,
+    MAX_BATCH_REQUESTS,
+    BatchRequest,
+    GraphBatchClient,
+    ReadStateBatch,
+)
+
+SERVICE_URL = "https://graph.invalid/v1.0"
+
+
+def _response(status: int, body: Any = None) -> Response:
+    response = Response()
+    response.status_code = status
+    response._content = b"" if body is None else json.dumps(body).encode()
+    return response
+
+
+class FakeConnection:
+    """Answers batches like Graph, failing the requests and calls it is told to."""
+
+    def __init__(self) -> None:
+        self.batches: List[List[str]] = []
+        self.unbatched: List[str] = []
+        # request url -> statuses to answer with, one per attempt
+        self.statuses: Dict[str, List[int]] = {}
+        # indices of batch calls that fail as a whole
+        self.failing_calls: Set[int] = set()
+
+    def post(self, url: str, data: Dict[str, Any]) -> Response:
+        assert url == SERVICE_URL + "/$batch"
+        self.batches.append([request["url"] for request in data["requests"]])
+        if len(self.batches) - 1 in self.failing_calls:
+            raise HTTPError(response=_response(400))
+        responses = [
+            {"id": request["id"], "status": self._status(request["url"])}
+            for request in data["requests"]
+        ]
+        return _response(200, {"responses": responses})
+
+    def oauth_request(
+        self, url: str, method: str, data: Optional[Dict[str, Any]] = None
+    ) -> Response:
+        self.unbatched.append(url)
+        return _response(202)
+
+    def _status(self, url: str) -> int:
+        statuses = self.statuses.get(url)
+        return statuses.pop(0) if statuses else 200
+
+
+@pytest.fixture
+def connection() -> FakeConnection:
+    return FakeConnection()
+
+
+@pytest.fixture
+def client(connection: FakeConnection) -> GraphBatchClient:
+    return GraphBatchClient(
+        cast(Connection, connection), SERVICE_URL, backoff_seconds=0
+    )
+
+
+def _requests(count: int) -> List[BatchRequest]:
+    return [
+        BatchRequest("PATCH", f"/messages/{i}", {"isRead": True}) for i in range(count)
+    ]
+
+
+def test_requests_are_sent_in_chunks(
+    client: GraphBatchClient, connection: FakeConnection
+) -> None:
+    responses = client.execute(_requests(45))
+
+    assert [len(batch) for batch in connection.batches] == [
+        MAX_BATCH_REQUESTS,
+        MAX_BATCH_REQUESTS,
+        5,
+    ]
+    assert all(response.ok for response in responses)
+
+
+def test_only_throttled_requests_are_retried(
+    client: GraphBatchClient, connection: FakeConnection
+) -> None:
+    connection.statuses = {"/messages/1": [429], "/messages/2": [404]}
+
+    responses = client.execute(_requests(3))
+
+    assert connection.batches == [
+        ["/messages/0", "/messages/1", "/messages/2"],
+        ["/messages/1"],
+    ]
+    assert [response.status for response in responses] == [200, 200, 404]
+
+
+def test_a_failed_batch_call_does_not_stop_the_other_chunks(
+    client: GraphBatchClient, connection: FakeConnection
+) -> None:
+    connection.failing_calls = {0}
+
+    responses = client.execute(_requests(25))
+
+    assert len(connection.batches) == 2
+    assert [response.status for response in responses] == [400] * 20 + [200] * 5
+
+
+def test_oversized_requests_are_sent_alone(
+    client: GraphBatchClient, connection: FakeConnection
+) -> None:
+    requests = _requests(2)
+    oversized = {"data": "x" * MAX_BATCH_BODY_BYTES}
+    requests.insert(1, BatchRequest("POST", "/sendMail", oversized))
+
+    responses = client.execute(requests)
+
+    assert connection.batches == [["/messages/0", "/messages/1"]]
+    assert connection.unbatched == [SERVICE_URL + "/sendMail"]
+    assert [response.status for response in responses] == [200, 202, 200]
+
+
+def test_read_state_failures_of_full_batches_are_reported_by_flush(
+    client: GraphBatchClient, connection: FakeConnection
+) -> None:
+    connection.statuses = {"/messages/0": [404], "/messages/2": [404]}
+    read_states = ReadStateBatch(client, flush_size=2)
+    messages = [
+        cast(
+            Message,
+            SimpleNamespace(
+                object_id=str(i), build_url=lambda endpoint: SERVICE_URL + endpoint
+            ),
+        )
+        for i in range(3)
+    ]
+
+    read_states.mark_as_read(messages[0])
+    read_states.mark_as_unread(messages[1])
+    assert len(connection.batches) == 1
+    read_states.mark_as_read(messages[2])
+
+    assert read_states.flush() == 2
+    assert read_states.flush() == 0
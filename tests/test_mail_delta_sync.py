@@ -0,0 +1,128 @@
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+import pytest
+from O365.mailbox import Folder as MailboxFolder
+from requests import HTTPError
+
+from src.utils.mail_delta_sync import MailDeltaSync
+
+FOLDER_URL = "https://graph/me/mailFolders/inbox/messages/delta"
+
+
+class Connection:
+    """Answers delta requests from a script of url -> page (or exception)."""
+
+    def __init__(self) -> None:
+        self.pages: Dict[str, Any] = {}
+        self.requests: List[Tuple[str, Optional[Dict[str, str]]]] = []
+
+    def get(self, url: str, params: Optional[Dict[str, str]], headers: Any) -> Any:
+        self.requests.append((url, params))
+        page = self.pages[url]
+        if isinstance(page, Exception):
+            raise page
+        return SimpleNamespace(json=lambda: page)
+
+
+def _message(parent: Any, **kwargs: Any) -> Any:
+    return SimpleNamespace(object_id=kwargs["cloud_data"]["id"])
+
+
+@pytest.fixture
+def connection() -> Connection:
+    connection = Connection()
+    connection.pages[FOLDER_URL] = {
+        "value": [{"id": "a"}, {"id": "gone", "@removed": {"reason": "deleted"}}],
+        "@odata.nextLink": "next",
+    }
+    connection.pages["next"] = {"value": [{"id": "b"}], "@odata.deltaLink": "delta-1"}
+    connection.pages["delta-1"] = {
+        "value": [{"id": "c"}],
+        "@odata.deltaLink": "delta-2",
+    }
+    return connection
+
+
+@pytest.fixture
+def sync(tmp_path: Path, connection: Connection) -> MailDeltaSync:
+    folder = SimpleNamespace(
+        con=connection,
+        folder_id="inbox",
+        build_url=lambda endpoint: "https://graph/me" + endpoint,
+        message_constructor=_message,
+        _cloud_data_key="cloud_data",
+    )
+    return MailDeltaSync(cast(MailboxFolder, folder), path=str(tmp_path / "delta"))
+
+
+def _ids(sync: MailDeltaSync) -> List[str]:
+    return [message.object_id for message in sync.get_changed_messages()]
+
+
+def test_initial_sync_pages_through_the_folder(
+    sync: MailDeltaSync, connection: Connection
+) -> None:
+    assert _ids(sync) == ["a", "b"]
+    assert [url for url, _ in connection.requests] == [FOLDER_URL, "next"]
+    assert connection.requests[0][1] == {"$select": ",".join(sync.select)}
+    assert connection.requests[1][1] is None
+
+
+def test_delta_link_is_stored_only_on_commit(sync: MailDeltaSync) -> None:
+    assert _ids(sync) == ["a", "b"]
+    assert not sync.path.exists()
+    # not committed, e.g. a message could not be handled: the same changes again
+    assert _ids(sync) == ["a", "b"]
+
+    sync.commit()
+    assert sync.path.read_text() == "delta-1"
+    assert _ids(sync) == ["c"]
+    sync.commit()
+    assert sync.path.read_text() == "delta-2"
+
+
+def test_failed_page_keeps_the_previous_link(
+    sync: MailDeltaSync, connection: Connection
+) -> None:
+    _ids(sync)
+    sync.commit()
+    connection.pages["delta-1"] = {"value": [{"id": "c"}], "@odata.nextLink": "fail"}
+    connection.pages["fail"] = HTTPError("503 Service Unavailable")
+
+    with pytest.raises(HTTPError):
+        sync.get_changed_messages()
+    sync.commit()
+
+    assert sync.path.read_text() == "delta-1"
+
+
+def test_missing_delta_link_fails_the_round(
+    sync: MailDeltaSync, connection: Connection
+) -> None:
+    del connection.pages["next"]["@odata.deltaLink"]
+
+    with pytest.raises(RuntimeError):
+        sync.get_changed_messages()
+    sync.commit()
+
+    assert not sync.path.exists()
+
+
+@pytest.mark.parametrize("stored_link", ["expired", "not a link"])
+def test_reset_after_a_rejected_link_starts_a_full_sync(
+    sync: MailDeltaSync, connection: Connection, stored_link: str
+) -> None:
+    # Graph answers 410 Gone for expired delta tokens and 400 for invalid ones
+    connection.pages["expired"] = HTTPError("410 Gone")
+    connection.pages["not a link"] = HTTPError("400 Bad Request")
+    sync.path.write_text(stored_link)
+
+    with pytest.raises(HTTPError):
+        sync.get_changed_messages()
+    sync.reset()
+
+    assert not sync.path.exists()
+    assert _ids(sync) == ["a", "b"]
+    assert connection.requests[-2][0] == FOLDER_URL
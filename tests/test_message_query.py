@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from typing import Iterable, List, cast
+
+from O365.message import Message
+
+from src.utils.message_query import build_unread_messages_query, process_all_unread
+
+
+def _messages(*ids: str) -> List[Message]:
+    return [cast(Message, SimpleNamespace(object_id=id)) for id in ids]
+
+
+def test_unknown_subjects_are_fetched() -> None:
+    params = build_unread_messages_query().as_params()
+
+    assert "isRead eq false" in params["$filter"]
+    assert "subject" not in params["$filter"]
+    assert "isDraft" in params["$select"].split(",")
+
+
+class Inbox:
+    """Unread messages paged with $skip, processing marks them read."""
+
+    def __init__(self, ids: Iterable[str], page_size: int) -> None:
+        self.unread = list(ids)
+        self.page_size = page_size
+        self.num_queries = 0
+        self.processed: List[str] = []
+
+    def get_unread_messages(self) -> Iterable[Message]:
+        self.num_queries += 1
+        skip = 0
+        while True:
+            page = self.unread[skip : skip + self.page_size]
+            yield from _messages(*page)
+            if len(page) < self.page_size:
+                return
+            skip += self.page_size
+
+    def process(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            self.processed.append(message.object_id)
+            self.unread.remove(message.object_id)
+
+
+def _process(inbox: Inbox) -> None:
+    process_all_unread(
+        inbox.get_unread_messages, inbox.process, page_size=inbox.page_size
+    )
+
+
+def test_a_short_page_takes_a_single_query() -> None:
+    inbox = Inbox(["a", "b"], page_size=3)
+
+    _process(inbox)
+
+    assert inbox.processed == ["a", "b"]
+    assert inbox.num_queries == 1
+
+
+def test_messages_skipped_while_paging_are_fetched_again() -> None:
+    inbox = Inbox([str(i) for i in range(7)], page_size=3)
+
+    _process(inbox)
+
+    assert sorted(inbox.processed) == [str(i) for i in range(7)]
+    assert inbox.unread == []
+    assert inbox.num_queries > 1
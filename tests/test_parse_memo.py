@@ -0,0 +1,105 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.utils.parse_memo import (
+    ParseMemo,
+    ParseMemoEntry,
+    UploadTarget,
+    hash_attachment_text,
+)
+
+TEXT = "4711\nTurnverein Musterdorf\nErika Muster\nTel. 079 123 45 67\n"
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Path:
+    return tmp_path / "parse_memo.jsonl"
+
+
+def _entry(text: str = TEXT) -> ParseMemoEntry:
+    return ParseMemoEntry(
+        booking_id="4711",
+        text_hash=hash_attachment_text(text),
+        upload_targets=[
+            UploadTarget(redacted=True, year=2030, filename="a.pdf", item_id="1")
+        ],
+    )
+
+
+def test_unchanged_text_is_a_hit_after_a_reload(path: Path) -> None:
+    ParseMemo(str(path)).put(_entry())
+
+    memo = ParseMemo(str(path))
+
+    assert memo.get("4711", hash_attachment_text(TEXT)) == _entry()
+
+
+def test_changed_text_or_booking_is_a_miss(path: Path) -> None:
+    memo = ParseMemo(str(path))
+    memo.put(_entry())
+
+    assert memo.get("4711", hash_attachment_text(TEXT + "changed")) is None
+    assert memo.get("815", hash_attachment_text(TEXT)) is None
+    assert "4711" in memo
+    assert "815" not in memo
+
+
+def test_later_versions_win(path: Path) -> None:
+    memo = ParseMemo(str(path))
+    memo.put(_entry())
+    memo.put(_entry(TEXT + "changed"))
+
+    reloaded = ParseMemo(str(path))
+
+    assert reloaded.get("4711", hash_attachment_text(TEXT)) is None
+    assert reloaded.get("4711", hash_attachment_text(TEXT + "changed")) is not None
+
+
+def test_a_version_can_be_claimed_once_until_put_or_released(path: Path) -> None:
+    memo = ParseMemo(str(path))
+    text_hash = hash_attachment_text(TEXT)
+
+    assert memo.claim("4711", text_hash)
+    assert not memo.claim("4711", text_hash)
+    assert memo.claim("4711", hash_attachment_text(TEXT + "changed"))
+
+    memo.release("4711", text_hash)
+    assert memo.claim("4711", text_hash)
+
+    memo.put(_entry())
+    assert memo.claim("4711", text_hash)
+
+
+def test_sensitive_content_is_not_stored(path: Path) -> None:
+    ParseMemo(str(path)).put(_entry())
+
+    stored = path.read_text()
+
+    for line in TEXT.splitlines()[1:]:
+        assert line not in stored
+
+
+def test_stored_metas_are_removed_on_load(path: Path) -> None:
+    data = _entry().to_dict()
+    data["metas"] = [{"sensitive_content": ["Erika Muster"]}]
+    path.write_text(json.dumps(data) + "\n")
+
+    memo = ParseMemo(str(path))
+
+    assert memo.get("4711", hash_attachment_text(TEXT)) == _entry()
+    assert "Erika Muster" not in path.read_text()
+
+
+def test_load_compacts_superseded_lines(path: Path) -> None:
+    memo = ParseMemo(str(path))
+    for i in range(150):
+        memo.put(_entry(TEXT + str(i)))
+    with path.open("a") as f:
+        f.write("not json\n")
+
+    memo = ParseMemo(str(path))
+
+    assert len(path.read_text().splitlines()) == 1
+    assert memo.get("4711", hash_attachment_text(TEXT + "149")) is not None
@@ -0,0 +1,118 @@
+from typing import Any, List, Set
+
+import fitz
+import pytest
+
+from src.utils.pdf_markup import HIGHLIGHT_STROKE, NeedleMatcher, PdfMarkupEngine
+from src.utils.pdf_text_cache import CachedPdfDocument
+from src.utils.typed_pymupdf import _open_empty_pdf
+
+LINES = [
+    "4711",
+    "Erika Muster",
+    "8000 Zürich",
+    "Mehrzweckhalle: Halle A / Dusche",
+    "Adresse Schulhausstrasse 5, 8000 Zürich",
+    "Turnhalle Schulhaus Nord",
+    "Adresse Nordstrasse 1",
+]
+STRINGS_TO_REDACT = {"Erika Muster", "8000 Zürich"}
+STRINGS_TO_HIGHLIGHT = {"Mehrzweckhalle: Halle A / Dusche", "Turnhalle Schulhaus Nord"}
+
+
+def _document(line_height: int) -> CachedPdfDocument:
+    doc = _open_empty_pdf()
+    page: Any = doc.new_page()
+    for i, line in enumerate(LINES):
+        page.insert_text((50, 50 + i * line_height), line, fontsize=10)
+    return CachedPdfDocument(doc)
+
+
+def _highlighted(doc: CachedPdfDocument) -> List[str]:
+    page = doc.page(0)
+    return sorted(
+        page.get_textbox(annot.rect).strip()
+        for annot in page.annots()
+        if tuple(annot.colors["stroke"]) == HIGHLIGHT_STROKE
+    )
+
+
+def _redact_then_highlight(
+    doc: CachedPdfDocument, strings_to_redact: Set[str], strings_to_highlight: Set[str]
+) -> None:
+    """The separate redaction and highlight passes the engine replaces."""
+    page = doc.page(0)
+    for string in strings_to_redact:
+        for rect in page.search_for(string):
+            page.add_redact_annot(rect, fill=(0, 0, 0))
+    page.apply_redactions(images=0)
+    for string in strings_to_highlight:
+        for rect in page.search_for(string):
+            highlight = page.add_highlight_annot(rect)
+            highlight.set_colors(stroke=HIGHLIGHT_STROKE)
+            highlight.update()
+    doc.invalidate()
+
+
+def test_needle_matcher_finds_overlapping_needles() -> None:
+    matcher = NeedleMatcher(["Halle A", "Halle A / Dusche", "Dusche", "Halle B", ""])
+
+    assert matcher.present("Mehrzweckhalle: Halle A / Dusche") == {
+        "Halle A",
+        "Halle A / Dusche",
+        "Dusche",
+    }
+
+
+def test_needle_matcher_ignores_case_and_whitespace() -> None:
+    matcher = NeedleMatcher(["Halle A / Dusche"])
+
+    assert matcher.present("HALLE a  /\nDusche") == {"Halle A / Dusche"}
+    assert matcher.present("Halle A") == set()
+
+
+def test_needle_matcher_finds_what_mupdf_finds() -> None:
+    doc = _document(line_height=13)
+    needles = ["8000 Zürich", "zürich", "Halle", "Dusche Halle", "Muster 8000"]
+
+    found = {needle for needle in needles if doc.search(0, needle)}
+
+    assert found <= NeedleMatcher(needles).present(doc.search_text(0))
+
+
+# 13 puts the lines close enough for their rectangles to overlap
+@pytest.mark.parametrize("line_height", [26, 13])
+def test_markup_matches_separate_passes(line_height: int) -> None:
+    doc = _document(line_height)
+    expected = _document(line_height)
+    _redact_then_highlight(expected, STRINGS_TO_REDACT, STRINGS_TO_HIGHLIGHT)
+
+    PdfMarkupEngine(STRINGS_TO_REDACT, STRINGS_TO_HIGHLIGHT).apply(doc)
+
+    assert _highlighted(doc) == _highlighted(expected)
+    assert len(_highlighted(doc)) == 2
+    assert doc.full_text() == expected.full_text()
+    for string in STRINGS_TO_REDACT:
+        assert string not in doc.full_text()
+
+
+def test_highlights_apart_from_redactions_are_not_searched_again(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    doc = _document(line_height=26)
+    searched: List[str] = []
+    page_type: Any = fitz.Page
+    search_for = page_type.search_for
+
+    def counting_search_for(page: Any, needle: str, *args: Any, **kwargs: Any) -> Any:
+        if kwargs.get("textpage") is None:
+            searched.append(needle)
+        return search_for(page, needle, *args, **kwargs)
+
+    monkeypatch.setattr(page_type, "search_for", counting_search_for)
+
+    PdfMarkupEngine(STRINGS_TO_REDACT, STRINGS_TO_HIGHLIGHT).apply(doc)
+
+    # only the cached text pages were searched
+    assert searched == []
+    assert len(_highlighted(doc)) == 2
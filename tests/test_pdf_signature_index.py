@@ -0,0 +1,69 @@
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from O365.drive import File
+
+from src.utils.pdf_signature_index import PdfSignatureIndex, get_drive_item_version
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Path:
+    return tmp_path / "pdf_signatures.jsonl"
+
+
+def test_entries_survive_a_reload(path: Path) -> None:
+    index = PdfSignatureIndex(str(path))
+    index.put("a", "v1", "hash-a")
+    index.put("b", "v1", "hash-b")
+    index.put("a", "v2", "hash-a2")
+
+    reloaded = PdfSignatureIndex(str(path))
+
+    assert reloaded.get("a", "v2") == "hash-a2"
+    assert reloaded.get("b", "v1") == "hash-b"
+
+
+def test_changed_version_is_a_miss(path: Path) -> None:
+    index = PdfSignatureIndex(str(path))
+    index.put("a", "v1", "hash-a")
+
+    assert index.get("a", "v2") is None
+    assert index.get("b", "v1") is None
+
+
+def test_unchanged_entries_are_not_appended(path: Path) -> None:
+    index = PdfSignatureIndex(str(path))
+    index.put("a", "v1", "hash-a")
+    index.put("a", "v1", "hash-a")
+
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_superseded_lines_are_compacted_on_load(path: Path) -> None:
+    index = PdfSignatureIndex(str(path))
+    for version in range(150):
+        index.put("a", f"v{version}", f"hash-{version}")
+    with path.open("a", encoding="utf-8") as f:
+        f.write("not json\n")
+
+    reloaded = PdfSignatureIndex(str(path))
+
+    assert path.read_text(encoding="utf-8").splitlines() == [
+        '{"id": "a", "version": "v149", "signature": "hash-149"}'
+    ]
+    assert reloaded.get("a", "v149") == "hash-149"
+    assert not path.with_name(path.name + ".tmp").exists()
+
+
+def test_version_changes_with_modification_time_and_size() -> None:
+    def item(modified: datetime, size: int) -> File:
+        return cast(File, SimpleNamespace(modified=modified, size=size))
+
+    version = get_drive_item_version(item(datetime(2030, 1, 7, 18), 100))
+
+    assert version == get_drive_item_version(item(datetime(2030, 1, 7, 18), 100))
+    assert version != get_drive_item_version(item(datetime(2030, 1, 7, 19), 100))
+    assert version != get_drive_item_version(item(datetime(2030, 1, 7, 18), 101))
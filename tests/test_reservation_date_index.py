@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from src.utils.reservation_date_index import (
+    RECONCILE_INTERVAL,
+    IndexedFile,
+    ReservationDateIndex,
+)
+
+FILES = [
+    ("Reservation_2030_01_07_Verein_4711.pdf", IndexedFile("a", None, 1)),
+    ("Reservation_2030_01_07_Verein_4711_1.pdf", IndexedFile("b", None, 2)),
+    ("Reservation_2030_01_14_Verein_4711.pdf", IndexedFile("c", None, 3)),
+]
+NEW_FILE = ("Reservation_2030_01_21_Verein_815.pdf", IndexedFile("d"))
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Path:
+    return tmp_path / "reservation_dates.jsonl"
+
+
+def test_files_are_found_by_date(path: Path) -> None:
+    index = ReservationDateIndex(str(path))
+    index.reconcile(2030, FILES)
+
+    assert sorted(index.files_on_date("2030_01_07")) == [FILES[0][0], FILES[1][0]]
+    assert index.files_on_date("2030_01_21") == {}
+
+
+def test_state_survives_a_reload(path: Path) -> None:
+    index = ReservationDateIndex(str(path))
+    index.reconcile(2030, FILES)
+    index.add(2030, *NEW_FILE)
+    index.reconcile(2031, [])
+    index.invalidate(2031)
+
+    reloaded = ReservationDateIndex(str(path))
+
+    assert reloaded.files_on_date("2030_01_21") == dict([NEW_FILE])
+    assert not reloaded.needs_reconciliation(2030)
+    assert reloaded.needs_reconciliation(2031)
+
+
+def test_reconcile_replaces_the_files_of_the_year(path: Path) -> None:
+    index = ReservationDateIndex(str(path))
+    index.reconcile(2030, FILES)
+    index.reconcile(2030, FILES[2:])
+
+    assert index.files_on_date("2030_01_07") == {}
+    assert list(index.files_on_date("2030_01_14")) == [FILES[2][0]]
+
+
+def test_reconciliation_expires(path: Path) -> None:
+    index = ReservationDateIndex(str(path))
+    assert index.needs_reconciliation(2030)
+
+    index.reconcile(2030, FILES)
+
+    later = datetime.now() + RECONCILE_INTERVAL + timedelta(minutes=1)
+    assert not index.needs_reconciliation(2030)
+    assert index.needs_reconciliation(2030, now=later)
+
+
+def test_file_keeps_one_listing_per_year(path: Path) -> None:
+    index = ReservationDateIndex(str(path))
+    for _ in range(10):
+        index.reconcile(2030, FILES)
+        index.reconcile(2031, [])
+
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    reloaded = ReservationDateIndex(str(path))
+    assert sorted(reloaded.files_on_date("2030_01_07")) == [FILES[0][0], FILES[1][0]]
+
+
+def test_replaced_listings_are_compacted_on_load(path: Path) -> None:
+    ReservationDateIndex(str(path)).reconcile(2030, FILES)
+    listing = path.read_text(encoding="utf-8")
+    # as written before a listing replaced the previous one in the file
+    path.write_text(listing * 5, encoding="utf-8")
+
+    reloaded = ReservationDateIndex(str(path))
+
+    assert path.read_text(encoding="utf-8") == listing
+    assert len(reloaded.files_on_date("2030_01_07")) == 2
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+from typing import Any, Iterator, List, cast
+
+import pytest
+from O365.drive import File, Folder
+
+from src.utils import sharepoint_folders
+from src.utils.sharepoint_folders import FOLDER_CACHE_TTL_SECONDS, SharePointFolderCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(sharepoint_folders, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+@pytest.fixture
+def listings(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+    """The ids of the folders listed through the cache."""
+    listed: List[str] = []
+
+    def get_items(folder: Any) -> Iterator[File]:
+        listed.append(folder.object_id)
+        return iter([cast(File, SimpleNamespace(name="a.pdf"))])
+
+    monkeypatch.setattr(sharepoint_folders, "_get_items", get_items)
+    return listed
+
+
+def _folder(object_id: str) -> Folder:
+    return cast(Folder, SimpleNamespace(object_id=object_id))
+
+
+def test_folder_index_is_listed_once_within_the_ttl(
+    clock: Clock, listings: List[str]
+) -> None:
+    cache = SharePointFolderCache()
+    index = cache.get_folder_index(_folder("2030"))
+
+    clock.now += FOLDER_CACHE_TTL_SECONDS - 1
+
+    assert cache.get_folder_index(_folder("2030")) is index
+    assert listings == ["2030"]
+
+
+def test_folder_index_is_listed_again_after_the_ttl(
+    clock: Clock, listings: List[str]
+) -> None:
+    cache = SharePointFolderCache()
+    index = cache.get_folder_index(_folder("2030"))
+
+    clock.now += FOLDER_CACHE_TTL_SECONDS
+
+    assert cache.get_folder_index(_folder("2030")) is not index
+    assert listings == ["2030", "2030"]
+
+
+def test_failed_lookup_invalidates_the_cache(clock: Clock, listings: List[str]) -> None:
+    cache = SharePointFolderCache()
+    cache.get_folder_index(_folder("2030"))
+    lookups: List[Folder] = []
+
+    def lookup() -> Folder:
+        lookups.append(_folder("2031"))
+        return lookups[-1]
+
+    def fail() -> Folder:
+        raise RuntimeError("not found")
+
+    cache._get_folder((2031, True, False), lookup)
+    with pytest.raises(RuntimeError):
+        cache._get_folder((2032, True, False), fail)
+    cache._get_folder((2031, True, False), lookup)
+    cache.get_folder_index(_folder("2030"))
+
+    assert len(lookups) == 2
+    assert listings == ["2030", "2030"]
+
+
+def test_folders_are_resolved_again_after_the_ttl(clock: Clock) -> None:
+    cache = SharePointFolderCache(ttl_seconds=60)
+    lookups: List[Folder] = []
+
+    def lookup() -> Folder:
+        lookups.append(_folder(str(len(lookups))))
+        return lookups[-1]
+
+    first = cache._get_folder((2030, False, False), lookup)
+    clock.now += 59
+    assert cache._get_folder((2030, False, False), lookup) is first
+    clock.now += 1
+    assert cache._get_folder((2030, False, False), lookup) is not first
+    assert len(lookups) == 2
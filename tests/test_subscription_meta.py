@@ -0,0 +1,120 @@
+import json
+import os
+import random
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Set, Tuple
+
+import pytest
+
+from src.utils.subscription_meta import SubscriptionManager, SubscriptionMeta
+
+EMAILS = [f"user{i}@example.ch" for i in range(6)]
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Path:
+    return tmp_path / "subscription_metas.json"
+
+
+def _random_meta(rng: random.Random) -> SubscriptionMeta:
+    return SubscriptionMeta(
+        email=rng.choice(EMAILS),
+        weekdays=rng.sample(range(7), rng.randint(0, 3)),
+        reminder_lead_days=rng.choice([None, 0, 1, 3]),
+        immediate_notifications=rng.random() < 0.5,
+    )
+
+
+def _indexes(manager: SubscriptionManager) -> Tuple[Any, Any, Counter[int]]:
+    return (
+        {k: set(v) for k, v in manager._notification_emails_by_weekday.items()},
+        {
+            k: set(v)
+            for k, v in manager._reminder_emails_by_weekday_and_lead_days.items()
+        },
+        manager._lead_days_counts,
+    )
+
+
+def _expected_indexes(
+    metas: Dict[str, SubscriptionMeta],
+) -> Tuple[Any, Any, Counter[int]]:
+    notifications: Dict[int, Set[str]] = {}
+    reminders: Dict[Tuple[int, int], Set[str]] = {}
+    lead_days: Counter[int] = Counter()
+    for meta in metas.values():
+        for weekday in meta.weekdays:
+            if meta.immediate_notifications:
+                notifications.setdefault(weekday, set()).add(meta.email)
+            if meta.reminder_lead_days is not None:
+                key = (weekday, meta.reminder_lead_days)
+                reminders.setdefault(key, set()).add(meta.email)
+        if meta.reminder_lead_days is not None:
+            lead_days[meta.reminder_lead_days] += 1
+    return notifications, reminders, lead_days
+
+
+def test_indexes_follow_updates_and_removals(path: Path) -> None:
+    rng = random.Random(4711)
+    manager = SubscriptionManager(str(path))
+
+    for _ in range(200):
+        if rng.random() < 0.3:
+            manager.remove_subscription(rng.choice(EMAILS))
+        else:
+            manager.add_or_update_subscription(_random_meta(rng))
+
+        assert _indexes(manager) == _expected_indexes(dict(manager.subscription_metas))
+    for weekday in range(7):
+        assert set(manager.emails_with_notifications_for_weekday(weekday)) == {
+            meta.email
+            for meta in manager.subscription_metas.values()
+            if meta.immediate_notifications and weekday in meta.weekdays
+        }
+
+
+def test_max_lead_days_drops_removed_subscriptions(path: Path) -> None:
+    manager = SubscriptionManager(str(path))
+    manager.add_or_update_subscription(SubscriptionMeta("a@b.ch", [0], 5))
+    manager.add_or_update_subscription(SubscriptionMeta("c@d.ch", [0], 2))
+    assert manager.max_lead_days == 5
+
+    manager.add_or_update_subscription(SubscriptionMeta("a@b.ch", [0], 1))
+    assert manager.max_lead_days == 2
+
+    manager.remove_subscription("c@d.ch")
+    manager.remove_subscription("a@b.ch")
+    assert manager.max_lead_days == -1
+    assert _indexes(manager) == ({}, {}, Counter())
+
+
+def test_dump_survives_a_reload(path: Path) -> None:
+    manager = SubscriptionManager(str(path))
+    manager.add_or_update_subscription(SubscriptionMeta("a@b.ch", [0, 2], 3, True))
+    manager.add_or_update_subscription(SubscriptionMeta("c@d.ch", [6]))
+    manager.remove_subscription("c@d.ch")
+
+    reloaded = SubscriptionManager(str(path))
+
+    assert dict(reloaded.subscription_metas) == dict(manager.subscription_metas)
+    assert _indexes(reloaded) == _indexes(manager)
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_interrupted_dump_keeps_the_previous_file(
+    path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    manager = SubscriptionManager(str(path))
+    manager.add_or_update_subscription(SubscriptionMeta("a@b.ch", [0]))
+    previous = path.read_text()
+
+    def fail(*args: Any) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        manager.add_or_update_subscription(SubscriptionMeta("c@d.ch", [1]))
+
+    assert path.read_text() == previous
+    assert list(json.loads(previous)) == ["a@b.ch"]